@@ -0,0 +1,5 @@
+// some javascript abbreviations
+//  (i like this better than using some of the other mini js frameworks)
+var qs = document.querySelector.bind(document);
+var qsa = document.querySelectorAll.bind(document);
+var onload = (callback) => document.addEventListener('DOMContentLoaded', callback)
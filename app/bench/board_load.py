@@ -0,0 +1,152 @@
+"""Loads a board with a crowd selecting on it the way it used to be loaded (the game with its cards
+and their selections joined on as objects) and with the plain row queries, counting statements,
+rows and allocations of each and checking both give the same live game
+
+run from the app directory: `python -m bench.board_load --selectors 100`
+the board is made in a new database in a temporary directory
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GAME_CODE = "BENCHB"
+LOADS = 200
+
+
+def make_board(selectors: int):
+    from models.config import Base, db_session, engine
+    from models.game import CARDS_PER_GAME, Card, Game, GameCard, GameCardKind, Selection
+
+    Base.metadata.create_all(engine)
+    kinds = list(GameCardKind)
+    with db_session() as db:
+        db.add(Game(code=GAME_CODE, session_id=1))
+        for index in range(CARDS_PER_GAME):
+            db.add(Card(id=index + 1, phrase=f"phrase {index}"))
+            db.add(
+                GameCard(
+                    card_id=index + 1,
+                    game_code=GAME_CODE,
+                    kind=random.choice(kinds),
+                    index=index,
+                    is_guessed=random.random() < 0.3,
+                )
+            )
+        for selector in range(selectors):
+            card_id = random.randrange(CARDS_PER_GAME) + 1
+            db.add(Selection(token=f"token {selector}", game_code=GAME_CODE, card_id=card_id))
+        db.commit()
+
+
+def load_joined(db):
+    """How a live game was loaded before the read queries"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import joinedload
+    from models.game import Game, GameCard
+    from models.reads import BoardCard, BoardSelection, GameRow
+    from models.store import LiveGame
+
+    game = db.scalar(
+        select(Game)
+        .filter(Game.code == GAME_CODE)
+        .filter(Game.is_claimed)
+        .options(
+            joinedload(Game.cards).joinedload(GameCard.selections),
+            joinedload(Game.cards).joinedload(GameCard.card),
+        )
+    )
+    next_game_code = db.scalar(
+        select(Game.code)
+        .filter(Game.code != game.code)
+        .filter(Game.session_id == game.session_id)
+        .filter(Game.rowid > game.rowid)
+        .filter(Game.is_claimed)
+        .limit(1)
+    )
+    row = GameRow(
+        game.code, game.session_id, game.rowid, game.last_updated, game.version, next_game_code
+    )
+    cards = [
+        BoardCard(
+            card.index, card.rowid, card.card_id, card.card.phrase, card.kind, card.is_guessed
+        )
+        for card in game.cards
+    ]
+    selections = [
+        BoardSelection(selection.token, card.index)
+        for card in game.cards
+        for selection in card.selections
+    ]
+    return LiveGame.from_rows(row, cards, selections)
+
+
+def load_rows(db):
+    from models.store import load_live_game
+
+    return load_live_game(db, GAME_CODE)
+
+
+def state(live_game) -> tuple:
+    return tuple(
+        getattr(live_game, name)
+        for name in live_game.__slots__
+        if name not in ("events", "last_used")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--selectors", type=int, default=100)
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+    from sqlalchemy import event
+    from models.config import db_session, engine
+
+    random.seed(0)
+    make_board(args.selectors)
+    with db_session() as db:
+        assert state(load_joined(db)) == state(load_rows(db)), "the loads differ"
+
+    statements = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, parameters, *_: statements.append((statement, parameters)),
+    )
+    print(f"a board with {args.selectors} people selecting")
+    for name, load in (("joinedload", load_joined), ("row queries", load_rows)):
+        with db_session() as db:
+            statements.clear()
+            load(db)
+            ran = list(statements)
+            # the rows sqlite hands back, run again on their own to count them
+            rows = sum(
+                len(db.connection().exec_driver_sql(statement, parameters).fetchall())
+                for statement, parameters in ran
+            )
+        # a new session each time like a cold load gets
+        tracemalloc.start()
+        with db_session() as db:
+            load(db)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for _ in range(LOADS):
+            with db_session() as db:
+                load(db)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<12} {len(ran)} statements, {rows:4} rows, "
+            f"peak {peak / 1024:6.1f}KiB allocated, {elapsed / LOADS * 1e3:5.2f}ms per load"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Checks a change to one game costs the same to send out no matter how many other games are
+being watched, exiting with an error when broadcasting next to many unrelated games is more than
+`--bound` times slower than broadcasting next to none
+
+run from the app directory: `python -m bench.broadcast_scaling --games 2000 --watchers 4`
+the games are made up in memory and the sockets only count what they're sent, no database is used
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPDATES = 200
+ROUNDS = 5
+TURNS = 3
+
+
+class CountingSocket:
+    """Stands in for a websocket, only counts the frames it's sent"""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, text: str):
+        self.frames += 1
+
+
+async def watch(game_code: str, watchers: int) -> list[CountingSocket]:
+    from typing import cast
+    from starlette.websockets import WebSocket
+    from live.broadcaster import Outbox, subscribe
+    from pages.play import rendered_update
+
+    sockets = []
+    for watcher in range(watchers):
+        socket = CountingSocket()
+        outbox = Outbox(
+            f"{game_code} {watcher}",
+            cast(WebSocket, socket),
+            game_code,
+            lambda since: rendered_update(game_code, since),
+        )
+        subscribe(outbox)
+        outbox.sync(None)
+        sockets.append(socket)
+    return sockets
+
+
+async def drained(sockets: list[CountingSocket], frames: int):
+    while any(socket.frames < frames for socket in sockets):
+        await asyncio.sleep(0)
+
+
+async def broadcast_seconds(others: int, watchers: int) -> float:
+    """Seconds per change of the one game with `others` unrelated games being watched"""
+    from bench.render import make_game
+    from live.broadcaster import subscribers, unsubscribe_game
+    from models.store import live_games
+    from pages.play import _update_game, rendered_updates
+
+    live_games.clear()
+    subscribers.clear()
+    rendered_updates.clear()
+    for other in range(others):
+        game = make_game(f"O{other:05}")
+        live_games[game.code] = game
+        # the other games' watchers are caught up so they're only sitting there like on a server
+        await drained(await watch(game.code, watchers), 1)
+    game = make_game("TARGET")
+    live_games[game.code] = game
+    sockets = await watch(game.code, watchers)
+    await drained(sockets, 1)
+
+    fastest = float("inf")
+    for rounds_done in range(ROUNDS):
+        start = time.perf_counter()
+        for update in range(UPDATES):
+            game.toggle_selection("token", update % len(game.phrases))
+            await _update_game(game.code)
+            await drained(sockets, 2 + rounds_done * UPDATES + update)
+        fastest = min(fastest, (time.perf_counter() - start) / UPDATES)
+    for game_code in list(subscribers):
+        unsubscribe_game(game_code)
+    return fastest
+
+
+async def run(games: int, watchers: int) -> tuple[float, float]:
+    alone = crowded = float("inf")
+    # taking turns so neither side is always the one that warmed things up
+    for _ in range(TURNS):
+        alone = min(alone, await broadcast_seconds(0, watchers))
+        crowded = min(crowded, await broadcast_seconds(games, watchers))
+    return alone, crowded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--watchers", type=int, default=4)
+    parser.add_argument(
+        "--bound", type=float, default=1.5, help="how many times slower is still flat"
+    )
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+
+    alone, crowded = asyncio.run(run(args.games, args.watchers))
+    ratio = crowded / alone
+    print(f"watchers per game: {args.watchers}")
+    print(f"broadcast alone: {alone * 1e6:.1f}us")
+    print(f"broadcast with {args.games} other games: {crowded * 1e6:.1f}us")
+    print(f"ratio: {ratio:.2f} (bound {args.bound:.2f})")
+    if ratio > args.bound:
+        sys.exit(f"broadcasting got {ratio:.2f} times slower with {args.games} other games")
+    print("broadcast cost stayed flat")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Starts two workers sharing one database over the sqlite bus and checks that a change made on one
+reaches the sockets connected to the other, along with how long it took
+
+run from the app directory: `python -m bench.bus --rounds 20`
+needs a loaded `cards.db`, the workers use a copy of it so the games made here don't stay around
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from bench.helpers import free_port, wait_until_up
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAME_TIMEOUT_SECONDS = 5
+
+
+def start_worker(directory: str, port: int) -> subprocess.Popen:
+    env = os.environ | {"CODENAMES_BUS": "sqlite"}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", APP_DIR, "--port", str(port)],
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def frame_at(ws, version: int) -> str:
+    """Reads frames until one brings the socket up to at least the version"""
+    while True:
+        frame = await asyncio.wait_for(ws.recv(), FRAME_TIMEOUT_SECONDS)
+        versions = [int(v) for v in re.findall(r'data-version="(\d+)"', frame)]
+        if versions and max(versions) >= version:
+            return frame
+
+
+async def run(rounds: int, urls: list[str]):
+    import httpx
+    import websockets
+
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            await wait_until_up(client, url)
+        first, second = urls
+        page = (await client.get(f"{first}/play")).text
+        tags = re.findall(r'name="tag-(\d+)"', page)
+        made = await client.post(f"{first}/play", data={"tags": tags, "dummy_value": "1"})
+        game_code = made.headers["hx-redirect"].rsplit("/", 1)[1]
+        role = {"role": "game_role_spymaster"}
+        page = (await client.get(f"{first}/play/{game_code}", params=role)).text
+        card_ids = re.findall(r"game_card_id&quot;: (\d+)|\"game_card_id\": (\d+)", page)
+        card_ids = [a or b for a, b in card_ids]
+        found_version = re.search(r'data-version="(\d+)"', page)
+        assert found_version is not None, "the game page has no version"
+        version = int(found_version.group(1))
+        sockets = []
+        for url in urls:
+            ws_url = url.replace("http", "ws", 1) + f"/play-connect/{game_code}"
+            ws = await websockets.connect(ws_url)
+            await ws.send(json.dumps({"version": version}))
+            sockets.append(ws)
+
+        latencies = []
+        for round in range(min(rounds, len(card_ids))):
+            # guesses go in on the first worker and selections on the second, each is checked
+            #    on the other worker's socket
+            url, ws = (first, sockets[1]) if round % 2 == 0 else (second, sockets[0])
+            action = "guess_card" if round % 2 == 0 else "select_card"
+            start = time.perf_counter()
+            response = await client.post(
+                f"{url}/partials/{action}/{game_code}", data={"game_card_id": card_ids[round]}
+            )
+            assert response.status_code == 200, response.text
+            version += 1
+            frame = await frame_at(ws, version)
+            latencies.append(time.perf_counter() - start)
+            if action == "guess_card":
+                assert "text-decoration-line-through" in frame, frame
+            else:
+                assert "selections" in frame, frame
+        for ws in sockets:
+            await ws.close()
+    latencies.sort()
+    print(f"game {game_code}, {len(latencies)} changes each seen on the other worker")
+    print(
+        f"latency median {latencies[len(latencies) // 2] * 1e3:.1f}ms, "
+        f"max {latencies[-1] * 1e3:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    database = os.path.join(os.getcwd(), "cards.db")
+    if not os.path.exists(database):
+        sys.exit("no cards.db here, load the database and cards first")
+    directory = tempfile.mkdtemp()
+    for suffix in ("", "-wal"):
+        if os.path.exists(database + suffix):
+            shutil.copy(database + suffix, directory)
+    # the new table for the bus if the database is older than it
+    subprocess.run(
+        [sys.executable, os.path.join(APP_DIR, "manage.py"), "migrate"],
+        cwd=directory,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    ports = [free_port(), free_port()]
+    workers = [start_worker(directory, port) for port in ports]
+    try:
+        asyncio.run(run(args.rounds, [f"http://127.0.0.1:{port}" for port in ports]))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+
+
+if __name__ == "__main__":
+    main()
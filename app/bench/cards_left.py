@@ -0,0 +1,118 @@
+"""Checks the cards left each session keeps in memory match counting them again from the database
+as games are made (starting from a counted session and from one that hasn't been counted yet),
+turned down and given back, exiting with an error when any of them don't
+
+run from the app directory: `python -m bench.cards_left`
+the games are made on a new database in a temporary directory
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# two games and then some, the third game is turned down
+TAG_CARDS = 60
+
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+    from models.codes import allocate_game_code
+    from models.config import Base, db_session, engine
+    from models.errors import NotEnoughCards
+    from models.game import (
+        CARDS_PER_GAME,
+        Card,
+        Session,
+        SessionTagGrouper,
+        Tag,
+        TagCardGrouper,
+        count_cards_left,
+        current_card_index,
+        session_cards_left,
+        session_tag_ids,
+        session_used_cards,
+    )
+    from models.upcoming import claim_game, make_upcoming_game, release_upcoming_games
+
+    Base.metadata.create_all(engine)
+    problems = []
+
+    with db_session() as db:
+        tag = Tag(name="cards left")
+        db.add(tag)
+        db.add_all(Card(id=i + 1, phrase=f"phrase {i}") for i in range(TAG_CARDS))
+        db.flush()
+        db.add_all(TagCardGrouper(tag_id=tag.id, card_id=i + 1) for i in range(TAG_CARDS))
+        db.commit()
+        tag_id = tag.id
+
+        def new_session() -> Session:
+            game_session = Session()
+            db.add(game_session)
+            db.flush()
+            db.add(SessionTagGrouper(session_id=game_session.id, tag_id=tag_id))
+            db.commit()
+            return game_session
+
+        def check(step: str, session_id: int):
+            index = current_card_index(db)
+            kept = index.sessions_cards_left.get(session_id)
+            used = session_used_cards(db, session_id)
+            counted = count_cards_left(index, session_tag_ids(db, session_id), used)
+            line = f"{step:<44} kept {str(kept):>4} counted {counted:>4}"
+            if kept is not None and kept != counted:
+                problems.append(f"{step} kept {kept} cards left but there are {counted}")
+                line += "  WRONG"
+            print(line)
+
+        def make_game(step: str, game_session: Session):
+            try:
+                game_session.create_game(db, allocate_game_code())
+            except NotEnoughCards:
+                step += " (not enough cards)"
+            check(step, game_session.id)
+
+        # nothing kept about the session until its first game
+        cold = new_session()
+        for game in range(TAG_CARDS // CARDS_PER_GAME + 1):
+            make_game(f"uncounted session game {game + 1}", cold)
+
+        # counted before its first game like the continue route does
+        counted = new_session()
+        session_cards_left(db, counted.id)
+        check("counted session", counted.id)
+        for game in range(TAG_CARDS // CARDS_PER_GAME + 1):
+            make_game(f"counted session game {game + 1}", counted)
+
+        # a session can always make its next game while it says there are enough cards left
+        upcoming = new_session()
+        while session_cards_left(db, upcoming.id) >= CARDS_PER_GAME:
+            game_code = make_upcoming_game(db, upcoming.id)
+            if game_code is None:
+                problems.append("the next game was turned down with enough cards left")
+                break
+            check("next game made in the background", upcoming.id)
+            claim_game(db, game_code)
+            db.commit()
+
+        # an unclaimed game's cards are given back and the session is counted again
+        given_back = new_session()
+        make_game("game before giving one back", given_back)
+        make_upcoming_game(db, given_back.id)
+        check("next game before giving it back", given_back.id)
+        release_upcoming_games(db, datetime.now() + timedelta(days=1))
+        session_cards_left(db, given_back.id)
+        check("after giving it back", given_back.id)
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(f"{len(problems)} problems")
+    print("every kept count matched")
+
+
+if __name__ == "__main__":
+    main()
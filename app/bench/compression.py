@@ -0,0 +1,80 @@
+"""Bytes that go out for every guess on a board with a room full of viewers, as is and compressed
+the way the server now compresses them
+
+run from the app directory: `python -m bench.compression --viewers 50`
+the websocket frames are compressed exactly like permessage-deflate does (one raw deflate stream
+per socket that keeps its window between frames) rather than going over a real socket
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import tempfile
+import zlib
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# a websocket frame header for a payload between 126 and 65535 bytes
+FRAME_HEADER_SIZE = 4
+
+
+class PerMessageDeflate:
+    def __init__(self, level: int, memory_level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, memory_level)
+
+    def encode(self, text: str) -> bytes:
+        data = self.compressor.compress(text.encode()) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        # the empty block every sync flush ends with isn't sent
+        return data[:-4]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--viewers", type=int, default=50)
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+    from fasthtml.common import to_xml
+    from starlette.requests import Request
+    from bench.render import make_game
+    from live.deflate import WS_COMPRESSION_LEVEL, WS_COMPRESSION_MEMORY_LEVEL
+    from make_app import GZIP_LEVEL
+    from models.game import CARDS_PER_GAME
+    from pages.play import GamePage, GameRole, fast_updated_game
+
+    random.seed(0)
+    game = make_game("BENCHG")
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+    page = to_xml(GamePage(request, game, repr(GameRole.OPERATIVE))).encode()
+    print(
+        f"board page {len(page):,} bytes, gzip level {GZIP_LEVEL} "
+        f"{len(gzip.compress(page, GZIP_LEVEL)):,} bytes"
+    )
+
+    # every viewer gets the same frames so one socket's stream stands in for all of them
+    socket = PerMessageDeflate(WS_COMPRESSION_LEVEL, WS_COMPRESSION_MEMORY_LEVEL)
+    whole_game = fast_updated_game(game)
+    socket.encode(whole_game)
+    plain = compressed = 0
+    guesses = list(range(CARDS_PER_GAME))
+    random.shuffle(guesses)
+    for index in guesses:
+        # someone points at the card and then it's guessed, each its own frame
+        for change in (lambda: game.toggle_selection("token", index), lambda: game.guess(index)):
+            version = game.version
+            change()
+            frame = fast_updated_game(game, game.events.since(version, game.version))
+            plain += len(frame.encode()) + FRAME_HEADER_SIZE
+            compressed += len(socket.encode(frame)) + FRAME_HEADER_SIZE
+    guess_count = len(guesses)
+    print(f"{args.viewers} viewers, {guess_count} guesses with a selection before each")
+    print(
+        f"per guess: {plain / guess_count * args.viewers:,.0f} bytes as is, "
+        f"{compressed / guess_count * args.viewers:,.0f} bytes with permessage-deflate level "
+        f"{WS_COMPRESSION_LEVEL} ({compressed / plain:.0%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
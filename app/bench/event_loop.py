@@ -0,0 +1,94 @@
+"""Measures how long the event loop is stalled while many people click at once
+
+run from the app directory: `python -m bench.event_loop --games 20 --clicks 400`
+a scratch database is made in a temporary directory so cards.db is never touched
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEARTBEAT_SECONDS = 0.001
+
+
+async def heartbeat(lateness: list[float], stop: asyncio.Event):
+    # anything the loop does between two ticks that isn't sleeping shows up as lateness
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + HEARTBEAT_SECONDS
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        lateness.append(max(0.0, loop.time() - expected))
+
+
+async def run(games: int, clicks: int):
+    import httpx
+    from make_app import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        page = await client.get("/play")
+        tag_ids = re.findall(r'name="tag-(\d+)"', page.text)
+        boards = []
+        for _ in range(games):
+            made = await client.post("/play", data={"tags": tag_ids, "dummy_value": "1"})
+            game_code = made.headers["hx-redirect"].rsplit("/", 1)[1]
+            board = await client.get(f"/play/{game_code}", params={"role": "game_role_viewer"})
+            card_ids = re.findall(r"game_card_id\W+(\d+)", board.text)
+            boards.append((game_code, card_ids))
+
+        lateness: list[float] = []
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(lateness, stop))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[
+                client.post(
+                    f"/partials/select_card/{boards[i % games][0]}",
+                    data={"game_card_id": boards[i % games][1][i % len(boards[i % games][1])]},
+                )
+                for i in range(clicks)
+            ]
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+
+    lateness.sort()
+    print(f"clicks: {clicks} over {games} games in {elapsed:.3f}s")
+    print(f"heartbeats: {len(lateness)} (ideal {int(elapsed / HEARTBEAT_SECONDS)})")
+    print(f"stall max: {lateness[-1] * 1000:.1f}ms")
+    print(f"stall p99: {lateness[int(len(lateness) * 0.99)] * 1000:.1f}ms")
+    print(f"stall mean: {statistics.fmean(lateness) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--clicks", type=int, default=400)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+    import manage
+
+    # manage turns on statement logging which would be measured along with everything else
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+    manage.BASE_CARDS_DIR = os.path.join(APP_DIR, manage.BASE_CARDS_DIR)
+    manage.simple_create_database()
+    manage.create_default_words()
+    # importing the pages registers the routes
+    import pages  # noqa: F401
+
+    asyncio.run(run(args.games, args.clicks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""What several of the benchmarks share, a free port to start a server on, waiting for it to answer
+and a new database with a tag of made up phrases
+
+the database is made in the current directory so call `make_database` after moving to a temporary
+one and putting the app directory on the path
+"""
+
+import asyncio
+import socket
+import time
+
+START_TIMEOUT_SECONDS = 30
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(client, url: str):
+    deadline = time.monotonic() + START_TIMEOUT_SECONDS
+    while True:
+        try:
+            await client.get(url)
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def make_database(tag_name: str, phrases: int) -> int:
+    """Makes every table and a tag with `phrases` made up phrases, returns the tag's id"""
+    # registers the game code table so create_all makes it
+    import models.codes  # noqa: F401
+    from models.config import Base, db_session, engine
+    from models.game import Card, Tag, TagCardGrouper
+
+    Base.metadata.create_all(engine)
+    with db_session() as db:
+        tag = Tag(name=tag_name)
+        db.add(tag)
+        db.add_all(Card(id=i + 1, phrase=f"phrase {i}") for i in range(phrases))
+        db.flush()
+        db.add_all(TagCardGrouper(tag_id=tag.id, card_id=i + 1) for i in range(phrases))
+        db.commit()
+        return tag.id
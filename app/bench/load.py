@@ -0,0 +1,378 @@
+"""Puts the server under the load of several games being played at once in front of a crowd of
+viewers each and reports how long a click takes to reach the viewers' sockets
+
+run from the app directory: `python -m bench.load --games 10 --viewers 20 --duration 30`
+a server is started on localhost on a new database of made up phrases, the boards come from
+`--seed` so runs with the same flags play the same boards and can be compared, `--url` points it
+at a server that's already running instead (only a started server's cpu and memory are reported)
+the results are json (`--out` to write them to a file) so runs can be diffed across commits
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAG_NAME = "load"
+# how long the switch to the next game waits for the viewers to see it
+FRAME_TIMEOUT_SECONDS = 5
+RESOURCE_SAMPLE_SECONDS = 0.5
+VERSION_PATTERN = re.compile(r'data-version="(\d+)"')
+CARD_ID_PATTERN = re.compile(r"game_card_id&quot;: (\d+)|\"game_card_id\": (\d+)")
+
+
+def make_seeded_games(phrases: int, games: int, seed: int) -> list[tuple[int, str]]:
+    """A pack of made up phrases and a session with a game for every game that's played, returns
+    the session id and code of each game"""
+    from bench.helpers import make_database
+    from models.codes import allocate_game_code
+    from models.config import db_session
+    from models.game import Session, SessionTagGrouper
+
+    tag_id = make_database(TAG_NAME, phrases)
+    random.seed(seed)
+    with db_session() as db:
+        sessions = [Session() for _ in range(games)]
+        db.add_all(sessions)
+        db.flush()
+        db.add_all(SessionTagGrouper(session_id=s.id, tag_id=tag_id) for s in sessions)
+        db.commit()
+        played = []
+        for game_session in sessions:
+            game = game_session.create_game(db, allocate_game_code())
+            played.append((game_session.id, game.code))
+    return played
+
+
+def serve(port: int):
+    """What `main.py` runs minus the reloader"""
+    import uvicorn
+    from live.deflate import DeflateWebSocketProtocol
+
+    uvicorn.run(
+        "main:app",
+        host="127.0.0.1",
+        port=port,
+        log_level="warning",
+        ws=DeflateWebSocketProtocol,
+        ws_per_message_deflate=True,
+    )
+
+
+class ServerResources:
+    """Cpu time and memory of the server process, read from /proc"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        # utime and stime are the 14th and 15th fields counting the pid and name
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss(self) -> int:
+        with open(f"/proc/{self.pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def sample(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            await asyncio.sleep(RESOURCE_SAMPLE_SECONDS)
+
+
+def percentile(ordered: list[float], fraction: float) -> float | None:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Stats:
+    def __init__(self):
+        self.measuring = False
+        self.clicks = 0
+        self.frames = 0
+        self.errors = 0
+        # seconds from a click being sent to each viewer's socket getting the frame with it
+        self.latencies: list[float] = []
+        self.missed = 0
+
+
+class PlayedGame:
+    """One game being clicked on by one player and watched by the viewers"""
+
+    def __init__(self, client, url: str, session_id: int, code: str, seed: int, stats: Stats):
+        self.client = client
+        self.url = url
+        self.session_id = session_id
+        self.random = random.Random(seed)
+        self.stats = stats
+        self.code = code
+        self.card_ids: list[str] = []
+        self.guessed: set[str] = set()
+        self.version = 0
+        # version -> when the click that makes it was sent
+        self.sent: dict[int, float] = {}
+        # the newest version each viewer has seen
+        self.seen: list[int] = []
+        self.viewers: list[asyncio.Task] = []
+
+    async def open(self, viewers: int):
+        import websockets
+
+        page = await self.client.get(
+            f"{self.url}/play/{self.code}", params={"role": "game_role_operative"}
+        )
+        self.card_ids = [a or b for a, b in CARD_ID_PATTERN.findall(page.text)]
+        found = VERSION_PATTERN.search(page.text)
+        assert found is not None, "the game page has no version"
+        self.version = int(found.group(1))
+        self.guessed = set()
+        self.sent = {}
+        self.seen = [self.version] * viewers
+        ws_url = self.url.replace("http", "ws", 1) + f"/play-connect/{self.code}"
+        sockets = [await websockets.connect(ws_url) for _ in range(viewers)]
+        for ws in sockets:
+            await ws.send(json.dumps({"version": self.version}))
+        self.viewers = [
+            asyncio.create_task(self.watch(viewer, ws)) for viewer, ws in enumerate(sockets)
+        ]
+
+    async def close(self):
+        for task in self.viewers:
+            task.cancel()
+        await asyncio.gather(*self.viewers, return_exceptions=True)
+        # clicks are only made while measuring
+        for seen in self.seen:
+            self.stats.missed += sum(1 for version in self.sent if version > seen)
+
+    async def watch(self, viewer: int, ws):
+        try:
+            async for frame in ws:
+                received = time.perf_counter()
+                versions = [int(v) for v in VERSION_PATTERN.findall(frame)]
+                if not versions or not self.stats.measuring:
+                    self.seen[viewer] = max(versions, default=self.seen[viewer])
+                    continue
+                self.stats.frames += 1
+                newest = max(versions)
+                for version in range(self.seen[viewer] + 1, newest + 1):
+                    sent = self.sent.get(version)
+                    if sent is not None:
+                        self.stats.latencies.append(received - sent)
+                self.seen[viewer] = max(self.seen[viewer], newest)
+        finally:
+            await ws.close()
+
+    async def click(self, guess_chance: float, guesses_per_game: int):
+        if len(self.guessed) >= min(guesses_per_game, len(self.card_ids)):
+            await self.next_game()
+            return
+        card_id = self.random.choice(self.card_ids)
+        action = "select_card"
+        if card_id not in self.guessed and self.random.random() < guess_chance:
+            action = "guess_card"
+            self.guessed.add(card_id)
+        await self.post(f"/partials/{action}/{self.code}", {"game_card_id": card_id})
+
+    async def post(self, path: str, data: dict):
+        self.version += 1
+        self.sent[self.version] = time.perf_counter()
+        response = await self.client.post(f"{self.url}{path}", data=data)
+        if self.stats.measuring:
+            self.stats.clicks += 1
+        if response.status_code != 200:
+            self.stats.errors += 1
+        return response
+
+    async def next_game(self):
+        response = await self.post(
+            "/continue_game", {"game_code": self.code, "session_id": self.session_id}
+        )
+        redirect = response.headers.get("hx-redirect")
+        if redirect is None:
+            # most likely out of cards, the same game keeps being played
+            self.stats.errors += 1
+            self.guessed.clear()
+            return
+        deadline = time.monotonic() + FRAME_TIMEOUT_SECONDS
+        while min(self.seen) < self.version and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        viewers = len(self.viewers)
+        await self.close()
+        self.code = redirect.rsplit("/", 1)[1]
+        await self.open(viewers)
+
+    async def play(self, rate: float, until: float, guess_chance: float, guesses_per_game: int):
+        start = time.monotonic()
+        clicks = 0
+        while time.monotonic() < until:
+            # clicks keep to the rate they were meant to go at even when one runs long
+            delay = start + clicks / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            clicks += 1
+            try:
+                await self.click(guess_chance, guesses_per_game)
+            except Exception as err:
+                self.stats.errors += 1
+                print(err, file=sys.stderr)
+
+
+async def run(args, url: str, played: list[tuple[int, str]], server_pid: int | None) -> dict:
+    import httpx
+    from bench.helpers import wait_until_up
+
+    stats = Stats()
+    resources = None if server_pid is None else ServerResources(server_pid)
+    # a client per game so each player has their own site token
+    clients = [httpx.AsyncClient(timeout=30) for _ in played]
+    await wait_until_up(clients[0], url)
+    games = [
+        PlayedGame(client, url, session_id, code, args.seed + g, stats)
+        for g, (client, (session_id, code)) in enumerate(zip(clients, played))
+    ]
+    for game in games:
+        await game.open(args.viewers)
+    sampler = None if resources is None else asyncio.create_task(resources.sample())
+    stats.measuring = True
+    cpu_start = None if resources is None else resources.cpu_seconds()
+    start = time.monotonic()
+    until = start + args.duration
+    await asyncio.gather(
+        *(game.play(args.rate, until, args.guess_chance, args.guesses_per_game) for game in games)
+    )
+    # the last clicks get a moment to reach everyone
+    await asyncio.sleep(0.5)
+    stats.measuring = False
+    elapsed = time.monotonic() - start
+    cpu = None if resources is None or cpu_start is None else resources.cpu_seconds() - cpu_start
+    if sampler is not None:
+        sampler.cancel()
+    for game in games:
+        await game.close()
+    for client in clients:
+        await client.aclose()
+
+    latencies = sorted(stats.latencies)
+    results = {
+        "clicks": stats.clicks,
+        "clicks_per_second": round(stats.clicks / elapsed, 2),
+        "frames": stats.frames,
+        "frames_per_second": round(stats.frames / elapsed, 2),
+        "latency_ms": {
+            name: None if value is None else round(value * 1e3, 2)
+            for name, value in (
+                ("p50", percentile(latencies, 0.5)),
+                ("p95", percentile(latencies, 0.95)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+        "missed_updates": stats.missed,
+        "errors": stats.errors,
+    }
+    if resources is not None and cpu is not None:
+        results["server"] = {
+            "cpu_seconds": round(cpu, 2),
+            "cpu_percent": round(cpu / elapsed * 100, 1),
+            "rss_mib": round(resources.rss() / 2**20, 1),
+            "peak_rss_mib": round(resources.peak_rss / 2**20, 1),
+        }
+    return results
+
+
+async def make_games(url: str, games: int) -> list[tuple[int, str]]:
+    """Games made through the pages of a server that's already running, their boards are up to
+    that server"""
+    import httpx
+
+    played = []
+    async with httpx.AsyncClient(timeout=30) as client:
+        page = (await client.get(f"{url}/play")).text
+        tags = re.findall(r'name="tag-(\d+)"', page)
+        for _ in range(games):
+            made = await client.post(f"{url}/play", data={"tags": tags, "dummy_value": "1"})
+            code = made.headers["hx-redirect"].rsplit("/", 1)[1]
+            page = await client.get(f"{url}/play/{code}", params={"role": "game_role_operative"})
+            session_id = re.search(r"session_id&quot;: (\d+)|\"session_id\": (\d+)", page.text)
+            assert session_id is not None, "the game page has no session id"
+            played.append((int(session_id.group(1) or session_id.group(2)), code))
+    return played
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=APP_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--viewers", type=int, default=20, help="sockets watching each game")
+    parser.add_argument("--rate", type=float, default=2, help="clicks per second on each game")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to click for")
+    parser.add_argument("--guess-chance", type=float, default=0.3)
+    parser.add_argument(
+        "--guesses-per-game", type=int, default=12, help="guesses before moving to the next game"
+    )
+    parser.add_argument("--phrases", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="a running server to use instead of starting one")
+    parser.add_argument("--out", help="file to write the json results to")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sys.path.insert(0, APP_DIR)
+    if args.serve is not None:
+        serve(args.serve)
+        return
+
+    if args.out:
+        args.out = os.path.abspath(args.out)
+    server = None
+    if args.url is None:
+        os.chdir(tempfile.mkdtemp())
+        from bench.helpers import free_port
+
+        played = make_seeded_games(args.phrases, args.games, args.seed)
+        port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)])
+        url = f"http://127.0.0.1:{port}"
+    else:
+        url = args.url.rstrip("/")
+        played = asyncio.run(make_games(url, args.games))
+    try:
+        results = asyncio.run(run(args, url, played, None if server is None else server.pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    config = {name: value for name, value in vars(args).items() if name not in ("out", "serve")}
+    output = json.dumps({"commit": git_commit(), "config": config, **results}, indent=2)
+    if args.out:
+        with open(args.out, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Times the functions performance work keeps touching and compares them against the times saved in
+`bench/baseline.json`, exiting with an error when any of them got slower than the threshold allows
+
+run from the app directory: `python -m bench.micro` (or `python -m bench.micro render_ load_`
+for only the benchmarks starting with those)
+`--save` writes the times as the new baseline, a baseline only means something on the machine (and
+python) it was saved on so save one before changing anything when comparing on a different machine
+every benchmark is timed in several rounds, the fastest round is compared against the baseline's and
+how far the median round was from the fastest (on either side) is added to the threshold so a noisy
+benchmark needs to get slower by more than its own noise to fail
+everything runs on a new database in a temporary directory
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable
+from bench.helpers import make_database
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(APP_DIR, "bench", "baseline.json")
+# a benchmark that takes this much more time than its baseline fails
+DEFAULT_THRESHOLD = 0.25
+# calls are timed in rounds at least this long, the fastest round is what counts
+ROUND_SECONDS = 0.2
+ROUNDS = 9
+# a benchmark past its allowance is timed again this many times before it counts as slower, a slow
+#    stretch of the whole machine looks just like a regression for one run
+RECHECKS = 2
+PACK_SIZES = (1_000, 10_000)
+PHRASES = 5_000
+SELECTORS = 20
+
+
+@dataclass
+class Benchmark:
+    name: str
+    run: Callable[[], object]
+    # how many calls a round is, None to work it out from ROUND_SECONDS
+    calls: int | None = None
+    rounds: int = ROUNDS
+
+
+def calls_per_round(run: Callable[[], object]) -> int:
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        if time.perf_counter() - start >= ROUND_SECONDS:
+            return calls
+        calls *= 2
+
+
+@dataclass
+class Timing:
+    fastest_us: float
+    median_us: float
+
+    @property
+    def noise(self) -> float:
+        """How much slower the median round was than the fastest, 0.1 is 10%"""
+        return self.median_us / self.fastest_us - 1
+
+
+def time_benchmark(benchmark: Benchmark) -> Timing:
+    """Microseconds per call of the fastest and the median round"""
+    calls = benchmark.calls or calls_per_round(benchmark.run)
+    rounds = []
+    for _ in range(benchmark.rounds):
+        # like timeit, a collection landing in one round but not another is only noise
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(calls):
+                benchmark.run()
+            rounds.append((time.perf_counter() - start) / calls * 1e6)
+        finally:
+            gc.enable()
+    return Timing(min(rounds), statistics.median(rounds))
+
+
+def allowed_change(timing: Timing, saved: Timing, threshold: float) -> float:
+    """How much slower than the baseline still passes, the threshold plus the noisier run's noise"""
+    return threshold + max(timing.noise, saved.noise)
+
+
+def session_benchmarks(tag_id: int) -> list[Benchmark]:
+    from models.codes import allocate_game_code
+    from models.config import db_session
+    from models.errors import NotEnoughCards
+    from models.game import Selection, Session, SessionTagGrouper
+    from models.store import load_live_game
+
+    def new_session(db) -> int:
+        game_session = Session()
+        db.add(game_session)
+        db.flush()
+        db.add(SessionTagGrouper(session_id=game_session.id, tag_id=tag_id))
+        db.commit()
+        return game_session.id
+
+    with db_session() as db:
+        session_ids = [new_session(db)]
+
+    def create_game():
+        with db_session() as db:
+            game_session = db.get(Session, session_ids[-1])
+            assert game_session is not None
+            try:
+                return game_session.create_game(db, allocate_game_code())
+            except NotEnoughCards:
+                # every card of the session was used, the game goes in a new one
+                session_ids.append(new_session(db))
+
+    with db_session() as db:
+        game_session = db.get(Session, session_ids[0])
+        assert game_session is not None
+        game = game_session.create_game(db, allocate_game_code())
+        # another game after it so it has a next game to find
+        game_session.create_game(db, allocate_game_code())
+        code = game.code
+        card_ids = [card.card_id for card in game.cards]
+        for selector in range(SELECTORS):
+            card_id = random.choice(card_ids)
+            db.add(Selection(token=f"token {selector}", game_code=code, card_id=card_id))
+        db.commit()
+
+    def load_game():
+        with db_session() as db:
+            return load_live_game(db, code)
+
+    return [
+        Benchmark("create_game", create_game),
+        Benchmark("load_live_game", load_game),
+    ]
+
+
+def render_benchmarks() -> list[Benchmark]:
+    from fasthtml.common import to_xml
+    from bench.render import make_game
+    from models.events import GameEventKind
+    from pages.play import (
+        CardBoard,
+        GameBoard,
+        NextGameButton,
+        Selections,
+        fast_updated_game,
+        updated_game,
+    )
+
+    game = make_game("MICROG")
+    for index in random.sample(range(len(game.phrases)), 8):
+        game.guess(index)
+    for selector in range(SELECTORS):
+        game.toggle_selection(f"token {selector}", random.randrange(len(game.phrases)))
+    game.set_next_game("NEXTGM")
+    # a single selection like most updates are
+    version = game.version
+    game.toggle_selection("token", next(i for i, g in enumerate(game.guessed) if not g))
+    events = game.events.since(version, game.version)
+    assert events is not None and events[0].kind == GameEventKind.SELECT
+
+    return [
+        Benchmark("render_updated_game_whole", lambda: to_xml(updated_game(game))),
+        Benchmark("render_updated_game_select", lambda: to_xml(updated_game(game, events))),
+        Benchmark("render_fast_updated_game_whole", lambda: fast_updated_game(game)),
+        Benchmark("render_fast_updated_game_select", lambda: fast_updated_game(game, events)),
+        Benchmark("render_game_board", lambda: to_xml(GameBoard(game, is_update=False))),
+        Benchmark("render_card_board", lambda: to_xml(CardBoard(game, 0))),
+        Benchmark("render_selections", lambda: to_xml(Selections(game))),
+        Benchmark("render_next_game_button", lambda: to_xml(NextGameButton(game))),
+    ]
+
+
+def pack_benchmarks() -> list[Benchmark]:
+    from manage import create_words
+
+    # manage logs every statement for the command line which would be timed along with them
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+    benchmarks = []
+    for size in PACK_SIZES:
+        runs = []
+
+        def load_pack(size=size, runs=runs):
+            # new phrases and a new tag every time so every run adds the whole pack
+            run = f"{size}-{len(runs)}"
+            runs.append(run)
+            path = f"pack-{run}.txt"
+            with open(path, "w") as file:
+                file.writelines(f"pack {run} phrase {i}\n" for i in range(size))
+            with contextlib.redirect_stdout(io.StringIO()):
+                create_words(path, f"pack {run}")
+
+        benchmarks.append(Benchmark(f"create_words_{size}", load_pack, calls=1, rounds=5))
+    return benchmarks
+
+
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"benchmarks": {}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help="only run benchmarks starting with these")
+    parser.add_argument("--save", action="store_true", help="save the times as the baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="how much slower than the baseline is a regression, 0.25 is 25%%",
+    )
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+
+    random.seed(0)
+    tag_id = make_database("micro", PHRASES)
+    benchmarks = session_benchmarks(tag_id) + render_benchmarks() + pack_benchmarks()
+    if args.names:
+        benchmarks = [b for b in benchmarks if b.name.startswith(tuple(args.names))]
+
+    baseline = load_baseline()
+    if "python" in baseline and baseline["python"] != platform.python_version():
+        print(
+            f"the baseline was saved on python {baseline['python']}, "
+            f"save one on {platform.python_version()} before comparing"
+        )
+    times = {}
+    regressions = []
+    for benchmark in benchmarks:
+        timing = time_benchmark(benchmark)
+        saved = baseline["benchmarks"].get(benchmark.name)
+        saved_timing = Timing(saved["fastest_us"], saved["median_us"]) if saved else None
+        if saved_timing is not None:
+            for _ in range(RECHECKS):
+                change = timing.fastest_us / saved_timing.fastest_us - 1
+                if change <= allowed_change(timing, saved_timing, args.threshold):
+                    break
+                timing = min(timing, time_benchmark(benchmark), key=lambda t: t.fastest_us)
+        times[benchmark.name] = timing
+        line = f"{benchmark.name:<34} {timing.fastest_us:12.1f}us ±{timing.noise:5.1%}"
+        if saved_timing is not None:
+            change = timing.fastest_us / saved_timing.fastest_us - 1
+            allowed = allowed_change(timing, saved_timing, args.threshold)
+            line += f" {change:+7.1%} against {saved_timing.fastest_us:.1f}us"
+            line += f" (allowed {allowed:+.1%})"
+            if change > allowed:
+                regressions.append(benchmark.name)
+                line += "  REGRESSED"
+        print(line, flush=True)
+
+    if args.save:
+        saved = baseline["benchmarks"] | {
+            name: {"fastest_us": round(t.fastest_us, 1), "median_us": round(t.median_us, 1)}
+            for name, t in times.items()
+        }
+        baseline = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "benchmarks": dict(sorted(saved.items())),
+        }
+        with open(BASELINE_FILE, "w") as file:
+            json.dump(baseline, file, indent=2)
+            file.write("\n")
+        print(f"saved the baseline to {os.path.relpath(BASELINE_FILE, APP_DIR)}")
+    elif regressions:
+        sys.exit(
+            f"{len(regressions)} slower than {args.threshold:.0%} and their noise past the baseline"
+        )
+
+
+if __name__ == "__main__":
+    main()
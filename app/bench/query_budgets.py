@@ -0,0 +1,103 @@
+"""Goes through every route (and a broadcast) with the query budgets in strict mode and fails if any
+of them ran more statements than its budget, repeated a statement or ran one in a loop
+
+run from the app directory: `python -m bench.query_budgets`
+the games are played on a new database in a temporary directory with the default packs loaded,
+every game is dropped from memory before it's opened so the cold loads are what's checked
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    os.symlink(os.path.join(APP_DIR, "cards"), os.path.join(directory, "cards"))
+    os.chdir(directory)
+    for load in ("database", "cards"):
+        subprocess.run(
+            [sys.executable, os.path.join(APP_DIR, "manage.py"), "load", load],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    os.environ["CODENAMES_QUERY_BUDGETS"] = "strict"
+    sys.path.insert(0, APP_DIR)
+    from starlette.testclient import TestClient
+    from budgets import budgets, most_statements, violations
+    from make_app import PARTIALS_PREFIX, app
+    from models import upcoming
+    from models.store import live_games
+
+    # registers every route on the app
+    import pages  # noqa: F401
+
+    # /metrics only answers the server's own network
+    with TestClient(app, client=("127.0.0.1", 50000)) as client:
+        client.get("/")
+        page = client.get("/play").text
+        tags = re.findall(r'name="tag-(\d+)"', page)
+        made = client.post("/play", data={"tags": tags, "dummy_value": "1"})
+        game_code = made.headers["hx-redirect"].rsplit("/", 1)[1]
+        client.get(f"/play/{game_code}")
+        live_games.clear()
+        page = client.get(f"/play/{game_code}", params={"role": "game_role_spymaster"}).text
+        card_ids = re.findall(r"game_card_id(?:&quot;|\"): (\d+)", page)
+        session_id = re.findall(r"session_id(?:&quot;|\"): (\d+)", page)[0]
+        client.post(f"{PARTIALS_PREFIX}/find_game", data={"game_code": game_code})
+        live_games.clear()
+        with client.websocket_connect(f"/play-connect/{game_code}") as ws:
+            ws.send_json({"version": 0})
+            for card_id in card_ids[:3]:
+                client.post(
+                    f"{PARTIALS_PREFIX}/select_card/{game_code}",
+                    data={"game_card_id": card_id},
+                )
+                ws.receive_text()
+            client.post(
+                f"{PARTIALS_PREFIX}/guess_card/{game_code}",
+                data={"game_card_id": card_ids[0]},
+            )
+            ws.receive_text()
+            while upcoming._prepare_tasks:
+                time.sleep(0.05)
+            continued = client.post(
+                "/continue_game", data={"game_code": game_code, "session_id": session_id}
+            )
+            game_code = continued.headers["hx-redirect"].rsplit("/", 1)[1]
+            ws.receive_text()
+        client.get(f"/play/{game_code}", params={"role": "game_role_operative"})
+        while upcoming._prepare_tasks:
+            time.sleep(0.05)
+        # claimed from the games made in the background while the game before was open
+        continued = client.post(
+            "/continue_game", data={"game_code": game_code, "session_id": session_id}
+        )
+        game_code = continued.headers["hx-redirect"].rsplit("/", 1)[1]
+        # nobody opened that one so its next game is made in the request
+        client.post("/continue_game", data={"game_code": game_code, "session_id": session_id})
+        client.get("/metrics")
+
+    print(f"{'route':<16} {'budget':>6} {'most':>6}")
+    for name in sorted(budgets.keys() | most_statements.keys()):
+        budget = budgets.get(name, "-")
+        most = most_statements.get(name, "-")
+        print(f"{name:<16} {budget:>6} {most:>6}")
+    unchecked = sorted(budgets.keys() - most_statements.keys())
+    for name in unchecked:
+        violations.append(f"{name} has a budget but was never run")
+    for violation in violations:
+        print(violation)
+    if violations:
+        sys.exit(f"{len(violations)} problems")
+    print("every route stayed within its budget")
+
+
+if __name__ == "__main__":
+    main()
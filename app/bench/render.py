@@ -0,0 +1,93 @@
+"""Compares rendering a board's updates by building the components and walking them with `to_xml`
+against filling in the board's templates, and checks the two give the exact same text
+
+run from the app directory: `python -m bench.render --games 200 --updates 20`
+the boards are made up in memory, no database is used
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# phrases that need escaping so a difference there shows up too
+PHRASES = ("salt & pepper", "<b>bold</b>", 'the "quote"', "rock 'n' roll", "ice cream", "émigré")
+
+
+def make_game(code: str):
+    from datetime import datetime
+    from models.game import CARDS_PER_GAME
+    from models.store import KINDS, LiveGame
+
+    game = LiveGame(code, random.randrange(1, 1000), 1, datetime.now(), 0)
+    start = random.randrange(1, 1_000_000)
+    for index in range(CARDS_PER_GAME):
+        game.phrases[index] = f"{random.choice(PHRASES)} {index}"
+        game.game_card_ids[index] = start + index
+        game.card_ids[index] = start + index
+        game.kinds[index] = random.randrange(len(KINDS))
+    return game
+
+
+def play(game, updates: int) -> list:
+    """Random clicks on the game, returns the events of each"""
+    from models.game import CARDS_PER_GAME
+
+    events = []
+    for update in range(updates):
+        index = random.randrange(CARDS_PER_GAME)
+        if update == updates // 2:
+            game.set_next_game("NEXTGM")
+        elif random.random() < 0.3 and not game.guessed[index]:
+            game.guess(index)
+        else:
+            game.toggle_selection(f"token {random.randrange(6)}", index)
+        events.append(game.events.since(game.version - 1, game.version))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=20)
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, APP_DIR)
+    from fasthtml.common import to_xml
+    from pages.play import fast_updated_game, updated_game
+
+    def check(game, events):
+        components = to_xml(updated_game(game, events))
+        templates = fast_updated_game(game, events)
+        assert components == templates, f"{game.code} differs\n{components}\n{templates}"
+
+    # every game is played once up front and each of its updates rendered both ways, along with
+    #    the whole game before anyone touched it (at version 0)
+    cases = []
+    for g in range(args.games):
+        game = make_game(f"GAME{g:02}")
+        check(game, None)
+        cases.append((game, play(game, args.updates)))
+    for game, updates in cases:
+        for events in updates + [None]:
+            check(game, events)
+
+    renders = args.games * (args.updates + 1)
+    for name, render in (
+        ("components + to_xml", lambda game, events: to_xml(updated_game(game, events))),
+        ("templates", fast_updated_game),
+    ):
+        start = time.perf_counter()
+        for game, updates in cases:
+            for events in updates + [None]:
+                render(game, events)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20} {elapsed / renders * 1e6:8.1f}us per update")
+    print(f"{renders} updates rendered the same both ways")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compares drawing a game's cards with `ORDER BY random()` against the in memory card index
+
+run from the app directory: `python -m bench.sampler --sizes 10000 100000 1000000`
+every size gets its own scratch database in a temporary directory
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAGS = ("1", "2", "3")
+# how much of each pack is also in the next pack
+OVERLAP = 0.1
+USED_GAMES = 10
+DRAWS = 20
+
+
+def fill(engine, size: int):
+    from sqlalchemy import insert
+    from models.config import Base
+    from models.game import Card, Tag, TagCardGrouper
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Tag), [{"id": int(tag), "name": f"pack {tag}"} for tag in TAGS])
+        conn.execute(insert(Card), [{"id": i, "phrase": f"phrase {i}"} for i in range(1, size + 1)])
+        per_tag = size // len(TAGS)
+        groupers = []
+        for t, tag in enumerate(TAGS):
+            start = t * per_tag
+            end = min(size, start + per_tag + int(per_tag * OVERLAP))
+            groupers.extend({"tag_id": tag, "card_id": i} for i in range(start + 1, end + 1))
+        conn.execute(insert(TagCardGrouper), groupers)
+
+
+def order_by_random(db, used_ids: set[int]):
+    """What Session.create_game used to do"""
+    from sqlalchemy import func, select
+    from models.game import Card, TagCardGrouper
+
+    return db.scalars(
+        select(Card)
+        .join(TagCardGrouper)
+        .filter(~Card.id.in_(used_ids))
+        .filter(TagCardGrouper.tag_id.in_(TAGS))
+        .order_by(func.random())
+        .limit(25)
+    ).all()
+
+
+def run(size: int):
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session as DbSession
+    from models.game import Card, TagCardGrouper
+    from models.sampler import CardIndex
+
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/cards.db")
+    fill(engine, size)
+    with DbSession(engine) as db:
+        rows = db.execute(select(TagCardGrouper.tag_id, TagCardGrouper.card_id)).tuples().all()
+        start = time.perf_counter()
+        index = CardIndex(0, rows)
+        build = time.perf_counter() - start
+
+        used_ids = set(random.sample(range(1, size + 1), 25 * USED_GAMES))
+
+        start = time.perf_counter()
+        for _ in range(DRAWS):
+            order_by_random(db, used_ids)
+        before = (time.perf_counter() - start) / DRAWS
+
+        start = time.perf_counter()
+        for _ in range(DRAWS):
+            drawn = index.sample(TAGS, used_ids, 25)
+            # still need the phrases for the drawn cards
+            db.execute(select(Card.id, Card.phrase).filter(Card.id.in_(drawn))).all()
+        after = (time.perf_counter() - start) / DRAWS
+    print(
+        f"{size:>9} cards | order by random() {before * 1000:8.2f}ms"
+        f" | card index {after * 1000:6.2f}ms (built once in {build * 1000:.0f}ms)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    sys.path.insert(0, APP_DIR)
+    for size in args.sizes:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Query plans and latency of the hot lookups with sqlite's defaults and no secondary indexes
+against the storage profile with the indexes `manage.py migrate` makes
+
+run from the app directory: `python -m bench.storage --sessions 2000 --games 10`
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CARDS = 20_000
+SELECTIONS_PER_GAME = 4
+RUNS = 500
+WRITES = 200
+
+
+def fill(engine, sessions: int, games: int):
+    from sqlalchemy import insert
+    from models.config import Base
+    from models.game import (
+        CARDS_PER_GAME,
+        Card,
+        Game,
+        GameCard,
+        GameCardKind,
+        Selection,
+        Session,
+        Tag,
+        TagCardGrouper,
+    )
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Tag), [{"id": 1, "name": "pack"}])
+        cards = [{"id": i, "phrase": f"phrase {i}"} for i in range(1, CARDS + 1)]
+        conn.execute(insert(Card), cards)
+        groupers = [{"tag_id": "1", "card_id": i} for i in range(1, CARDS + 1)]
+        conn.execute(insert(TagCardGrouper), groupers)
+        conn.execute(insert(Session), [{"id": s} for s in range(1, sessions + 1)])
+        game_rows, card_rows, selection_rows = [], [], []
+        for s in range(1, sessions + 1):
+            for g in range(games):
+                code = f"{s:06}{g:02}"
+                game_rows.append({"code": code, "session_id": s})
+                card_ids = random.sample(range(1, CARDS + 1), CARDS_PER_GAME)
+                for index, card_id in enumerate(card_ids):
+                    card_rows.append(
+                        {
+                            "card_id": card_id,
+                            "game_code": code,
+                            "kind": GameCardKind.TAN,
+                            "index": index,
+                            "is_guessed": False,
+                        }
+                    )
+                for token in range(SELECTIONS_PER_GAME):
+                    selection_rows.append(
+                        {"token": f"t{token}", "game_code": code, "card_id": card_ids[token]}
+                    )
+        conn.execute(insert(Game), game_rows)
+        conn.execute(insert(GameCard), card_rows)
+        conn.execute(insert(Selection), selection_rows)
+
+
+def hot_queries(session_id: int, game_code: str) -> dict:
+    from sqlalchemy import select
+    from models.game import Game, GameCard, Selection, TagCardGrouper
+
+    return {
+        "next game of session": select(Game.code)
+        .filter(Game.code != game_code)
+        .filter(Game.session_id == session_id)
+        .filter(Game.rowid > 0)
+        .limit(1),
+        "cards of game": select(GameCard).filter(GameCard.game_code == game_code),
+        "selections of game": select(Selection).filter(Selection.game_code == game_code),
+        "cards used in session": select(GameCard.card_id)
+        .join(GameCard.game)
+        .filter(Game.session_id == session_id),
+        "tags of card": select(TagCardGrouper.tag_id).filter(TagCardGrouper.card_id == 7),
+    }
+
+
+def measure(engine, sessions: int, games: int, label: str):
+    from sqlalchemy import update
+    from models.game import Game
+
+    print(f"--- {label}")
+    with engine.connect() as conn:
+        journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+        print(f"journal_mode={journal_mode} synchronous={synchronous}")
+        for name, query in hot_queries(1, "00000100").items():
+            sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+            timings = []
+            for _ in range(RUNS):
+                session_id = random.randrange(1, sessions + 1)
+                game_code = f"{session_id:06}{random.randrange(games):02}"
+                query = hot_queries(session_id, game_code)[name]
+                start = time.perf_counter()
+                conn.execute(query).all()
+                timings.append(time.perf_counter() - start)
+            print(
+                f"{name:<22} median {statistics.median(timings) * 1000:7.3f}ms"
+                f" | {' / '.join(row[-1] for row in plan)}"
+            )
+        timings = []
+        for _ in range(WRITES):
+            session_id = random.randrange(1, sessions + 1)
+            start = time.perf_counter()
+            conn.execute(
+                update(Game)
+                .filter(Game.code == f"{session_id:06}00")
+                .values(version=Game.version + 1)
+            )
+            conn.commit()
+            timings.append(time.perf_counter() - start)
+        print(f"{'version write + commit':<22} median {statistics.median(timings) * 1000:7.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--games", type=int, default=10)
+    args = parser.parse_args()
+    sys.path.insert(0, APP_DIR)
+    from sqlalchemy import create_engine, event
+    from models.config import Base, StorageProfile, apply_storage_profile
+
+    directory = tempfile.mkdtemp()
+    before_path = os.path.join(directory, "before.db")
+    after_path = os.path.join(directory, "after.db")
+    before = create_engine(f"sqlite:///{before_path}")
+    fill(before, args.sessions, args.games)
+    print(f"database is {os.path.getsize(before_path) / 1e6:.1f}MB")
+    shutil.copy(before_path, after_path)
+    # what a database made before the indexes were in the models looks like
+    with before.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(conn, checkfirst=True)
+        conn.exec_driver_sql("ANALYZE")
+
+    after = create_engine(f"sqlite:///{after_path}")
+    event.listen(after, "connect", lambda conn, _: apply_storage_profile(conn, StorageProfile()))
+    # the same as `manage.py migrate`
+    with after.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.exec_driver_sql("ANALYZE")
+
+    measure(before, args.sessions, args.games, "defaults, no secondary indexes")
+    measure(after, args.sessions, args.games, "storage profile and indexes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Query budgets, how many sql statements a route (or a broadcast) is expected to run at most
+
+Off unless `CODENAMES_QUERY_BUDGETS` is set. With `warn` every request's statements are recorded
+and a warning is logged when it goes over its route's budget, runs the exact same statement more
+than once or runs one statement with different parameters enough times to look like a query in a
+loop. `strict` also keeps the problems in `violations` so a check can fail on them, see
+`python -m bench.query_budgets`.
+"""
+
+import logging
+import os
+from collections import Counter
+from typing import Callable, TypeVar
+from metrics import RequestQueries, query_checks
+
+QUERY_BUDGETS = os.getenv("CODENAMES_QUERY_BUDGETS", "")
+# the same statement this many times with different parameters looks like a query in a loop
+REPEATED_STATEMENT_LIMIT = 3
+STATEMENT_PREVIEW_SIZE = 120
+
+T = TypeVar("T")
+logger = logging.getLogger("codenames.queries")
+# route name -> statements it can run
+budgets: dict[str, int] = {}
+# route name -> the most statements it was seen running
+most_statements: dict[str, int] = {}
+violations: list[str] = []
+
+
+def declare_budget(name: str, statements: int):
+    budgets[name] = statements
+
+
+def query_budget(statements: int) -> Callable[[T], T]:
+    """Declares the budget of the route it decorates, goes above the route's decorator"""
+
+    def declare(route: T) -> T:
+        declare_budget(getattr(route, "__routename__", getattr(route, "__name__")), statements)
+        return route
+
+    return declare
+
+
+def _preview(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > STATEMENT_PREVIEW_SIZE:
+        return statement[:STATEMENT_PREVIEW_SIZE] + "..."
+    return statement
+
+
+def query_problems(name: str, queries: RequestQueries) -> list[str]:
+    recorded = queries.recorded or []
+    problems = []
+    budget = budgets.get(name)
+    if budget is not None and len(recorded) > budget:
+        problems.append(f"ran {len(recorded)} statements over its budget of {budget}")
+    exact = Counter((statement, repr(parameters)) for statement, parameters in recorded)
+    for (statement, _), count in exact.items():
+        if count > 1:
+            problems.append(f"ran the same statement {count} times: {_preview(statement)}")
+    different = Counter(statement for statement, _ in exact)
+    for statement, count in different.items():
+        if count >= REPEATED_STATEMENT_LIMIT:
+            problems.append(
+                f"ran a statement with {count} different parameters: {_preview(statement)}"
+            )
+    return problems
+
+
+def check_queries(name: str, queries: RequestQueries):
+    most_statements[name] = max(most_statements.get(name, 0), queries.statements)
+    for problem in query_problems(name, queries):
+        logger.warning(f"{name} {problem}")
+        if QUERY_BUDGETS == "strict":
+            violations.append(f"{name} {problem}")
+
+
+if QUERY_BUDGETS:
+    query_checks.append(check_queries)
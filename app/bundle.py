@@ -0,0 +1,216 @@
+"""The site's assets served by the site itself
+
+`manage.py assets` downloads the third party files into `assets/vendor` and writes every asset out
+to `assets/build` under a name with a hash of its content in it, along with gzip and brotli copies.
+A name like that never changes content so browsers can keep it for good. Until the assets have
+been built the pages use the cdn and the plain files.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Callable
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+ASSETS_PATH = "/assets"
+BUILD_PATH = f"{ASSETS_PATH}/build"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(APP_DIR, "assets")
+VENDOR_DIR = os.path.join(ASSETS_DIR, "vendor")
+BUILD_DIR = os.path.join(ASSETS_DIR, "build")
+MANIFEST_FILE = os.path.join(BUILD_DIR, "manifest.json")
+FINGERPRINT_SIZE = 12
+DOWNLOAD_TIMEOUT_SECONDS = 30
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# best first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+@dataclass
+class VendoredAsset:
+    url: str
+    # the subresource integrity the cdn file is checked against, downloads that don't match are
+    #    thrown out
+    integrity: str | None = None
+
+
+VENDORED = {
+    # what fasthtml puts on every page, the same versions it would get from the cdn
+    "htmx.min.js": VendoredAsset("https://cdn.jsdelivr.net/npm/htmx.org@2.0.4/dist/htmx.min.js"),
+    "fasthtml.js": VendoredAsset(
+        "https://cdn.jsdelivr.net/gh/answerdotai/fasthtml-js@1.0.12/fasthtml.js"
+    ),
+    "surreal.js": VendoredAsset("https://cdn.jsdelivr.net/gh/answerdotai/surreal@main/surreal.js"),
+    "css-scope-inline.js": VendoredAsset(
+        "https://cdn.jsdelivr.net/gh/gnat/css-scope-inline@main/script.js"
+    ),
+    "bootstrap.min.css": VendoredAsset(
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+        "sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH",
+    ),
+    "bootstrap.bundle.min.js": VendoredAsset(
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+        "sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz",
+    ),
+    "htmx-ws.js": VendoredAsset("https://unpkg.com/htmx.org@1.9.12/dist/ext/ws.js"),
+}
+# the repo's own assets that go through the build
+OWN_ASSETS = ("helpers.js", "error.svg", "success.svg", "warning.svg")
+
+
+@dataclass
+class BuiltAsset:
+    path: str
+    media_type: str
+    # encodings there's a compressed copy for, the copy is the path plus the encoding's suffix
+    encodings: list[str] = field(default_factory=list)
+
+
+def _load_manifest() -> dict[str, str]:
+    try:
+        with open(MANIFEST_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+# asset name -> the name it was built under
+manifest = _load_manifest()
+# built name -> the files for it
+built: dict[str, BuiltAsset] = {}
+
+
+def _find_built():
+    built.clear()
+    for built_name in manifest.values():
+        path = os.path.join(BUILD_DIR, built_name)
+        media_type = mimetypes.guess_type(built_name)[0] or "application/octet-stream"
+        encodings = [
+            encoding for encoding, suffix in ENCODINGS.items() if os.path.exists(path + suffix)
+        ]
+        built[built_name] = BuiltAsset(path, media_type, encodings)
+
+
+_find_built()
+
+
+def asset_url(name: str) -> str:
+    """Where the page should get the asset from"""
+    built_name = manifest.get(name)
+    if built_name is not None:
+        return f"{BUILD_PATH}/{built_name}"
+    if name in VENDORED:
+        return VENDORED[name].url
+    return f"{ASSETS_PATH}/{name}"
+
+
+def integrity(name: str) -> str | None:
+    vendored = VENDORED.get(name)
+    return None if vendored is None else vendored.integrity
+
+
+def _integrity_matches(content: bytes, expected: str) -> bool:
+    algorithm, _, digest = expected.partition("-")
+    actual = base64.b64encode(hashlib.new(algorithm, content).digest()).decode()
+    return actual == digest
+
+
+def vendor_assets(progress: Callable[[str], None] = print):
+    """Downloads any third party asset that isn't in the vendor directory yet"""
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    for name, vendored in VENDORED.items():
+        path = os.path.join(VENDOR_DIR, name)
+        if os.path.exists(path):
+            continue
+        try:
+            with urllib.request.urlopen(vendored.url, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+                content = response.read()
+        except OSError as err:
+            progress(f"could not download {name} ({err}), it stays on the cdn")
+            continue
+        if vendored.integrity and not _integrity_matches(content, vendored.integrity):
+            progress(f"{name} does not match its integrity, it stays on the cdn")
+            continue
+        with open(path, "wb") as file:
+            file.write(content)
+        progress(f"vendored {name} ({len(content):,} bytes)")
+
+
+def _write(path: str, content: bytes):
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def build_assets(progress: Callable[[str], None] = print) -> dict[str, str]:
+    """Writes the fingerprinted and compressed copies of every asset there is a file for and the
+    manifest pointing at them"""
+    # imported here so the rest of manage.py still runs without brotli installed
+    import brotli
+
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    sources = {name: os.path.join(VENDOR_DIR, name) for name in VENDORED}
+    sources |= {name: os.path.join(ASSETS_DIR, name) for name in OWN_ASSETS}
+    new_manifest = {}
+    for name, source in sources.items():
+        if not os.path.exists(source):
+            continue
+        with open(source, "rb") as file:
+            content = file.read()
+        stem, extension = os.path.splitext(name)
+        fingerprint = hashlib.sha256(content).hexdigest()[:FINGERPRINT_SIZE]
+        built_name = f"{stem}.{fingerprint}{extension}"
+        path = os.path.join(BUILD_DIR, built_name)
+        _write(path, content)
+        sizes = [f"{len(content):,}"]
+        # compressed copies that aren't smaller would only cost the browser time to unpack
+        gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(gzipped) < len(content):
+            _write(path + ENCODINGS["gzip"], gzipped)
+            sizes.append(f"gzip {len(gzipped):,}")
+        compressed = brotli.compress(content, quality=11)
+        if len(compressed) < len(content):
+            _write(path + ENCODINGS["br"], compressed)
+            sizes.append(f"br {len(compressed):,}")
+        new_manifest[name] = built_name
+        progress(f"{name} -> {built_name} ({', '.join(sizes)} bytes)")
+    with open(MANIFEST_FILE, "w") as file:
+        json.dump(new_manifest, file, indent=2)
+    manifest.clear()
+    manifest.update(new_manifest)
+    _find_built()
+    return new_manifest
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        encoding, _, params = part.strip().partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+async def serve_built_asset(request: Request) -> Response:
+    asset = built.get(request.path_params["name"])
+    if asset is None:
+        return Response(status_code=404)
+    headers = {"cache-control": IMMUTABLE_CACHE_CONTROL, "vary": "accept-encoding"}
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    for encoding in asset.encodings:
+        if encoding in accepted:
+            headers["content-encoding"] = encoding
+            return FileResponse(
+                asset.path + ENCODINGS[encoding], media_type=asset.media_type, headers=headers
+            )
+    return FileResponse(asset.path, media_type=asset.media_type, headers=headers)
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+from starlette.websockets import WebSocket
+from metrics import COUNT_BUCKETS, Collected, Histogram
+
+# how many frames a socket can fall behind before its outbox is collapsed down to the newest one
+OUTBOX_SIZE = 8
+# a socket that can't take a frame in this long is treated as gone
+SEND_TIMEOUT_SECONDS = 10
+
+logger = logging.getLogger("codenames.broadcast")
+
+
+@dataclass
+class Frame:
+    since: int | None
+    """the version the client has to be at for this frame to apply, None for the whole game"""
+    version: int
+    """the version the client is at after the frame"""
+    text: str
+
+
+@dataclass
+class BroadcastStats:
+    frames_queued: int = 0
+    frames_sent: int = 0
+    # frames that were thrown away because a newer frame made them pointless to send
+    frames_coalesced: int = 0
+    # frames that never made it because the socket failed or timed out
+    frames_dropped: int = 0
+
+
+stats = BroadcastStats()
+Collected(
+    "codenames_broadcast_frames_total",
+    "Frames by what happened to them",
+    lambda: {
+        ("queued",): stats.frames_queued,
+        ("sent",): stats.frames_sent,
+        ("coalesced",): stats.frames_coalesced,
+        ("dropped",): stats.frames_dropped,
+    },
+    kind="counter",
+    labels=("outcome",),
+)
+broadcast_seconds = Histogram(
+    "codenames_broadcast_seconds", "Time taken to queue a game's change for everyone watching it"
+)
+# a label per game would make a new series for every game ever played
+broadcast_sockets = Histogram(
+    "codenames_broadcast_sockets",
+    "Sockets a game's change was queued for",
+    COUNT_BUCKETS + (144, 233, 377, 610, 987),
+)
+
+
+class Outbox:
+    """The frames waiting to go out on a single socket, sent by its own task so one slow
+    client never holds up anybody else"""
+
+    def __init__(
+        self,
+        socket_id: str,
+        websocket: WebSocket,
+        game_code: str,
+        render: Callable[[int | None], Frame | None],
+        size: int = OUTBOX_SIZE,
+    ):
+        self.socket_id = socket_id
+        self.websocket = websocket
+        self.game_code = game_code
+        # makes the frame that brings a client at the given version up to the newest version
+        self.render = render
+        self.size = size
+        # version the client is at, None until it tells us
+        self.version: int | None = None
+        self.frames: deque[Frame] = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def queued_version(self) -> int | None:
+        """The version the client will be at once everything queued is sent"""
+        return self.frames[-1].version if self.frames else self.version
+
+    def put(self, frame: Frame | None):
+        if self.closed or frame is None:
+            return
+        stats.frames_queued += 1
+        # once the client has fallen this far behind it's cheaper to jump it straight to the
+        #    newest version than to send everything it missed one by one
+        if len(self.frames) >= self.size:
+            stats.frames_coalesced += len(self.frames) + 1
+            self.frames.clear()
+            frame = self.render(self.version)
+            if frame is None:
+                return
+        self.frames.append(frame)
+        self.wakeup.set()
+
+    def notify(self):
+        """The game changed, queue whatever the client doesn't have yet"""
+        since = self.queued_version()
+        frame = self.render(since)
+        if frame is not None and frame.version != since:
+            self.put(frame)
+
+    def sync(self, version: int | None):
+        """The client said which version it has (like after reconnecting)"""
+        self.version = version
+        stats.frames_coalesced += len(self.frames)
+        self.frames.clear()
+        self.notify()
+
+    async def run(self):
+        while not self.closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.frames and not self.closed:
+                frame = self.frames.popleft()
+                if frame.since != self.version:
+                    # the frame was made for a version this client isn't at
+                    stats.frames_coalesced += 1
+                    frame = self.render(self.version)
+                    if frame is None:
+                        continue
+                if frame.version == self.version:
+                    continue
+                try:
+                    await asyncio.wait_for(
+                        self.websocket.send_text(frame.text), SEND_TIMEOUT_SECONDS
+                    )
+                except Exception as err:
+                    # a client going away is expected, so only what happened and not the trace
+                    logger.info(f"Dropping socket {self.socket_id} of {self.game_code}: {err!r}")
+                    stats.frames_dropped += 1 + len(self.frames)
+                    unsubscribe(self.socket_id, self.game_code)
+                    return
+                stats.frames_sent += 1
+                self.version = frame.version
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.frames.clear()
+        self.wakeup.set()
+
+
+# game code -> socket id -> outbox
+# a change to a game should only ever cost as much as the sockets watching that game, not
+#    every socket connected to the server
+subscribers: dict[str, dict[str, Outbox]] = {}
+
+
+def subscribe(outbox: Outbox):
+    subscribers.setdefault(outbox.game_code, {})[outbox.socket_id] = outbox
+
+
+def unsubscribe(socket_id: str, game_code: str):
+    watchers = subscribers.get(game_code)
+    if watchers is None:
+        return
+    outbox = watchers.pop(socket_id, None)
+    if outbox is not None:
+        outbox.close()
+    # don't let games nobody is watching pile up
+    if not watchers:
+        del subscribers[game_code]
+
+
+def unsubscribe_game(game_code: str):
+    for socket_id in list(subscribers.get(game_code, {})):
+        unsubscribe(socket_id, game_code)
+
+
+def is_watched(game_code: str) -> bool:
+    return game_code in subscribers
+
+
+def broadcast(game_code: str):
+    """Queues the newest state of the game for everyone watching it, never waits on a socket"""
+    outboxes = list(subscribers.get(game_code, {}).values())
+    start = time.perf_counter()
+    for outbox in outboxes:
+        outbox.notify()
+    broadcast_seconds.observe(time.perf_counter() - start)
+    broadcast_sockets.observe(len(outboxes))
+
+
+Collected(
+    "codenames_websockets",
+    "Sockets watching a game",
+    lambda: sum(len(watchers) for watchers in subscribers.values()),
+)
+Collected("codenames_watched_games", "Games with someone watching them", lambda: len(subscribers))
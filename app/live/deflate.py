@@ -0,0 +1,26 @@
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+# how hard permessage-deflate works on each frame, 1 (fastest) to 9 (smallest)
+# every socket keeps its compression window between frames so the class strings that repeat in
+#    every update go out as back references after the first time
+WS_COMPRESSION_LEVEL = 6
+# zlib's memory level, 1 to 9, every socket in a crowd holds its own compressor
+WS_COMPRESSION_MEMORY_LEVEL = 5
+
+
+class DeflateWebSocketProtocol(WebSocketProtocol):
+    """uvicorn's websockets protocol with permessage-deflate at `WS_COMPRESSION_LEVEL`, uvicorn
+    itself can only turn it on or off"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [
+                ServerPerMessageDeflateFactory(
+                    compress_settings={
+                        "level": WS_COMPRESSION_LEVEL,
+                        "memLevel": WS_COMPRESSION_MEMORY_LEVEL,
+                    }
+                )
+            ]
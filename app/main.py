@@ -1,5 +1,19 @@
-from fasthtml.common import serve
+import os
+import uvicorn
 from pages import *
 from make_app import *
+from live.deflate import DeflateWebSocketProtocol
 
-serve()
+if __name__ == "__main__":
+    # what fasthtml's serve() does but with the websocket protocol swapped for the one that
+    #    compresses at the configured level
+    port = int(os.getenv("PORT", default=5001))
+    print(f"Link: http://localhost:{port}")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        reload=True,
+        ws=DeflateWebSocketProtocol,
+        ws_per_message_deflate=True,
+    )
@@ -2,32 +2,38 @@ from fasthtml.common import *
 from fasthtml.svg import Path
 from starlette.requests import Request
 import secrets
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.routing import Route
+from bundle import BUILD_PATH, asset_url, integrity, serve_built_asset
+from metrics import MetricsMiddleware
 
 _hdrs = (
-    # boostrap cdn v5.3
+    # fasthtml's default headers but with its scripts going through `asset_url` too
+    charset,
+    viewport,
+    Script(src=asset_url("htmx.min.js")),
+    Script(src=asset_url("fasthtml.js")),
+    Script(src=asset_url("surreal.js")),
+    Script(src=asset_url("css-scope-inline.js")),
+    # boostrap v5.3, served by the site once `manage.py assets` has been run (the cdn until then)
     Link(
-        href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+        href=asset_url("bootstrap.min.css"),
         rel="stylesheet",
-        integrity="sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH",
+        integrity=integrity("bootstrap.min.css"),
         crossorigin="anonymous",
     ),
     Script(
-        src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
-        integrity="sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz",
+        src=asset_url("bootstrap.bundle.min.js"),
+        integrity=integrity("bootstrap.bundle.min.js"),
         crossorigin="anonymous",
     ),
-    Script(src="https://unpkg.com/htmx.org@1.9.12/dist/ext/ws.js"),
-    # some javascript abbreviations
-    #  (i like this better than using some of the other mini js frameworks)
-    Script("""
-               var qs = document.querySelector.bind(document);
-               var qsa = document.querySelectorAll.bind(document);
-               var qsa = document.querySelectorAll.bind(document);
-               var onload = (callback) => document.addEventListener('DOMContentLoaded', callback)
-               """),
+    Script(src=asset_url("htmx-ws.js")),
+    # some javascript abbreviations, a file so browsers keep it instead of getting it every page
+    Script(src=asset_url("helpers.js")),
 )
 PARTIALS_PREFIX = "/partials"
-ASSETS_PATH = "/assets"
 SCRIPTS_PATH = "/scripts"
 CSS_PATH = "/css"
 
@@ -37,6 +43,10 @@ SITE_TOKEN = "session_id"
 IS_DARK_MODE_TOKEN = "use_dark_mode"
 
 TOKEN_SIZE = 32
+# pages and partials smaller than this go out as they are, compressing them saves next to nothing
+GZIP_MINIMUM_SIZE = 500
+# 1 (fastest) to 9 (smallest)
+GZIP_LEVEL = 6
 
 
 def before(request: Request):
@@ -45,6 +55,29 @@ def before(request: Request):
     request.session[SITE_TOKEN] = secrets.token_urlsafe(TOKEN_SIZE)
 
 
-bware = Beforeware(before, skip=[r"/favicon\.ico", r"/assets/.*", r".*\.css", r".*\.js"])
+bware = Beforeware(
+    before, skip=[r"/favicon\.ico", r"/assets/.*", r".*\.css", r".*\.js", r"/metrics"]
+)
+
+# other modules hook into shutting down through this so this module doesn't need to import them
+shutdown_hooks: list[Callable[[], Awaitable[None]]] = []
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    for hook in shutdown_hooks:
+        await hook()
 
-app, rt = fast_app(before=bware, hdrs=_hdrs, pico=False, live=False)
+
+app, rt = fast_app(
+    before=bware, hdrs=_hdrs, default_hdrs=False, pico=False, live=False, lifespan=lifespan
+)
+# assets that were built with compressed copies already have a content-encoding so they're skipped
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
+# outside of everything else so the time it takes to compress is counted too
+app.add_middleware(MetricsMiddleware)
+# ahead of fasthtml's catch all for static files
+app.router.routes.insert(
+    0, Route(f"{BUILD_PATH}/{{name:str}}", serve_built_asset, name="built_asset")
+)
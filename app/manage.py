@@ -1,6 +1,12 @@
 from models.game import *
-from models.config import Base, engine, session
-from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# registers the change feed's table so create_all makes it
+from models.bus import GameChangeRow  # noqa: F401
+from models.codes import code_space_usage
+from models.config import Base, engine, db_session
+from models.packs import PackStats, load_packs
+from models.sampler import invalidate_card_index
+from bundle import build_assets, vendor_assets
 import os
 
 # needs to import everything from all the models to ensure that the all
@@ -15,26 +21,100 @@ def simple_create_database():
     Base.metadata.create_all(engine)
 
 
-def create_words(file_path: str, tag_name: str):
-    add_tag = sqlite_insert(Tag).values({"name": tag_name}).on_conflict_do_nothing([Tag.name])
-    session.execute(add_tag)
-    # need to get the id of the tag (kind of messy)
-    session.commit()
-    tag_id = session.scalar(select(Tag.id).filter(Tag.name == tag_name))
-    assert tag_id is not None
-    with open(file_path, "r") as f:
-        phrases = {p.strip() for p in f.readlines()}
-        cards = [{"phrase": phrase} for phrase in phrases]
-        add_cards = sqlite_insert(Card).values(cards).on_conflict_do_nothing([Card.phrase])
-        session.execute(add_cards)
-        groupers = [{"card_phrase": phrase, "tag_id": tag_id} for phrase in phrases]
-        add_groupers = (
-            sqlite_insert(TagCardGrouper)
-            .values(groupers)
-            .on_conflict_do_nothing([TagCardGrouper.card_phrase, TagCardGrouper.tag_id])
+# tables that used to be keyed by the card's phrase -> how to fill the new table from the old one
+CARD_KEYED_TABLES = {
+    "Cards": 'INSERT INTO "Cards" (id, phrase) SELECT rowid, phrase FROM "Cards_old"',
+    "TagCardGroupers": """
+        INSERT INTO "TagCardGroupers" (tag_id, card_id)
+        SELECT old.tag_id, card.rowid FROM "TagCardGroupers_old" old
+        JOIN "Cards_old" card ON card.phrase = old.card_phrase
+    """,
+    # keeps the rowids since those are what the pages use to say which card was clicked
+    "GameCards": """
+        INSERT INTO "GameCards" (rowid, is_guessed, card_id, game_code, kind, "index")
+        SELECT old.rowid, old.is_guessed, card.rowid, old.game_code, old.kind, old."index"
+        FROM "GameCards_old" old JOIN "Cards_old" card ON card.phrase = old.card_phrase
+    """,
+    "Selections": """
+        INSERT INTO "Selections" (token, game_code, card_id)
+        SELECT old.token, old.game_code, card.rowid FROM "Selections_old" old
+        LEFT JOIN "Cards_old" card ON card.phrase = old.card_phrase
+    """,
+}
+
+
+def migrate_card_ids():
+    """Rewrites a database from when cards were keyed by their phrase so they're keyed by an
+    integer id, does nothing if it already is"""
+    with engine.begin() as conn:
+        card_columns = {row[1] for row in conn.exec_driver_sql('PRAGMA table_info("Cards")')}
+        if not card_columns or "id" in card_columns:
+            return
+        # pysqlite doesn't start the transaction until the first insert, without this a failure
+        #    part way through would leave the tables renamed
+        conn.exec_driver_sql("BEGIN")
+        for table_name in CARD_KEYED_TABLES:
+            indexes = conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?"
+                " AND name NOT LIKE 'sqlite_autoindex%'",
+                (table_name,),
+            ).scalars()
+            # index names have to be free for the new tables
+            for index_name in indexes.all():
+                conn.exec_driver_sql(f'DROP INDEX "{index_name}"')
+            conn.exec_driver_sql(f'ALTER TABLE "{table_name}" RENAME TO "{table_name}_old"')
+        tables = [Base.metadata.tables[table_name] for table_name in CARD_KEYED_TABLES]
+        Base.metadata.create_all(conn, tables=tables)
+        for copy_rows in CARD_KEYED_TABLES.values():
+            conn.exec_driver_sql(copy_rows)
+        for table_name in reversed(CARD_KEYED_TABLES):
+            conn.exec_driver_sql(f'DROP TABLE "{table_name}_old"')
+        bump_cards_generation(conn)  # pyright: ignore
+    invalidate_card_index()
+
+
+def migrate_database():
+    """Brings an existing database up to date with the models, missing tables are made and
+    columns and indexes that were added since the database was made are added on"""
+    Base.metadata.create_all(engine)
+    migrate_card_ids()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            table_info = conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')
+            existing = {row[1] for row in table_info}
+            for column in table.columns:
+                if column.name in existing or column.system:
+                    continue
+                column_type = column.type.compile(engine.dialect)
+                add_column = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                if column.server_default is not None:
+                    add_column += f" DEFAULT {column.server_default.arg}"  # pyright: ignore
+                conn.exec_driver_sql(add_column)
+        # create_all only makes indexes along with a new table
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        # lets the query planner know about the new indexes
+        conn.exec_driver_sql("ANALYZE")
+
+
+def create_words(file_path: str, tag_name: str, dry_run: bool = False, sync: bool = False):
+    report_packs(load_packs([(file_path, tag_name)], dry_run=dry_run, sync=sync), dry_run)
+
+
+def report_packs(all_stats: list[PackStats], dry_run: bool):
+    for stats in all_stats:
+        if stats.unchanged:
+            print(f"{stats.file_path} ({stats.tag_name}): unchanged since it was last synced")
+            continue
+        print(
+            f"{stats.file_path} ({stats.tag_name}): {stats.lines:,} lines,"
+            f" {stats.blank_lines:,} blank, {stats.repeated_lines:,} repeated,"
+            f" {stats.cards_added:,} new cards, {stats.tag_cards_added:,} new in the tag,"
+            f" {stats.tag_cards_removed:,} taken out of the tag, {stats.cards_removed:,} deleted"
         )
-        session.execute(add_groupers)
-    session.commit()
+    if dry_run:
+        print("dry run, nothing was written")
 
 
 BASE_CARDS_DIR = "cards"
@@ -43,12 +123,15 @@ BASE_CARDS_DIR = "cards"
 # each file in the cards folder represents a group of words
 #   under a single tag/ category e.i. computer science
 # words may be parts of many different categorys
-def create_default_words():
+def create_default_words(dry_run: bool = False, sync: bool = False):
     # related words for computer science found from the relatedwords.io game
     files_tags_to_source_from = [("compsci.txt", "Computer Science"), ("general.txt", "Base Game")]
 
-    for file_name, tag in files_tags_to_source_from:
-        create_words(os.path.join(BASE_CARDS_DIR, file_name), tag)
+    packs = [
+        (os.path.join(BASE_CARDS_DIR, file_name), tag)
+        for file_name, tag in files_tags_to_source_from
+    ]
+    report_packs(load_packs(packs, dry_run=dry_run, sync=sync), dry_run)
 
 
 if __name__ == "__main__":
@@ -57,15 +140,44 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(dest="command")
     load_parser = subparsers.add_parser("load")
     load_parser.add_argument("type", help="Type to load", choices=["cards", "database"])
-    load_parser.add_argument("--file_path", help="File path to load cards from")
-    load_parser.add_argument("--tag", help="Tag for the loaded cards")
+    load_parser.add_argument("--file_path", nargs="+", help="File paths to load cards from")
+    load_parser.add_argument("--tag", nargs="+", help="Tag for the cards of each file")
+    load_parser.add_argument(
+        "--dry-run", action="store_true", help="Report what would be loaded without writing it"
+    )
+    load_parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Skip unchanged packs and take phrases that were removed from a pack out of its tag",
+    )
+    subparsers.add_parser("migrate", help="Update an existing database to the current models")
+    codes_parser = subparsers.add_parser("codes", help="Show how much of the code space is used")
+    codes_parser.add_argument("--length", type=int, default=GAME_CODE_SIZE, help="Code length")
+    assets_parser = subparsers.add_parser(
+        "assets", help="Vendor the cdn files and build fingerprinted, compressed copies of assets"
+    )
+    assets_parser.add_argument(
+        "--offline", action="store_true", help="Only build from files that are already here"
+    )
     args = parser.parse_args()
     if args.command == "load":
         if args.type == "cards":
             if args.file_path:
-                assert args.tag is not None
-                create_words(args.file_path, args.tag)
+                assert args.tag is not None and len(args.tag) == len(args.file_path)
+                packs = list(zip(args.file_path, args.tag))
+                all_stats = load_packs(packs, dry_run=args.dry_run, sync=args.sync)
+                report_packs(all_stats, args.dry_run)
             else:
-                create_default_words()
+                create_default_words(args.dry_run, args.sync)
         elif args.type == "database":
             simple_create_database()
+    elif args.command == "migrate":
+        migrate_database()
+    elif args.command == "codes":
+        with db_session() as session:
+            used, total = code_space_usage(session, args.length)
+        print(f"{used}/{total} ({used / total:.6%}) codes of length {args.length} used")
+    elif args.command == "assets":
+        if not args.offline:
+            vendor_assets()
+        build_assets()
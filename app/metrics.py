@@ -0,0 +1,333 @@
+"""Counters, gauges and histograms of what the server is doing, served on `/metrics` in the
+prometheus text format
+
+A metric is a few dict lookups and additions to update so they're always on. The modules that own
+something register a metric for it (the store its live games, the broadcaster its sockets) and
+the middleware here times every request along with the sql statements it ran.
+
+Without `CODENAMES_METRICS_TOKEN` only the machine itself and private networks can see them. Behind
+a reverse proxy every request looks like it comes from a private address, so set the token there
+and scrape with an `Authorization: Bearer <token>` header.
+"""
+
+import hmac
+import ipaddress
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Iterator
+from sqlalchemy import event
+from starlette.routing import BaseRoute
+from models.config import engine
+
+# seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_TOKEN = os.getenv("CODENAMES_METRICS_TOKEN", "")
+
+Labels = tuple[str, ...]
+# every metric there is in the order they were made
+registry: list["Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # the database threads update some metrics while the event loop updates others
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            f"{self.name}{_label_text(self.labels, label_values)} {_number(value)}"
+            for label_values, value in values
+        ]
+
+
+class Collected(Metric):
+    """A metric read from whatever owns it when the metrics are asked for, `read` gives the value
+    or a value for each set of label values"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], float | dict[Labels, float]],
+        kind: str = "gauge",
+        labels: Labels = (),
+    ):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.read = read
+
+    def samples(self) -> list[str]:
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_label_text(self.labels, label_values)} {_number(value)}"
+            for label_values, value in values.items()
+        ]
+
+
+@dataclass
+class HistogramValues:
+    # how many observations fell in each bucket (not counting the ones before it), the last one
+    #    is +Inf
+    buckets: list[int]
+    sum: float = 0
+    count: int = 0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        labels: Labels = (),
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.values: dict[Labels, HistogramValues] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self.lock:
+            values = self.values.get(label_values)
+            if values is None:
+                values = HistogramValues([0] * (len(self.buckets) + 1))
+                self.values[label_values] = values
+            values.buckets[bisect_left(self.buckets, value)] += 1
+            values.sum += value
+            values.count += 1
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = [
+                (label_values, list(v.buckets), v.sum, v.count)
+                for label_values, v in self.values.items()
+            ]
+        lines = []
+        for label_values, buckets, total, count in values:
+            cumulative = 0
+            bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, bucket in zip(bounds, buckets):
+                cumulative += bucket
+                le = _label_text(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _label_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "".join(metric.render() for metric in registry)
+
+
+request_seconds = Histogram(
+    "codenames_http_request_seconds",
+    "Time taken to answer a request by the route that answered it",
+    labels=("route", "method"),
+)
+requests_total = Counter(
+    "codenames_http_requests_total",
+    "Requests answered by the route that answered them and the status",
+    labels=("route", "method", "status"),
+)
+request_statements = Histogram(
+    "codenames_http_request_sql_statements",
+    "Sql statements a request ran",
+    COUNT_BUCKETS,
+    labels=("route",),
+)
+request_sql_seconds = Histogram(
+    "codenames_http_request_sql_seconds",
+    "Time a request spent in sql statements",
+    labels=("route",),
+)
+statements_total = Counter(
+    "codenames_sql_statements_total", "Sql statements run, including the ones behind requests"
+)
+sql_seconds_total = Counter(
+    "codenames_sql_seconds_total", "Time spent in sql statements, including behind requests"
+)
+
+
+class RequestQueries:
+    """The sql statements run on behalf of one request (or broadcast)"""
+
+    __slots__ = ("statements", "seconds", "recorded", "finished")
+
+    def __init__(self, record: bool = False):
+        self.statements = 0
+        self.seconds = 0.0
+        # every statement and its parameters when something is looking over them
+        self.recorded: list[tuple[str, object]] | None = [] if record else None
+        # tasks started during the request carry it along in their context after it's done
+        self.finished = False
+
+
+# set for the length of a request, the database threads get a copy of the context so the
+#    statements they run are counted for the request that asked for them
+current_queries: ContextVar[RequestQueries | None] = ContextVar("current_queries", default=None)
+# other modules look over the statements a request ran through these (like the query budgets),
+#    statements are only recorded while there are any
+query_checks: list[Callable[[str, RequestQueries], None]] = []
+
+
+@contextmanager
+def tracked_queries(name: Callable[[], str] | str) -> Iterator[RequestQueries]:
+    """Counts the statements run inside for `name`, which can be worked out once they're done"""
+    queries = RequestQueries(record=bool(query_checks))
+    token = current_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        current_queries.reset(token)
+        queries.finished = True
+        if query_checks:
+            finished_name = name if isinstance(name, str) else name()
+            for check in query_checks:
+                check(finished_name, queries)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info["statement_started"] = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("statement_started", time.perf_counter())
+    statements_total.inc()
+    sql_seconds_total.inc(amount=elapsed)
+    queries = current_queries.get()
+    if queries is not None and not queries.finished:
+        queries.statements += 1
+        queries.seconds += elapsed
+        if queries.recorded is not None:
+            queries.recorded.append((statement, parameters))
+
+
+# route endpoint -> its route, so a label is the route rather than every url
+_routes: dict[object, BaseRoute] = {}
+
+
+def _route(scope) -> BaseRoute | None:
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return None
+    route = _routes.get(endpoint)
+    if route is None:
+        for route in scope["app"].router.routes:
+            if hasattr(route, "endpoint"):
+                _routes[route.endpoint] = route
+        route = _routes.get(endpoint)
+    return route
+
+
+def route_path(scope) -> str:
+    return getattr(_route(scope), "path", "unmatched")
+
+
+def route_name(scope) -> str:
+    return getattr(_route(scope), "name", "unmatched")
+
+
+class MetricsMiddleware:
+    """Times every request and counts the sql statements it ran"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        with tracked_queries(lambda: route_name(scope)) as queries:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                elapsed = time.perf_counter() - start
+                route = route_path(scope)
+                method = scope["method"]
+                request_seconds.observe(elapsed, route, method)
+                requests_total.inc(route, method, str(status))
+                request_statements.observe(queries.statements, route)
+                request_sql_seconds.observe(queries.seconds, route)
+
+
+def is_internal(host: str | None) -> bool:
+    """Only the machine itself and private networks (like a docker network) can see the metrics"""
+    if host is None:
+        return False
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+def can_see_metrics(host: str | None, authorization: str | None) -> bool:
+    """With a token set only a scraper sending it can see the metrics, wherever it is"""
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        return hmac.compare_digest((authorization or "").encode(), expected.encode())
+    return is_internal(host)
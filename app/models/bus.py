@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import DateTime, Integer, String, delete, func, insert, select
+from sqlalchemy.orm import Mapped, mapped_column
+from models.config import Base, DbSession, run_db
+from models.events import GameEventKind
+
+# how the workers tell each other about changes to games
+#    "process" is for a single worker, every socket is already connected to it
+#    "sqlite" is for several workers (or containers sharing the database file) serving the same
+#        games, each one fans a change out to only its own sockets
+BUS_BACKEND = os.getenv("CODENAMES_BUS", "process")
+BUS_POLL_SECONDS = 0.025
+# every worker has long since seen changes this old
+CHANGE_KEEP_SECONDS = 60
+PRUNE_EVERY_SECONDS = 10
+# so a worker can skip the changes it published itself
+WORKER_ID = secrets.token_hex(8)
+
+logger = logging.getLogger("codenames.bus")
+
+
+@dataclass
+class GameChange:
+    """A change one worker made to a game, enough for the others to make it to their copy"""
+
+    game_code: str
+    version: int
+    """the version of the game the change made"""
+    kind: GameEventKind
+    index: int | None = None
+    token: str | None = None
+    """whose selection it was"""
+    next_game_code: str | None = None
+
+
+class GameChangeRow(Base):
+    __tablename__ = "GameChanges"
+    # without it sqlite hands out the ids of deleted rows again once the table is emptied, and the
+    #    workers would skip changes until the ids passed the last one they saw
+    __table_args__ = {"sqlite_autoincrement": True}
+    id: Mapped[int] = mapped_column(Integer(), primary_key=True, autoincrement=True)
+    worker: Mapped[str] = mapped_column(String())
+    game_code: Mapped[str] = mapped_column(String())
+    version: Mapped[int] = mapped_column(Integer())
+    kind: Mapped[str] = mapped_column(String())
+    index: Mapped[Optional[int]] = mapped_column(Integer())
+    token: Mapped[Optional[str]] = mapped_column(String())
+    next_game_code: Mapped[Optional[str]] = mapped_column(String())
+    created: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+
+
+Deliver = Callable[[list[GameChange]], Awaitable[None]]
+
+
+class ProcessBus:
+    """Nothing to tell anyone, there are no other workers"""
+
+    def publish(self, db: DbSession, change: GameChange):
+        pass
+
+    async def run(self, deliver: Deliver):
+        pass
+
+
+class SqliteBus:
+    """Changes are written to a table in the same transaction as the change itself and every
+    worker polls it for the ones the others made, the ids give every worker the same order"""
+
+    def __init__(self, poll_seconds: float = BUS_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+
+    def publish(self, db: DbSession, change: GameChange):
+        db.execute(
+            insert(GameChangeRow).values(
+                worker=WORKER_ID,
+                game_code=change.game_code,
+                version=change.version,
+                kind=change.kind.value,
+                index=change.index,
+                token=change.token,
+                next_game_code=change.next_game_code,
+            )
+        )
+
+    @staticmethod
+    def _newest_id(db: DbSession) -> int:
+        return db.scalar(select(func.max(GameChangeRow.id))) or 0
+
+    @staticmethod
+    def _changes_after(db: DbSession, last_id: int) -> tuple[int, list[GameChange]]:
+        rows = db.execute(
+            select(
+                GameChangeRow.id,
+                GameChangeRow.worker,
+                GameChangeRow.game_code,
+                GameChangeRow.version,
+                GameChangeRow.kind,
+                GameChangeRow.index,
+                GameChangeRow.token,
+                GameChangeRow.next_game_code,
+            )
+            .filter(GameChangeRow.id > last_id)
+            .order_by(GameChangeRow.id)
+        ).all()
+        changes = [
+            GameChange(game_code, version, GameEventKind(kind), index, token, next_game_code)
+            for _, worker, game_code, version, kind, index, token, next_game_code in rows
+            if worker != WORKER_ID
+        ]
+        return (rows[-1].id if rows else last_id), changes
+
+    @staticmethod
+    def _prune(db: DbSession):
+        cutoff = datetime.now() - timedelta(seconds=CHANGE_KEEP_SECONDS)
+        # the newest is always kept so a table made before it was autoincrement doesn't go back
+        #    to handing out old ids either
+        newest = select(func.max(GameChangeRow.id)).scalar_subquery()
+        db.execute(
+            delete(GameChangeRow)
+            .filter(GameChangeRow.created < cutoff)
+            .filter(GameChangeRow.id != newest)
+        )
+        db.commit()
+
+    async def run(self, deliver: Deliver):
+        last_id = await run_db(self._newest_id)
+        last_pruned = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                last_id, changes = await run_db(lambda db: self._changes_after(db, last_id))
+                if changes:
+                    await deliver(changes)
+                if time.monotonic() - last_pruned > PRUNE_EVERY_SECONDS:
+                    last_pruned = time.monotonic()
+                    await run_db(self._prune)
+            except Exception:
+                logger.exception("Reading the change feed failed")
+
+
+def make_bus(backend: str = BUS_BACKEND) -> ProcessBus | SqliteBus:
+    if backend == "process":
+        return ProcessBus()
+    if backend == "sqlite":
+        return SqliteBus()
+    raise ValueError(f"Unknown bus `{backend}`, use process or sqlite")
+
+
+bus = make_bus()
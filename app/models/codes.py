@@ -0,0 +1,116 @@
+import hashlib
+import secrets
+import string
+import threading
+from collections import deque
+from sqlalchemy import Integer, String, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column
+from models.config import Base, DbSession, db_session
+from models.errors import CodeSpaceExhausted
+from models.game import GAME_CODE_SIZE, Game
+
+# game codes are handed out by walking a counter through a keyed shuffle of every possible code,
+#    so no two counts can ever make the same code and the codes still look random
+CODE_ALPHABET = string.ascii_uppercase
+# how many counts a worker takes for itself at once, the only database trip is once per block
+CODE_BLOCK_SIZE = 64
+FEISTEL_ROUNDS = 4
+
+
+class GameCodeRange(Base):
+    """How far the counter has gotten for codes of a length, shared between every worker"""
+
+    __tablename__ = "GameCodeRanges"
+    length: Mapped[int] = mapped_column(Integer(), primary_key=True)
+    next_count: Mapped[int] = mapped_column(Integer(), default=0)
+    # what the shuffle is keyed with, made once per length
+    key: Mapped[str] = mapped_column(String())
+
+
+def code_space(length: int) -> int:
+    return len(CODE_ALPHABET) ** length
+
+
+def _shuffle(count: int, key: bytes, space: int) -> int:
+    """A one to one mapping of [0, space) onto itself, a feistel network over enough bits to
+    cover the space and walked until it lands back inside of it"""
+    bits = max(2, (space - 1).bit_length())
+    bits += bits % 2
+    half = bits // 2
+    mask = (1 << half) - 1
+    value = count
+    while True:
+        left, right = value >> half, value & mask
+        for round_number in range(FEISTEL_ROUNDS):
+            digest = hashlib.blake2b(
+                right.to_bytes(8, "big"),
+                key=key,
+                salt=round_number.to_bytes(16, "big"),
+                digest_size=8,
+            ).digest()
+            left, right = right, left ^ (int.from_bytes(digest, "big") & mask)
+        value = (left << half) | right
+        if value < space:
+            return value
+
+
+def _to_code(value: int, length: int) -> str:
+    letters = []
+    for _ in range(length):
+        value, letter = divmod(value, len(CODE_ALPHABET))
+        letters.append(CODE_ALPHABET[letter])
+    return "".join(letters)
+
+
+def _reserve_block(length: int) -> list[str]:
+    space = code_space(length)
+    # its own transaction so the block is taken for good even if whatever wanted the code
+    #    rolls back, other workers only ever see blocks that were committed
+    with db_session() as db:
+        db.execute(
+            sqlite_insert(GameCodeRange)
+            .values(length=length, next_count=0, key=secrets.token_hex(16))
+            .on_conflict_do_nothing()
+        )
+        next_count, key = db.execute(
+            update(GameCodeRange)
+            .where(GameCodeRange.length == length)
+            .values(next_count=GameCodeRange.next_count + CODE_BLOCK_SIZE)
+            .returning(GameCodeRange.next_count, GameCodeRange.key)
+        ).one()
+        db.commit()
+        start = next_count - CODE_BLOCK_SIZE
+        if start >= space:
+            raise CodeSpaceExhausted(f"Every game code of length {length} has been used", length)
+        key_bytes = bytes.fromhex(key)
+        codes = [
+            _to_code(_shuffle(count, key_bytes, space), length)
+            for count in range(start, min(next_count, space))
+        ]
+        # games from before codes were handed out like this were just random
+        taken = set(db.scalars(select(Game.code).filter(Game.code.in_(codes))))
+    return [code for code in codes if code not in taken]
+
+
+# length -> codes this worker has reserved but not handed out yet
+_reserved: dict[int, deque[str]] = {}
+_reserved_lock = threading.Lock()
+
+
+def allocate_game_code(length: int = GAME_CODE_SIZE) -> str:
+    """A game code nobody has had before, this can write to the database so it has to be called
+    before the calling thread starts using its own session"""
+    with _reserved_lock:
+        reserved = _reserved.setdefault(length, deque())
+        while not reserved:
+            reserved.extend(_reserve_block(length))
+        return reserved.popleft()
+
+
+def code_space_usage(db: DbSession, length: int = GAME_CODE_SIZE) -> tuple[int, int]:
+    """How many codes of the length have been taken (handed out or reserved by a worker) and how
+    many there are in total"""
+    next_count = db.scalar(select(GameCodeRange.next_count).filter(GameCodeRange.length == length))
+    space = code_space(length)
+    return min(next_count or 0, space), space
@@ -1,6 +1,10 @@
-from typing import Type, TypeVar, Tuple
-from sqlalchemy import create_engine, Integer, select, Select
-from sqlalchemy.orm import Mapped, Session, mapped_column
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, Type, TypeVar, Tuple
+import anyio.to_thread
+from anyio import CapacityLimiter
+from sqlalchemy import create_engine, event, Integer, select, Select
+from sqlalchemy.orm import Mapped, Session as DbSession, mapped_column, sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
 T = TypeVar("T")
@@ -10,9 +14,9 @@ class Base(DeclarativeBase):
     rowid: Mapped[int] = mapped_column(Integer, system=True)
 
     @classmethod
-    def get(cls: Type[T], rowid: int) -> T:
+    def get(cls: Type[T], db: DbSession, rowid: int) -> T:
         """Get the element with the sqlite rowid"""
-        result = session.scalar(select(cls).filter(cls.rowid == rowid))  # pyright: ignore
+        result = db.scalar(select(cls).filter(cls.rowid == rowid))  # pyright: ignore
         assert result is not None
         return result
 
@@ -22,8 +26,77 @@ class Base(DeclarativeBase):
         return select(cls).filter(cls.rowid == rowid)  # pyright: ignore
 
 
+@dataclass
+class StorageProfile:
+    """The pragmas every sqlite connection is opened with"""
+
+    # wal lets the request threads read while the write behind task is writing
+    journal_mode: str = "wal"
+    # in wal mode normal only syncs at checkpoints, a crash can lose the newest commits but never
+    #    corrupts the database
+    synchronous: str = "normal"
+    # bytes of the file read through a memory map instead of read calls, 0 turns it off
+    mmap_size: int = 256 * 1024 * 1024
+    # negative is in KiB instead of pages
+    cache_size: int = -64 * 1024
+    # milliseconds a connection waits on another one's write lock before giving up
+    busy_timeout: int = 5000
+
+    def pragmas(self) -> list[str]:
+        return [
+            f"PRAGMA journal_mode={self.journal_mode}",
+            f"PRAGMA synchronous={self.synchronous}",
+            f"PRAGMA mmap_size={self.mmap_size}",
+            f"PRAGMA cache_size={self.cache_size}",
+            f"PRAGMA busy_timeout={self.busy_timeout}",
+        ]
+
+
 # Database configuration
 DB_URI = "sqlite:///cards.db"
-# Create the engine and session
+# change this before the first connection is made to use a different profile
+storage_profile = StorageProfile()
+# Create the engine and session factory
 engine = create_engine(DB_URI)
-session = Session(engine)
+make_db_session = sessionmaker(engine)
+
+
+def apply_storage_profile(dbapi_connection, profile: StorageProfile):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in profile.pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+@event.listens_for(engine, "connect")
+def _on_connect(dbapi_connection, _):
+    apply_storage_profile(dbapi_connection, storage_profile)
+
+
+# sqlite calls block so anything a request needs from the database is done on one of these
+#    threads with its own session, that way the event loop (and every websocket) keeps moving
+DB_THREADS = 8
+_db_limiter: CapacityLimiter | None = None
+
+
+@contextmanager
+def db_session() -> Iterator[DbSession]:
+    """A session for code that is already off the event loop, like sync routes (which starlette
+    runs on its threadpool) or `manage.py`"""
+    with make_db_session() as db:
+        yield db
+
+
+async def run_db(work: Callable[[DbSession], T]) -> T:
+    """Runs `work` on a database thread with a session that only lives for that call"""
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = CapacityLimiter(DB_THREADS)
+
+    def in_session() -> T:
+        with make_db_session() as db:
+            return work(db)
+
+    return await anyio.to_thread.run_sync(in_session, limiter=_db_limiter)
@@ -3,3 +3,9 @@ class NotEnoughCards(Exception):
         super().__init__(message)
         self.needed_cards = needed_cards
         self.cards_left = cards_left
+
+
+class CodeSpaceExhausted(Exception):
+    def __init__(self, message, length: int):
+        super().__init__(message)
+        self.length = length
@@ -0,0 +1,57 @@
+from collections import deque
+from enum import Enum
+from typing import NamedTuple
+
+# how many of the newest changes to a game are kept around for catching clients up, anyone
+#    further behind than this just gets the whole game again
+EVENT_LOG_SIZE = 64
+
+
+class GameEventKind(Enum):
+    GUESS = "guess"
+    SELECT = "select"
+    UNSELECT = "unselect"
+    NEW_GAME = "new_game"
+
+
+class GameEvent(NamedTuple):
+    version: int
+    """the version of the game this event made"""
+    kind: GameEventKind
+    # named so it doesn't shadow tuple's own index()
+    card_index: int | None = None
+    """index of the card the event was about"""
+
+
+def guessed_indexes(events: list[GameEvent]) -> list[int]:
+    """The cards guessed in the events in board order"""
+    return sorted(
+        {
+            event.card_index
+            for event in events
+            if event.kind == GameEventKind.GUESS and event.card_index is not None
+        }
+    )
+
+
+class EventLog:
+    """The newest events of a single game, the oldest fall off once it's full"""
+
+    __slots__ = ("events",)
+
+    def __init__(self, size: int = EVENT_LOG_SIZE):
+        self.events: deque[GameEvent] = deque(maxlen=size)
+
+    def append(self, event: GameEvent):
+        self.events.append(event)
+
+    def since(self, version: int, current_version: int) -> list[GameEvent] | None:
+        """The events that happened after the version, None if they aren't all in the log
+        anymore (or the version never existed) and the whole game needs to be sent"""
+        if version == current_version:
+            return []
+        if version > current_version or not self.events:
+            return None
+        if self.events[0].version > version + 1:
+            return None
+        return [event for event in self.events if event.version > version]
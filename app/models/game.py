@@ -4,23 +4,25 @@ from sqlalchemy import (
     Integer,
     String,
     Boolean,
+    LargeBinary,
     Enum,
     DateTime,
     UniqueConstraint,
     ForeignKeyConstraint,
+    Index,
 )
 import random
-import string
-from sqlalchemy.sql.expression import func
 from fasthtml.ft import *
-from models.config import Base, session
+from models.config import Base, DbSession
 from models.errors import *
+from models.sampler import CardIndex, CardSet, card_index
 from sqlalchemy import select
 from make_app import TOKEN_SIZE
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Mapped, validates
 from sqlalchemy.orm import mapped_column, relationship
 from enum import Enum as PyEnum
-from typing import Optional
+from typing import NamedTuple, Optional
 
 CARDS_PER_GAME = 25
 GUESS_AMOUNT = 8
@@ -31,9 +33,40 @@ CARDS_PER_ROW = 5
 GAME_CODE_SIZE = 6
 
 
+# bumped every time cards are loaded so servers know to rebuild what they keep about the cards
+CARDS_GENERATION = "cards_generation"
+
+
+# things about the database itself, not called Meta so it doesn't hide fasthtml's Meta tag
+class MetaRow(Base):
+    __tablename__ = "Meta"
+    key: Mapped[str] = mapped_column(String(), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer(), default=0)
+
+
+def cards_generation(db: DbSession) -> int:
+    return db.scalar(select(MetaRow.value).filter(MetaRow.key == CARDS_GENERATION)) or 0
+
+
+def bump_cards_generation(db: DbSession):
+    db.execute(
+        sqlite_insert(MetaRow)
+        .values(key=CARDS_GENERATION, value=1)
+        .on_conflict_do_update([MetaRow.key], set_={MetaRow.value: MetaRow.value + 1})
+    )
+
+
+# this is wrong but it is consistantly wrong so idrc
+def to_row_col(index: int) -> tuple[int, int]:
+    row, col = divmod(index, CARDS_PER_ROW)
+    return (row if row != 0 else CARDS_PER_ROW, col if col != 0 else CARDS_PER_ROW)
+
+
 class Card(Base):
     __tablename__ = "Cards"
-    phrase: Mapped[str] = mapped_column(String(), primary_key=True)
+    # the same as the rowid, everything else keys cards by this instead of their phrase
+    id: Mapped[int] = mapped_column(Integer(), primary_key=True, autoincrement=True)
+    phrase: Mapped[str] = mapped_column(String(), unique=True)
 
     game_cards: Mapped[list["GameCard"]] = relationship(back_populates="card")
     tag_card_groupers: Mapped[list["TagCardGrouper"]] = relationship(back_populates="card")
@@ -52,7 +85,10 @@ class Tag(Base):
 class TagCardGrouper(Base):
     __tablename__ = "TagCardGroupers"
     tag_id: Mapped[str] = mapped_column(String(), ForeignKey("Tags.id"), primary_key=True)
-    card_phrase: Mapped[str] = mapped_column(String(), ForeignKey("Cards.phrase"), primary_key=True)
+    # tag_id already leads the primary key's index, this is for going from a card to its tags
+    card_id: Mapped[int] = mapped_column(
+        Integer(), ForeignKey("Cards.id"), primary_key=True, index=True
+    )
 
     tag: Mapped["Tag"] = relationship(back_populates="tag_card_groupers")
     card: Mapped["Card"] = relationship(back_populates="tag_card_groupers")
@@ -66,11 +102,18 @@ class Session(Base):
     id: Mapped[int] = mapped_column(Integer(), primary_key=True, autoincrement=True)
     name: Mapped[Optional[str]] = mapped_column(String())
     date_created: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+    # every card id the session's games have used as a compressed `CardSet`, None for sessions
+    #    from before this was kept
+    used_cards: Mapped[Optional[bytes]] = mapped_column(LargeBinary())
 
     session_tag_groupers: Mapped[list["SessionTagGrouper"]] = relationship(back_populates="session")
     games: Mapped[list["Game"]] = relationship(back_populates="session")
 
-    def create_game(self) -> "Game":
+    def create_game(
+        self, db: DbSession, code: str, is_claimed: bool = True, index: CardIndex | None = None
+    ) -> "Game":
+        """Makes the next game of the session, the code should come from `allocate_game_code`,
+        `index` saves looking up the card index again when the caller already has it"""
         # figure out who goes first and gets the additional
         #     card
         if random.random() < 0.5:
@@ -80,33 +123,26 @@ class Session(Base):
             red = [GameCardKind.RED] * GUESS_AMOUNT
             blue = [GameCardKind.BLUE] * (GUESS_AMOUNT + 1)
 
-        # TODO ensure random string is not already in the db
-        random_string = "".join(random.choices(string.ascii_uppercase, k=GAME_CODE_SIZE))
-        game = Game(code=random_string, session_id=self.id)
-        session.add(game)
+        game = Game(code=code, session_id=self.id, is_claimed=is_claimed)
+        db.add(game)
+        # writing the game takes the database's write lock until the commit, so the used cards
+        #    read after it can't be changed by another worker before they're written back
+        db.flush()
 
         # get the random cards for the next game
-        previous_phrases_in_session = (
-            select(GameCard.card_phrase).join(Game).filter(Game.session_id == self.id)
-        )
-        tags = (
-            select(Tag.id).join(SessionTagGrouper).filter(SessionTagGrouper.session_id == self.id)
-        )
-        random_cards = session.scalars(
-            select(Card)
-            .join(TagCardGrouper)
-            .filter(~Card.phrase.in_(previous_phrases_in_session))
-            .filter(TagCardGrouper.tag_id.in_(tags))
-            .order_by(func.random())
-            .limit(CARDS_PER_GAME)
-        ).all()
-
-        if len(random_cards) != CARDS_PER_GAME:
-            session.rollback()
+        if index is None:
+            index = current_card_index(db)
+        previous_cards_in_session = session_used_cards(db, self.id)
+        tag_ids = session_tag_ids(db, self.id)
+        random_card_ids = index.sample(tag_ids, previous_cards_in_session, CARDS_PER_GAME)
+
+        if len(random_card_ids) != CARDS_PER_GAME:
+            db.rollback()
+            # when there aren't enough the sample is every card that was left
+            index.sessions_cards_left[self.id] = len(random_card_ids)
             raise NotEnoughCards(
-                "Need more cards", needed_cards=CARDS_PER_GAME, cards_left=len(random_cards)
+                "Need more cards", needed_cards=CARDS_PER_GAME, cards_left=len(random_card_ids)
             )
-
         # create all game cards
         black = [GameCardKind.BLACK] * BLACK_AMOUNT
         tan = [GameCardKind.TAN] * (CARDS_PER_GAME - (GUESS_AMOUNT * 2 + 1) - BLACK_AMOUNT)
@@ -115,25 +151,38 @@ class Session(Base):
         game_cards = [
             GameCard(
                 is_guessed=False,
-                card_phrase=card.phrase,
+                card_id=card_id,
                 game_code=game.code,
                 index=i,
                 kind=kind,
             )
-            for i, (card, kind) in enumerate(zip(random_cards, kinds))
+            for i, (card_id, kind) in enumerate(zip(random_card_ids, kinds))
         ]
-        session.add_all(game_cards)
-        session.commit()
+        db.add_all(game_cards)
+        previous_cards_in_session.update(random_card_ids)
+        self.used_cards = previous_cards_in_session.to_blob()
+        db.commit()
+        cards_left = index.sessions_cards_left.get(self.id)
+        if cards_left is None:
+            # counted with this game's cards already used
+            cards_left = count_cards_left(index, tag_ids, previous_cards_in_session)
+        else:
+            cards_left -= CARDS_PER_GAME
+        index.sessions_cards_left[self.id] = cards_left
         return game
 
 
 class Game(Base):
     __tablename__ = "Games"
     code: Mapped[str] = mapped_column(String(), primary_key=True)
-    session_id: Mapped[int] = mapped_column(Integer(), ForeignKey("Sessions.id"))
+    session_id: Mapped[int] = mapped_column(Integer(), ForeignKey("Sessions.id"), index=True)
     # integrity does not really matter as much for this because it should only be used
     #   to match game state
     last_updated: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+    # goes up with every change to the game, clients use it to only ask for what they missed
+    version: Mapped[int] = mapped_column(Integer(), default=0, server_default="0")
+    # games made ahead of time can't be found or played until "Next Game" claims them
+    is_claimed: Mapped[bool] = mapped_column(Boolean(), default=True, server_default="1")
 
     cards: Mapped[list["GameCard"]] = relationship(back_populates="game")
     session: Mapped["Session"] = relationship(back_populates="games")
@@ -186,8 +235,10 @@ class GameCard(Base):
     __tablename__ = "GameCards"
 
     is_guessed = mapped_column(Boolean())
-    card_phrase: Mapped[str] = mapped_column(String(), ForeignKey("Cards.phrase"), primary_key=True)
-    game_code: Mapped[str] = mapped_column(String(), ForeignKey("Games.code"), primary_key=True)
+    card_id: Mapped[int] = mapped_column(Integer(), ForeignKey("Cards.id"), primary_key=True)
+    game_code: Mapped[str] = mapped_column(
+        String(), ForeignKey("Games.code"), primary_key=True, index=True
+    )
     kind: Mapped[GameCardKind] = mapped_column(Enum(GameCardKind))
     # the index goes from top left to bottom right starting at 0
     index: Mapped[int] = mapped_column(Integer())
@@ -203,23 +254,22 @@ class GameCard(Base):
             raise ValueError(f"Invalid index of {index} must be in range")
         return index
 
-    # this is wrong but it is consistantly wrong so idrc
     def to_row_col(self) -> tuple[int, int]:
-        row, col = divmod(self.index, CARDS_PER_ROW)
-        return (row if row != 0 else CARDS_PER_ROW, col if col != 0 else CARDS_PER_ROW)
+        return to_row_col(self.index)
 
 
 class Selection(Base):
     __tablename__ = "Selections"
     token: Mapped[str] = mapped_column(String(), primary_key=True)
     game_code: Mapped[str] = mapped_column(String(), primary_key=True)
-    card_phrase: Mapped[Optional[str]] = mapped_column(String())
+    card_id: Mapped[Optional[int]] = mapped_column(Integer())
     game_card: Mapped["GameCard"] = relationship(back_populates="selections")
 
     __table_args__ = (
         ForeignKeyConstraint(
-            ["game_code", "card_phrase"], ["GameCards.game_code", "GameCards.card_phrase"]
+            ["game_code", "card_id"], ["GameCards.game_code", "GameCards.card_id"]
         ),
+        Index("ix_Selections_game_code_card_id", "game_code", "card_id"),
     )
 
     # this ensures that people can't mess with the tokens too bad
@@ -229,3 +279,72 @@ class Selection(Base):
         if len(token) > 64:
             raise ValueError("Invalid token size")
         return token
+
+
+def current_card_index(db: DbSession) -> CardIndex:
+    return card_index(
+        cards_generation(db),
+        lambda: db.execute(select(TagCardGrouper.tag_id, TagCardGrouper.card_id)).tuples(),
+    )
+
+
+def session_tag_ids(db: DbSession, session_id: int) -> list[str]:
+    return list(
+        db.scalars(
+            select(SessionTagGrouper.tag_id).filter(SessionTagGrouper.session_id == session_id)
+        )
+    )
+
+
+def session_used_cards(db: DbSession, session_id: int) -> CardSet:
+    used_cards = db.scalar(select(Session.used_cards).filter(Session.id == session_id))
+    if used_cards is not None:
+        return CardSet.from_blob(used_cards)
+    # made before sessions kept their used cards, it gets saved with the session's next game
+    return CardSet(
+        db.scalars(
+            select(GameCard.card_id).join(GameCard.game).filter(Game.session_id == session_id)
+        )
+    )
+
+
+def session_cards_left(db: DbSession, session_id: int, index: CardIndex | None = None) -> int:
+    """How many cards the session could still draw from, worked out once per generation of cards
+    and then kept up as games are made"""
+    if index is None:
+        index = current_card_index(db)
+    cards_left = index.sessions_cards_left.get(session_id)
+    if cards_left is None:
+        tag_ids = session_tag_ids(db, session_id)
+        cards_left = count_cards_left(index, tag_ids, session_used_cards(db, session_id))
+        index.sessions_cards_left[session_id] = cards_left
+    return cards_left
+
+
+def count_cards_left(index: CardIndex, tag_ids: list[str], used: CardSet) -> int:
+    # cards taken out of the tags since they were used don't count against what's left
+    still_in_tags = sum(1 for card_id in used if index.in_any(tag_ids, card_id))
+    return index.tag_set_size(tag_ids) - still_in_tags
+
+
+class TagAvailability(NamedTuple):
+    id: int
+    name: str
+    cards: int
+
+
+# the generation the tags were read at and the tags, they only change when cards are loaded
+_tag_availability: tuple[int, list[TagAvailability]] | None = None
+
+
+def tag_availability(db: DbSession) -> list[TagAvailability]:
+    """Every tag and how many cards it has"""
+    global _tag_availability
+    index = current_card_index(db)
+    if _tag_availability is None or _tag_availability[0] != index.generation:
+        tags = [
+            TagAvailability(tag_id, name, index.tag_size(tag_id))
+            for tag_id, name in db.execute(select(Tag.id, Tag.name).order_by(Tag.id))
+        ]
+        _tag_availability = (index.generation, tags)
+    return _tag_availability[1]
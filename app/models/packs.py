@@ -0,0 +1,359 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterator
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    Select,
+    String,
+    Table,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    select,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column
+from models.config import Base, engine
+from models.game import Card, GameCard, Tag, TagCardGrouper, bump_cards_generation
+from models.sampler import invalidate_card_index
+
+# phrases per executemany, small enough that a reader never holds much of a pack at once
+IMPORT_CHUNK_SIZE = 5000
+# chunks the readers can get ahead of the writer by
+IMPORT_QUEUE_SIZE = 8
+PROGRESS_EVERY_SECONDS = 1.0
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class PackHash(Base):
+    """What a pack file looked like the last time it was synced into its tag"""
+
+    __tablename__ = "PackHashes"
+    file_path: Mapped[str] = mapped_column(String(), primary_key=True)
+    tag_id: Mapped[int] = mapped_column(Integer(), ForeignKey("Tags.id"), primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String())
+    synced_at: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+
+
+@dataclass
+class PackStats:
+    file_path: str
+    tag_name: str
+    lines: int = 0
+    blank_lines: int = 0
+    # lines that were the same as another line in the same chunk
+    repeated_lines: int = 0
+    cards_added: int = 0
+    tag_cards_added: int = 0
+    # only when syncing
+    unchanged: bool = False
+    cards_removed: int = 0
+    tag_cards_removed: int = 0
+
+
+def normalize_phrase(line: str) -> str:
+    return " ".join(line.split())
+
+
+def pack_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_pack(file_path: str, stats: PackStats, chunk_size: int) -> Iterator[list[str]]:
+    """The phrases of a pack a chunk at a time, never more than a chunk of the file in memory"""
+    chunk: dict[str, None] = {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            stats.lines += 1
+            phrase = normalize_phrase(line)
+            if not phrase:
+                stats.blank_lines += 1
+                continue
+            if phrase in chunk:
+                stats.repeated_lines += 1
+                continue
+            chunk[phrase] = None
+            if len(chunk) == chunk_size:
+                yield list(chunk)
+                chunk = {}
+    if chunk:
+        yield list(chunk)
+
+
+# the packs are staged here first so the cards can go in sorted, adding millions of phrases to
+#    the unique index in file order means a random index page for every row
+_staging = Table(
+    "pack_staging",
+    MetaData(),
+    Column("pack", Integer()),
+    Column("phrase", String()),
+    prefixes=["TEMPORARY"],
+)
+_stage_rows = 'INSERT INTO "pack_staging" (pack, phrase) VALUES (?, ?)'
+# what a sync found to be different between a pack and its tag
+_added = Table("pack_added", _staging.metadata, Column("phrase", String()), prefixes=["TEMPORARY"])
+_removed = Table(
+    "pack_removed", _staging.metadata, Column("card_id", Integer()), prefixes=["TEMPORARY"]
+)
+
+
+def tag_id_for(conn: Connection, tag_name: str) -> int:
+    conn.execute(sqlite_insert(Tag).values(name=tag_name).on_conflict_do_nothing([Tag.name]))
+    tag_id = conn.scalar(select(Tag.id).filter(Tag.name == tag_name))
+    assert tag_id is not None
+    return tag_id
+
+
+def save_pack_hash(conn: Connection, file_path: str, tag_id: int, content_hash: str):
+    values = {"content_hash": content_hash, "synced_at": datetime.now()}
+    conn.execute(
+        sqlite_insert(PackHash)
+        .values(file_path=file_path, tag_id=tag_id, **values)
+        .on_conflict_do_update(set_=values)
+    )
+
+
+def _stream(conn: Connection, statement: Select) -> Iterator[tuple]:
+    """The rows of a big select straight from the driver's cursor, going through sqlalchemy's
+    rows costs more than the diffing itself"""
+    compiled = statement.compile(conn)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(str(compiled), params)
+        while rows := cursor.fetchmany(IMPORT_CHUNK_SIZE):
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def _distinct(rows: Iterator[tuple]) -> Iterator[str]:
+    """The first column of sorted rows with the repeats left out"""
+    previous = None
+    for value, *_ in rows:
+        if value != previous:
+            previous = value
+            yield value
+
+
+def diff_pack(conn: Connection, pack: int, tag_id: int) -> int:
+    """Walks the pack's staged phrases and the tag's phrases side by side in order, phrases only
+    in the pack go in the added table and cards only in the tag go in the removed table, returns
+    how many phrases were added"""
+    staged = _distinct(
+        _stream(
+            conn,
+            select(_staging.c.phrase).filter(_staging.c.pack == pack).order_by(_staging.c.phrase),
+        )
+    )
+    current = _stream(
+        conn,
+        select(Card.phrase, Card.id)
+        .join(TagCardGrouper)
+        .filter(TagCardGrouper.tag_id == tag_id)
+        .order_by(Card.phrase),
+    )
+    added: list[dict] = []
+    removed: list[dict] = []
+    added_count = 0
+
+    def flush():
+        if added:
+            conn.execute(insert(_added), added)
+            added.clear()
+        if removed:
+            conn.execute(insert(_removed), removed)
+            removed.clear()
+
+    # sqlite compares text byte by byte which is the same order as python's for utf-8
+    phrase = next(staged, None)
+    for current_phrase, card_id in current:
+        while phrase is not None and phrase < current_phrase:
+            added.append({"phrase": phrase})
+            added_count += 1
+            phrase = next(staged, None)
+        if phrase == current_phrase:
+            phrase = next(staged, None)
+        else:
+            removed.append({"card_id": card_id})
+        if len(added) + len(removed) >= IMPORT_CHUNK_SIZE:
+            flush()
+    while phrase is not None:
+        added.append({"phrase": phrase})
+        added_count += 1
+        phrase = next(staged, None)
+    flush()
+    return added_count
+
+
+def remove_missing(conn: Connection, tag_id: int, stats: PackStats):
+    """Takes the cards in the removed table out of the tag, cards that end up in no tag are
+    deleted unless a game still has them"""
+    removed_ids = select(_removed.c.card_id)
+    stats.tag_cards_removed = conn.execute(
+        delete(TagCardGrouper)
+        .filter(TagCardGrouper.tag_id == tag_id)
+        .filter(TagCardGrouper.card_id.in_(removed_ids))
+    ).rowcount
+    stats.cards_removed = conn.execute(
+        delete(Card)
+        .filter(Card.id.in_(removed_ids))
+        .filter(~exists().where(TagCardGrouper.card_id == Card.id))
+        .filter(~exists().where(GameCard.card_id == Card.id))
+    ).rowcount
+
+
+def add_phrases(conn: Connection, phrases: Select, tag_id: int, stats: PackStats, count: int):
+    """Adds the `phrases` (a select of `count` phrases) that aren't cards yet and puts all of
+    them in the tag"""
+    newest_card_id = conn.scalar(select(func.max(Card.id))) or 0
+    stats.cards_added = conn.execute(
+        sqlite_insert(Card)
+        .from_select([Card.phrase], phrases.order_by(phrases.selected_columns.phrase))
+        .on_conflict_do_nothing()
+    ).rowcount
+    # new cards are the only ones with an id past the newest from before so they don't need to
+    #    be looked up by phrase
+    stats.tag_cards_added = conn.execute(
+        sqlite_insert(TagCardGrouper)
+        .from_select(
+            [TagCardGrouper.tag_id, TagCardGrouper.card_id],
+            select(literal(tag_id), Card.id).filter(Card.id > newest_card_id),
+        )
+        .on_conflict_do_nothing()
+    ).rowcount
+    if stats.cards_added == count:
+        return
+    # some of the phrases were already cards (or repeated across chunks)
+    stats.tag_cards_added += conn.execute(
+        sqlite_insert(TagCardGrouper)
+        .from_select(
+            [TagCardGrouper.tag_id, TagCardGrouper.card_id],
+            select(literal(tag_id), Card.id)
+            .filter(Card.phrase.in_(phrases))
+            .filter(Card.id <= newest_card_id),
+        )
+        .on_conflict_do_nothing()
+    ).rowcount
+
+
+def _read_into(chunks: queue.Queue, pack: int, stats: PackStats, chunk_size: int):
+    try:
+        for chunk in read_pack(stats.file_path, stats, chunk_size):
+            chunks.put([(pack, phrase) for phrase in chunk])
+        chunks.put(None)
+    except BaseException as err:
+        chunks.put(err)
+
+
+def load_packs(
+    packs: list[tuple[str, str]],
+    dry_run: bool = False,
+    sync: bool = False,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    progress: Callable[[str], None] = print,
+) -> list[PackStats]:
+    """Loads every (file path, tag name) pack in a single transaction, the files are read in
+    parallel and written by this thread as their chunks come in
+    with `sync` packs that haven't changed since they were last synced are skipped and phrases
+    that were taken out of a pack are taken out of its tag too
+    with `dry_run` everything is still done so the numbers are right but then rolled back"""
+    all_stats = [PackStats(os.path.normpath(path), tag_name) for path, tag_name in packs]
+    chunks: queue.Queue = queue.Queue(IMPORT_QUEUE_SIZE)
+    start = last_progress = time.perf_counter()
+    with engine.connect() as conn:
+        tag_ids = [tag_id_for(conn, tag_name) for _, tag_name in packs]
+        hashes: list[str] = []
+        if sync:
+            hashes = [pack_hash(stats.file_path) for stats in all_stats]
+            synced = {
+                (file_path, tag_id): content_hash
+                for file_path, tag_id, content_hash in conn.execute(
+                    select(PackHash.file_path, PackHash.tag_id, PackHash.content_hash)
+                )
+            }
+            for stats, tag_id, content_hash in zip(all_stats, tag_ids, hashes):
+                stats.unchanged = synced.get((stats.file_path, tag_id)) == content_hash
+        if all(stats.unchanged for stats in all_stats):
+            conn.rollback()
+            progress("every pack is already synced")
+            return all_stats
+        for table in (_staging, _added, _removed):
+            table.drop(conn, checkfirst=True)
+            table.create(conn)
+        readers = [
+            threading.Thread(target=_read_into, args=(chunks, pack, stats, chunk_size), daemon=True)
+            for pack, stats in enumerate(all_stats)
+            if not stats.unchanged
+        ]
+        for reader in readers:
+            reader.start()
+        readers_left = len(readers)
+        staged = 0
+        try:
+            while readers_left:
+                item = chunks.get()
+                if item is None:
+                    readers_left -= 1
+                    continue
+                if isinstance(item, BaseException):
+                    raise item
+                conn.exec_driver_sql(_stage_rows, item)
+                staged += len(item)
+                now = time.perf_counter()
+                if now - last_progress >= PROGRESS_EVERY_SECONDS:
+                    last_progress = now
+                    progress(f"{staged:,} phrases read, {staged / (now - start):,.0f} rows/s")
+            for pack, (stats, tag_id) in enumerate(zip(all_stats, tag_ids)):
+                if stats.unchanged:
+                    continue
+                if sync:
+                    added = diff_pack(conn, pack, tag_id)
+                    remove_missing(conn, tag_id, stats)
+                    add_phrases(conn, select(_added.c.phrase), tag_id, stats, added)
+                    conn.execute(delete(_added))
+                    conn.execute(delete(_removed))
+                    save_pack_hash(conn, stats.file_path, tag_id, hashes[pack])
+                else:
+                    phrases = select(_staging.c.phrase).filter(_staging.c.pack == pack)
+                    count = stats.lines - stats.blank_lines - stats.repeated_lines
+                    add_phrases(conn, phrases, tag_id, stats, count)
+                progress(f"{stats.file_path} added, {time.perf_counter() - start:.2f}s so far")
+            for table in (_staging, _added, _removed):
+                table.drop(conn)
+            if dry_run:
+                conn.rollback()
+            else:
+                # lets running servers know their card index is out of date
+                bump_cards_generation(conn)  # pyright: ignore
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            # readers blocked on a full queue would never finish otherwise
+            while any(reader.is_alive() for reader in readers):
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+    elapsed = time.perf_counter() - start
+    progress(f"{staged:,} phrases in {elapsed:.2f}s, {staged / max(elapsed, 1e-9):,.0f} rows/s")
+    if not dry_run:
+        invalidate_card_index()
+    return all_stats
@@ -0,0 +1,89 @@
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from models.config import DbSession
+from models.game import Card, Game, GameCard, GameCardKind, Selection
+
+# what loading a game for the board needs as plain rows, joining the selections onto the cards
+#    returned a row (and full objects) for every card and selection pair just to count them
+
+
+class GameRow(NamedTuple):
+    code: str
+    session_id: int
+    rowid: int
+    last_updated: datetime
+    version: int
+    next_game_code: str | None
+    """the game that was made after this one in the session"""
+
+
+# the card's index is `card_index` so it doesn't shadow tuple's own index()
+class BoardCard(NamedTuple):
+    card_index: int
+    game_card_id: int
+    card_id: int
+    phrase: str
+    kind: GameCardKind
+    is_guessed: bool | None
+
+
+class BoardSelection(NamedTuple):
+    token: str
+    card_index: int
+
+
+def game_row(db: DbSession, game_code: str) -> GameRow | None:
+    later = aliased(Game)
+    next_game_code = (
+        select(later.code)
+        .filter(later.code != Game.code)
+        .filter(later.session_id == Game.session_id)
+        .filter(later.rowid > Game.rowid)
+        .filter(later.is_claimed)
+        .limit(1)
+        .scalar_subquery()
+    )
+    row = db.execute(
+        select(
+            Game.code,
+            Game.session_id,
+            Game.rowid,
+            Game.last_updated,
+            Game.version,
+            next_game_code,
+        )
+        .filter(Game.code == game_code)
+        .filter(Game.is_claimed)
+    ).first()
+    return None if row is None else GameRow(*row)
+
+
+def board_cards(db: DbSession, game_code: str) -> list[BoardCard]:
+    rows = db.execute(
+        select(
+            GameCard.index,
+            GameCard.rowid,
+            GameCard.card_id,
+            Card.phrase,
+            GameCard.kind,
+            GameCard.is_guessed,
+        )
+        .join(Card, Card.id == GameCard.card_id)
+        .filter(GameCard.game_code == game_code)
+    )
+    return [BoardCard(*row) for row in rows]
+
+
+def board_selections(db: DbSession, game_code: str) -> list[BoardSelection]:
+    """Every token's selection, one row per person selecting rather than per card they share"""
+    rows = db.execute(
+        select(Selection.token, GameCard.index)
+        .join(
+            GameCard,
+            (GameCard.game_code == Selection.game_code) & (GameCard.card_id == Selection.card_id),
+        )
+        .filter(Selection.game_code == game_code)
+    )
+    return [BoardSelection(*row) for row in rows]
@@ -0,0 +1,164 @@
+import heapq
+import random
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+from typing import Callable, Container, Iterable, Iterator
+
+# how many random draws are tried per card before giving up on guessing and going through every
+#    card left (which only happens when most of the tags' cards have been used)
+DRAWS_PER_CARD = 20
+
+
+def _contains(cards: array, card_id: int) -> bool:
+    i = bisect_left(cards, card_id)
+    return i < len(cards) and cards[i] == card_id
+
+
+class CardIndex:
+    """Every card id under each tag kept in memory so drawing cards for a game costs about the
+    same no matter how big the packs get"""
+
+    def __init__(self, generation: int, tag_cards: Iterable[tuple[str, int]]):
+        self.generation = generation
+        unsorted: dict[str, list[int]] = {}
+        for tag_id, card_id in tag_cards:
+            unsorted.setdefault(str(tag_id), []).append(card_id)
+        # sorted so membership is a binary search without needing a set per tag
+        self.tag_cards = {tag_id: array("q", sorted(cards)) for tag_id, cards in unsorted.items()}
+        # counts worked out from this generation of cards, they go away along with the index
+        #    when the cards change so they never need to be invalidated one by one
+        self.tag_set_sizes: dict[frozenset[str], int] = {}
+        # session id -> how many cards its tags have that none of its games have used
+        self.sessions_cards_left: dict[int, int] = {}
+
+    def tag_size(self, tag_id: str) -> int:
+        return len(self.tag_cards.get(str(tag_id), ()))
+
+    def tag_set_size(self, tag_ids: Iterable[str]) -> int:
+        """How many different cards the tags have between them"""
+        key = frozenset(str(t) for t in tag_ids if str(t) in self.tag_cards)
+        size = self.tag_set_sizes.get(key)
+        if size is None:
+            # the arrays are sorted so a card in more than one tag comes out of the merge
+            #    next to itself
+            tags = [self.tag_cards[t] for t in key]
+            size = len(tags[0]) if len(tags) == 1 else sum(1 for _ in groupby(heapq.merge(*tags)))
+            self.tag_set_sizes[key] = size
+        return size
+
+    def in_any(self, tag_ids: Iterable[str], card_id: int) -> bool:
+        return any(
+            _contains(self.tag_cards[t], card_id)
+            for t in {str(t) for t in tag_ids}
+            if t in self.tag_cards
+        )
+
+    def sample(self, tag_ids: Iterable[str], exclude: Container[int], amount: int) -> list[int]:
+        """`amount` different card ids from the tags that aren't excluded, as many as there are
+        if there aren't enough"""
+        tags = [self.tag_cards[t] for t in {str(t) for t in tag_ids} if t in self.tag_cards]
+        total = sum(len(cards) for cards in tags)
+        chosen: list[int] = []
+        seen: set[int] = set()
+        for _ in range(amount * DRAWS_PER_CARD):
+            if len(chosen) == amount or total == 0:
+                break
+            position = random.randrange(total)
+            for cards in tags:
+                if position < len(cards):
+                    break
+                position -= len(cards)
+            card_id = cards[position]  # pyright: ignore
+            if card_id in exclude or card_id in seen:
+                continue
+            # a card in more than one of the tags is drawn that many times more often so it's
+            #    only kept that fraction of the time to keep every card equally likely
+            tag_count = sum(1 for other in tags if _contains(other, card_id))
+            if tag_count > 1 and random.randrange(tag_count) != 0:
+                continue
+            seen.add(card_id)
+            chosen.append(card_id)
+        if len(chosen) < amount:
+            left = {
+                card_id
+                for cards in tags
+                for card_id in cards
+                if card_id not in exclude and card_id not in seen
+            }
+            chosen.extend(random.sample(sorted(left), min(amount - len(chosen), len(left))))
+        return chosen
+
+
+class CardSet:
+    """Card ids as a bitmap, checking a card costs the same however many cards are in it"""
+
+    __slots__ = ("bits",)
+
+    def __init__(self, card_ids: Iterable[int] = ()):
+        self.bits = bytearray()
+        self.update(card_ids)
+
+    def __contains__(self, card_id: int) -> bool:
+        byte = card_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (card_id & 7)))
+
+    def __iter__(self) -> Iterator[int]:
+        for byte_index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_index << 3) | bit
+
+    def __len__(self) -> int:
+        return int.from_bytes(self.bits, "little").bit_count()
+
+    def add(self, card_id: int):
+        byte = card_id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (card_id & 7)
+
+    def update(self, card_ids: Iterable[int]):
+        for card_id in card_ids:
+            self.add(card_id)
+
+    def discard(self, card_id: int):
+        byte = card_id >> 3
+        if byte < len(self.bits):
+            self.bits[byte] &= ~(1 << (card_id & 7)) & 0xFF
+
+    # a session's cards are spread thin over every card id so the bitmap is mostly zeros and
+    #    compresses down to almost nothing
+    def to_blob(self) -> bytes:
+        return zlib.compress(self.bits)
+
+    @classmethod
+    def from_blob(cls, blob: bytes) -> "CardSet":
+        card_set = cls()
+        card_set.bits = bytearray(zlib.decompress(blob))
+        return card_set
+
+
+_card_index: CardIndex | None = None
+_card_index_lock = threading.Lock()
+
+
+def card_index(generation: int, load: Callable[[], Iterable[tuple[str, int]]]) -> CardIndex:
+    """The index for the current generation of cards, rebuilt with `load` when the cards have
+    changed since it was built"""
+    global _card_index
+    index = _card_index
+    if index is not None and index.generation == generation:
+        return index
+    with _card_index_lock:
+        if _card_index is None or _card_index.generation != generation:
+            _card_index = CardIndex(generation, load())
+        return _card_index
+
+
+def invalidate_card_index():
+    global _card_index
+    _card_index = None
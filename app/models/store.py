@@ -0,0 +1,485 @@
+import asyncio
+import logging
+import time
+from contextvars import Context
+from array import array
+from datetime import datetime
+from typing import Awaitable, Callable
+from sqlalchemy import update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.config import DbSession, run_db
+from models.bus import GameChange, bus
+from make_app import shutdown_hooks
+from metrics import Collected, Counter
+from models.game import CARDS_PER_GAME, Game, GameCardKind, GameCard, Selection
+from models.reads import BoardCard, BoardSelection, GameRow, board_cards, board_selections, game_row
+from models.events import EventLog, GameEvent, GameEventKind
+
+# a board is tiny and only changes a few dozen times a game so the server keeps the live games
+#    in memory and reads/changes those, the database is only written behind them
+KINDS = list(GameCardKind)
+_KIND_INDEXES = {kind: i for i, kind in enumerate(KINDS)}
+# games that haven't been touched in this long are dropped (they're reloaded if needed again)
+LIVE_GAME_IDLE_SECONDS = 30 * 60
+EVICT_EVERY_SECONDS = 60
+# a write that fails is tried again this many times (waiting twice as long each time) before
+#    it's given up on
+WRITE_ATTEMPTS = 5
+WRITE_RETRY_SECONDS = 0.1
+
+logger = logging.getLogger("codenames.store")
+
+
+class LiveGame:
+    """The state of one game's board, every per card field is indexed by the card's index"""
+
+    __slots__ = (
+        "code",
+        "session_id",
+        "rowid",
+        "last_updated",
+        "version",
+        "events",
+        "next_game_code",
+        "phrases",
+        "game_card_ids",
+        "card_ids",
+        "kinds",
+        "guessed",
+        "selection_counts",
+        "selections",
+        "last_used",
+    )
+
+    def __init__(
+        self, code: str, session_id: int, rowid: int, last_updated: datetime, version: int
+    ):
+        self.code = code
+        self.session_id = session_id
+        self.rowid = rowid
+        self.last_updated = last_updated
+        # goes up by one with every change so clients can say how far along they are
+        self.version = version
+        self.events = EventLog()
+        # the game that was made after this one in the session
+        self.next_game_code: str | None = None
+        self.phrases: list[str] = [""] * CARDS_PER_GAME
+        # rowids of the GameCards, these are what the page sends back
+        self.game_card_ids = array("q", [0] * CARDS_PER_GAME)
+        # ids of the Cards
+        self.card_ids = array("q", [0] * CARDS_PER_GAME)
+        self.kinds = bytearray(CARDS_PER_GAME)
+        self.guessed = bytearray(CARDS_PER_GAME)
+        self.selection_counts = array("H", [0] * CARDS_PER_GAME)
+        # site token -> index of the card they selected
+        self.selections: dict[str, int] = {}
+        self.last_used = time.monotonic()
+
+    def kind(self, index: int) -> GameCardKind:
+        return KINDS[self.kinds[index]]
+
+    def is_guessed(self, index: int) -> bool:
+        return bool(self.guessed[index])
+
+    def index_of(self, game_card_id: int) -> int:
+        return self.game_card_ids.index(game_card_id)
+
+    def kind_counts(self, kind: GameCardKind) -> tuple[int, int]:
+        """How many of the kind have been guessed and how many there are"""
+        kind_index = _KIND_INDEXES[kind]
+        guessed = total = 0
+        for k, is_guessed in zip(self.kinds, self.guessed):
+            if k == kind_index:
+                total += 1
+                guessed += is_guessed
+        return guessed, total
+
+    def record(self, kind: GameEventKind, index: int | None = None):
+        self.version += 1
+        self.last_updated = datetime.now()
+        self.events.append(GameEvent(self.version, kind, index))
+
+    def guess(self, index: int):
+        assert not self.guessed[index]
+        self.guessed[index] = 1
+        self.record(GameEventKind.GUESS, index)
+
+    def toggle_selection(self, token: str, index: int) -> bool:
+        """Selects the card for the token, if it was already their selection it is unselected
+        instead, returns if the card is now selected"""
+        current = self.selections.pop(token, None)
+        if current is not None:
+            self.selection_counts[current] -= 1
+        if current == index:
+            self.record(GameEventKind.UNSELECT, index)
+            return False
+        self.selections[token] = index
+        self.selection_counts[index] += 1
+        self.record(GameEventKind.SELECT, index)
+        return True
+
+    def set_next_game(self, game_code: str):
+        if self.next_game_code is not None:
+            return
+        self.next_game_code = game_code
+        self.record(GameEventKind.NEW_GAME)
+
+    @classmethod
+    def from_rows(
+        cls, game: GameRow, cards: list[BoardCard], selections: list[BoardSelection]
+    ) -> "LiveGame":
+        live_game = cls(game.code, game.session_id, game.rowid, game.last_updated, game.version)
+        live_game.next_game_code = game.next_game_code
+        for card in cards:
+            live_game.phrases[card.card_index] = card.phrase
+            live_game.game_card_ids[card.card_index] = card.game_card_id
+            live_game.card_ids[card.card_index] = card.card_id
+            live_game.kinds[card.card_index] = _KIND_INDEXES[card.kind]
+            live_game.guessed[card.card_index] = bool(card.is_guessed)
+        for token, index in selections:
+            live_game.selections[token] = index
+            live_game.selection_counts[index] += 1
+        return live_game
+
+
+def load_live_game(db: DbSession, game_code: str) -> LiveGame | None:
+    game = game_row(db, game_code)
+    if game is None:
+        return None
+    return LiveGame.from_rows(game, board_cards(db, game_code), board_selections(db, game_code))
+
+
+live_games: dict[str, LiveGame] = {}
+Collected("codenames_live_games", "Games in memory", lambda: len(live_games))
+Collected(
+    "codenames_live_sessions",
+    "Sessions with a game in memory",
+    lambda: len({live_game.session_id for live_game in live_games.values()}),
+)
+# cold loads in progress so a crowd opening the same game only loads it once
+_loading: dict[str, asyncio.Future[LiveGame | None]] = {}
+# game code -> changes other workers made while it was loading, the load may have read the game
+#    from before them
+_changes_while_loading: dict[str, list[GameChange]] = {}
+
+
+async def get_live_game(game_code: str) -> LiveGame | None:
+    _start_background_tasks()
+    live_game = live_games.get(game_code)
+    if live_game is None:
+        loading = _loading.get(game_code)
+        if loading is not None:
+            live_game = await asyncio.shield(loading)
+        else:
+            loading = asyncio.get_running_loop().create_future()
+            _loading[game_code] = loading
+            _changes_while_loading[game_code] = []
+            try:
+                live_game = await run_db(lambda db: load_live_game(db, game_code))
+                changes = _changes_while_loading.pop(game_code)
+                if live_game is not None:
+                    live_games[game_code] = live_game
+                    if not _catch_up(live_game, changes):
+                        await _reload_live_game(game_code, live_game.version)
+                        live_game = live_games.get(game_code)
+                loading.set_result(live_game)
+            except Exception as err:
+                loading.set_exception(err)
+                raise
+            finally:
+                del _loading[game_code]
+                _changes_while_loading.pop(game_code, None)
+        if live_game is None:
+            return None
+    live_game.last_used = time.monotonic()
+    return live_game
+
+
+# writes to the database happen in the order they were made on a single task, batched
+#    together into one transaction when they pile up
+_writes: asyncio.Queue[tuple[str, Callable[[DbSession], None]]] | None = None
+# game code -> writes still waiting, a game can't be dropped from memory until these are done
+_pending_writes: dict[str, int] = {}
+_background_tasks: set[asyncio.Task] = set()
+_loop: asyncio.AbstractEventLoop | None = None
+Collected(
+    "codenames_pending_writes",
+    "Changes waiting to be written to the database",
+    lambda: 0 if _writes is None else _writes.qsize(),
+)
+write_failures = Counter(
+    "codenames_write_failures_total",
+    "Writes behind the live games that failed, by whether they were tried again or given up on",
+    labels=("outcome",),
+)
+
+
+def persist(game_code: str, work: Callable[[DbSession], None]):
+    """Queues `work` to be written to the database behind the live game, it must not hold on to
+    the live game since it runs later"""
+    _start_background_tasks()
+    assert _writes is not None
+    _pending_writes[game_code] = _pending_writes.get(game_code, 0) + 1
+    _writes.put_nowait((game_code, work))
+
+
+def _apply_writes(db: DbSession, writes: list[Callable[[DbSession], None]]):
+    for work in writes:
+        work(db)
+    db.commit()
+
+
+async def _write(game_code: str, work: Callable[[DbSession], None]) -> bool:
+    """Writes one change on its own, trying again while it fails, False once it's given up on"""
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            await run_db(lambda db: _apply_writes(db, [work]))
+            return True
+        except Exception as err:
+            if attempt == WRITE_ATTEMPTS - 1:
+                write_failures.inc("dropped")
+                logger.error(
+                    f"Gave up writing a change to {game_code} after {WRITE_ATTEMPTS} tries",
+                    exc_info=err,
+                )
+                return False
+            write_failures.inc("retried")
+            logger.warning(f"Writing a change to {game_code} failed, trying again: {err!r}")
+            await asyncio.sleep(WRITE_RETRY_SECONDS * 2**attempt)
+    return False
+
+
+async def _write_behind():
+    assert _writes is not None
+    while True:
+        batch = [await _writes.get()]
+        while not _writes.empty():
+            batch.append(_writes.get_nowait())
+        try:
+            await run_db(lambda db: _apply_writes(db, [work for _, work in batch]))
+        except Exception as err:
+            write_failures.inc("retried")
+            logger.warning(f"Writing a batch of changes failed, trying them one by one: {err!r}")
+            # one bad write shouldn't take the rest of the batch down with it, the writes are
+            #    still made in order so a game's newer writes never land before its older ones
+            for game_code, work in batch:
+                if not await _write(game_code, work):
+                    # the game here has a change the database never got, it's made to match the
+                    #    database again once the writes before it are done
+                    task = asyncio.get_running_loop().create_task(
+                        _resync_live_game(game_code), context=Context()
+                    )
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+        for game_code, _ in batch:
+            _pending_writes[game_code] -= 1
+            if _pending_writes[game_code] == 0:
+                del _pending_writes[game_code]
+            _writes.task_done()
+
+
+def saved_version(live_game: LiveGame) -> Callable[[DbSession], None]:
+    game_code = live_game.code
+    version = live_game.version
+    last_updated = live_game.last_updated
+
+    def save_version(db: DbSession):
+        db.execute(
+            update(Game)
+            .where(Game.code == game_code)
+            .values(version=version, last_updated=last_updated)
+        )
+
+    return save_version
+
+
+def guess_card(live_game: LiveGame, index: int):
+    live_game.guess(index)
+    game_code = live_game.code
+    game_card_id = live_game.game_card_ids[index]
+    save_version = saved_version(live_game)
+    change = GameChange(game_code, live_game.version, GameEventKind.GUESS, index)
+
+    def save_guess(db: DbSession):
+        db.execute(update(GameCard).where(GameCard.rowid == game_card_id).values(is_guessed=True))
+        save_version(db)
+        bus.publish(db, change)
+
+    persist(game_code, save_guess)
+
+
+def toggle_selection(live_game: LiveGame, token: str, index: int) -> bool:
+    """Selects the card for the token (or unselects it if it was already their selection),
+    returns if the card is now selected"""
+    is_selected = live_game.toggle_selection(token, index)
+    game_code = live_game.code
+    card_id = live_game.card_ids[index]
+    save_version = saved_version(live_game)
+    kind = GameEventKind.SELECT if is_selected else GameEventKind.UNSELECT
+    change = GameChange(game_code, live_game.version, kind, index, token)
+
+    def save_selection(db: DbSession):
+        if is_selected:
+            db.execute(
+                sqlite_insert(Selection)
+                .values([{"token": token, "game_code": game_code, "card_id": card_id}])
+                .on_conflict_do_update(set_={Selection.card_id: card_id})
+            )
+        else:
+            db.execute(
+                delete(Selection)
+                .filter(Selection.token == token)
+                .filter(Selection.game_code == game_code)
+            )
+        save_version(db)
+        bus.publish(db, change)
+
+    persist(game_code, save_selection)
+    return is_selected
+
+
+def set_next_game(live_game: LiveGame, game_code: str):
+    if live_game.next_game_code is not None:
+        return
+    live_game.set_next_game(game_code)
+    save_version = saved_version(live_game)
+    change = GameChange(
+        live_game.code, live_game.version, GameEventKind.NEW_GAME, next_game_code=game_code
+    )
+
+    def save_next_game(db: DbSession):
+        save_version(db)
+        bus.publish(db, change)
+
+    persist(live_game.code, save_next_game)
+
+
+async def flush_writes():
+    """Waits for everything queued so far to be in the database"""
+    if _writes is not None and _loop is asyncio.get_running_loop():
+        await _writes.join()
+
+
+def _apply_change(live_game: LiveGame, change: GameChange) -> bool:
+    """Makes a change another worker made to the copy here, False when the copy wasn't at the
+    version right before it (both workers changed the game at once)"""
+    if change.version != live_game.version + 1:
+        return False
+    match change.kind:
+        case GameEventKind.GUESS:
+            assert change.index is not None
+            if live_game.guessed[change.index]:
+                return False
+            live_game.guess(change.index)
+        case GameEventKind.SELECT | GameEventKind.UNSELECT:
+            assert change.index is not None and change.token is not None
+            is_selected = live_game.toggle_selection(change.token, change.index)
+            if is_selected != (change.kind == GameEventKind.SELECT):
+                return False
+        case GameEventKind.NEW_GAME:
+            assert change.next_game_code is not None
+            live_game.set_next_game(change.next_game_code)
+    return live_game.version == change.version
+
+
+async def _reload_live_game(game_code: str, version: int):
+    """The copy here and another worker's went different ways, once everything from here is
+    written the database has both"""
+    await flush_writes()
+    live_game = await run_db(lambda db: load_live_game(db, game_code))
+    if live_game is None:
+        live_games.pop(game_code, None)
+        return
+    # past any version the sockets here have seen so they're all sent the whole game
+    live_game.version = max(version, live_game.version) + 1
+    live_games[game_code] = live_game
+
+
+# other modules hear about games another worker changed through these
+change_listeners: list[Callable[[str], None]] = []
+
+
+async def _resync_live_game(game_code: str):
+    live_game = live_games.get(game_code)
+    if live_game is None:
+        return
+    await _reload_live_game(game_code, live_game.version)
+    for listener in change_listeners:
+        listener(game_code)
+
+
+def _catch_up(live_game: LiveGame, changes: list[GameChange]) -> bool:
+    """Makes the changes that came in while the game was loading, False when they don't line up
+    with what was loaded"""
+    for change in changes:
+        # the change was written along with the version so the load already has it
+        if change.version <= live_game.version:
+            continue
+        if not _apply_change(live_game, change):
+            return False
+    return True
+
+
+async def apply_remote_changes(changes: list[GameChange]):
+    for change in changes:
+        live_game = live_games.get(change.game_code)
+        if live_game is None:
+            # made once the load is done in case the load read the game from before it
+            missed = _changes_while_loading.get(change.game_code)
+            if missed is not None:
+                missed.append(change)
+            # otherwise it's loaded with the change whenever it's needed here
+            continue
+        if not _apply_change(live_game, change):
+            await _reload_live_game(change.game_code, live_game.version)
+        for listener in change_listeners:
+            listener(change.game_code)
+
+
+# other modules say a game is still being used (like someone watching it) through these
+in_use_checks: list[Callable[[str], bool]] = []
+
+
+def evict_idle_games():
+    cutoff = time.monotonic() - LIVE_GAME_IDLE_SECONDS
+    for game_code, live_game in list(live_games.items()):
+        if live_game.last_used >= cutoff or game_code in _pending_writes:
+            continue
+        if any(is_in_use(game_code) for is_in_use in in_use_checks):
+            continue
+        del live_games[game_code]
+
+
+# other modules let go of their own idle things along with the games through these
+eviction_hooks: list[Callable[[], Awaitable[None]]] = []
+
+
+async def _evict_idle_games():
+    while True:
+        await asyncio.sleep(EVICT_EVERY_SECONDS)
+        evict_idle_games()
+        for hook in eviction_hooks:
+            try:
+                await hook()
+            except Exception:
+                logger.exception("Letting go of idle things failed")
+
+
+def _start_background_tasks():
+    global _writes, _loop
+    loop = asyncio.get_running_loop()
+    # the server runs on one loop the whole time but things like benchmarks can start the app
+    #    up more than once
+    if _loop is loop:
+        return
+    _loop = loop
+    _writes = asyncio.Queue()
+    _pending_writes.clear()
+    for work in (_write_behind, _evict_idle_games, lambda: bus.run(apply_remote_changes)):
+        # a context of their own so they aren't counted as part of the request that started them
+        task = loop.create_task(work(), context=Context())
+        _background_tasks.add(task)
+
+
+# anything still queued would be lost when the server stops
+shutdown_hooks.append(flush_writes)
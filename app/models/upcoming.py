@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from contextvars import Context
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import aliased
+from models.codes import allocate_game_code
+from models.config import DbSession, run_db
+from models.errors import CodeSpaceExhausted, NotEnoughCards
+from models.game import (
+    CARDS_PER_GAME,
+    Game,
+    GameCard,
+    Session,
+    current_card_index,
+    session_cards_left,
+)
+from models.sampler import CardSet
+from models.store import eviction_hooks
+
+# the next game of a session is made in the background while the current one is played so
+#    "Next Game" only has to claim it, until then it can't be found or played
+# an unclaimed game is let go (and its cards given back to the session) once none of the
+#    session's games have changed in this long
+UPCOMING_IDLE_SECONDS = 30 * 60
+
+logger = logging.getLogger("codenames.upcoming")
+
+# session id -> its lock and how many are holding or waiting on it, dropped once nobody is
+_session_locks: dict[int, tuple[asyncio.Lock, int]] = {}
+# sessions this worker already has a next game made (or being made) for and when, the database
+#    still decides this is just so every page load doesn't have to ask it
+# sessions without enough cards left for a next game stay in here too so refreshing the page
+#    doesn't try again every time
+# the game can be claimed on another worker (and cards can be loaded) so they're forgotten once
+#    they're this old
+_prepared: dict[int, float] = {}
+_prepare_tasks: set[asyncio.Task] = set()
+
+
+@asynccontextmanager
+async def making_next_game(session_id: int) -> AsyncIterator[None]:
+    """Held while the session's next game is made or claimed so two people hitting next game at
+    once end up in the same next game, other sessions never wait on it"""
+    lock, users = _session_locks.get(session_id, (asyncio.Lock(), 0))
+    _session_locks[session_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _session_locks[session_id]
+        if users == 1:
+            del _session_locks[session_id]
+        else:
+            _session_locks[session_id] = (lock, users - 1)
+
+
+def upcoming_game_code(db: DbSession, session_id: int) -> str | None:
+    return db.scalar(
+        select(Game.code).filter(Game.session_id == session_id).filter(~Game.is_claimed).limit(1)
+    )
+
+
+def claim_game(db: DbSession, game_code: str) -> bool:
+    """Makes the game the newest game of its session, the caller commits, False when the game
+    is gone (it was given back) or someone else claimed it first"""
+    result = db.execute(
+        update(Game)
+        .where(Game.code == game_code)
+        .where(~Game.is_claimed)
+        .values(is_claimed=True, last_updated=datetime.now())
+    )
+    return result.rowcount > 0
+
+
+def make_upcoming_game(db: DbSession, session_id: int) -> str | None:
+    """The code of the session's next game, made if there isn't one yet, None when the session
+    doesn't have enough cards left for another game (or there are no game codes left)"""
+    game_code = upcoming_game_code(db, session_id)
+    if game_code is not None:
+        return game_code
+    index = current_card_index(db)
+    if session_cards_left(db, session_id, index) < CARDS_PER_GAME:
+        return None
+    game_session = db.get(Session, session_id)
+    if game_session is None:
+        return None
+    try:
+        # this has to happen before the session starts writing
+        game_code = allocate_game_code()
+        return game_session.create_game(db, game_code, is_claimed=False, index=index).code
+    except (CodeSpaceExhausted, NotEnoughCards):
+        return None
+
+
+def release_upcoming_games(db: DbSession, idle_before: datetime) -> list[int]:
+    """Deletes the unclaimed games of sessions that haven't been played since `idle_before` and
+    gives their cards back to the sessions, returns the sessions"""
+    claimed = aliased(Game)
+    last_played = (
+        select(func.max(claimed.last_updated))
+        .filter(claimed.session_id == Game.session_id)
+        .filter(claimed.is_claimed)
+        .scalar_subquery()
+    )
+    games = db.execute(
+        select(Game.code, Game.session_id)
+        .filter(~Game.is_claimed)
+        .filter(last_played < idle_before)
+    ).all()
+    released = []
+    for game_code, session_id in games:
+        # deleted first to take the database's write lock, so the game can't be claimed and the
+        #    used cards can't be changed by anyone else until this is committed
+        deleted = db.execute(delete(Game).filter(Game.code == game_code).filter(~Game.is_claimed))
+        if deleted.rowcount == 0:
+            continue
+        released.append(session_id)
+        card_ids = db.scalars(
+            select(GameCard.card_id).filter(GameCard.game_code == game_code)
+        ).all()
+        db.execute(delete(GameCard).filter(GameCard.game_code == game_code))
+        used_cards = db.scalar(select(Session.used_cards).filter(Session.id == session_id))
+        if used_cards is not None:
+            used = CardSet.from_blob(used_cards)
+            for card_id in card_ids:
+                used.discard(card_id)
+            db.execute(
+                update(Session).where(Session.id == session_id).values(used_cards=used.to_blob())
+            )
+    db.commit()
+    # counted with the released cards gone, they're counted again when needed
+    index = current_card_index(db)
+    for session_id in released:
+        index.sessions_cards_left.pop(session_id, None)
+    return released
+
+
+def prepare_next_game(session_id: int):
+    """Starts making the session's next game in the background if it isn't already"""
+    if session_id in _prepared:
+        return
+    _prepared[session_id] = time.monotonic()
+    # not part of the request that started it
+    task = asyncio.get_running_loop().create_task(_prepare_next_game(session_id), context=Context())
+    _prepare_tasks.add(task)
+    task.add_done_callback(_prepare_tasks.discard)
+
+
+async def _prepare_next_game(session_id: int):
+    try:
+        async with making_next_game(session_id):
+            # None when there aren't enough cards left, kept as prepared so it isn't tried again
+            await run_db(lambda db: make_upcoming_game(db, session_id))
+    except Exception:
+        logger.exception(f"Making the next game of session {session_id} failed")
+        _prepared.pop(session_id, None)
+
+
+def claimed_next_game(session_id: int):
+    """The session's next game was claimed so the one after it can be made"""
+    _prepared.pop(session_id, None)
+
+
+async def release_idle_games():
+    idle_before = datetime.now() - timedelta(seconds=UPCOMING_IDLE_SECONDS)
+    # claiming a game checks it's still there so this doesn't need any session's lock
+    released = await run_db(lambda db: release_upcoming_games(db, idle_before))
+    for session_id in released:
+        _prepared.pop(session_id, None)
+    forget_before = time.monotonic() - UPCOMING_IDLE_SECONDS
+    for session_id, prepared in list(_prepared.items()):
+        if prepared < forget_before:
+            del _prepared[session_id]
+
+
+eviction_hooks.append(release_idle_games)
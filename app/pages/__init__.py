@@ -1,2 +1,3 @@
 from pages.play import *
 from pages.home import *
+from pages.prometheus import *
@@ -1,5 +1,10 @@
 from fasthtml.common import *
-from make_app import ASSETS_PATH, app
+import hashlib
+import threading
+from typing import Any, Callable, Hashable
+from starlette.responses import Response
+from make_app import app
+from bundle import asset_url
 
 
 def Settings(req: Request):
@@ -28,6 +33,61 @@ def Page(req: Request, title: str, *c):
     )
 
 
+@dataclass
+class CachedPage:
+    version: Hashable
+    body: bytes
+    headers: dict[str, str]
+    etag: str
+
+
+# everything that goes into a page besides its version, the canonical link and htmx's push url
+#    are the whole url and htmx requests get just the container
+def _page_key(req: Request) -> tuple:
+    return (
+        str(req.url),
+        "hx-request" in req.headers,
+        "hx-history-restore-request" in req.headers,
+    )
+
+
+# page key -> the newest version of the page rendered for it, the oldest are dropped past the size
+page_cache: dict[tuple, CachedPage] = {}
+PAGE_CACHE_SIZE = 2048
+# the sync routes change the cache from starlette's threadpool while the async ones change it
+#    from the event loop
+page_cache_lock = threading.Lock()
+# browsers keep the page but check it's still the newest before using it
+PAGE_CACHE_CONTROL = "no-cache"
+
+
+def cached_page(req: Request, version: Hashable, make: Callable[[], Any]) -> Response:
+    """The response `make` gives for the request, only made again when `version` changes (like
+    the game's version) and a 304 when the browser already has it"""
+    key = _page_key(req)
+    page = page_cache.get(key)
+    if page is None or page.version != version:
+        response = FtResponse(make()).__response__(req)
+        body = bytes(response.body)
+        # weak since the same page can go out gzipped or not
+        etag = f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        headers = dict(response.headers) | {"etag": etag, "cache-control": PAGE_CACHE_CONTROL}
+        page = CachedPage(version, body, headers, etag)
+        with page_cache_lock:
+            page_cache.pop(key, None)
+            page_cache[key] = page
+            while len(page_cache) > PAGE_CACHE_SIZE:
+                del page_cache[next(iter(page_cache))]
+    if page.etag in (tag.strip() for tag in req.headers.get("if-none-match", "").split(",")):
+        headers = {
+            name: value
+            for name, value in page.headers.items()
+            if name not in ("content-length", "content-type")
+        }
+        return Response(status_code=304, headers=headers)
+    return Response(page.body, headers=page.headers)
+
+
 class MessageKind(enum.Enum):
     INFO = 0
     SUCCESS = 1
@@ -37,13 +97,13 @@ class MessageKind(enum.Enum):
     def to_path(self) -> str:
         if self == MessageKind.INFO:
             # TODO CHANGE TO MAYBE A DIFFERENT ICON
-            return f"{ASSETS_PATH}/success.svg"
+            return asset_url("success.svg")
         if self == MessageKind.SUCCESS:
-            return f"{ASSETS_PATH}/success.svg"
+            return asset_url("success.svg")
         elif self == MessageKind.WARNING:
-            return f"{ASSETS_PATH}/warning.svg"
+            return asset_url("warning.svg")
         elif self == MessageKind.ERROR:
-            return f"{ASSETS_PATH}/error.svg"
+            return asset_url("error.svg")
         raise ValueError("Invalid message kind")
 
 
@@ -3,15 +3,21 @@ from sqlalchemy import func
 from models.game import *
 from starlette.requests import Request
 from make_app import app
-from pages.components import Page
+from budgets import query_budget
+from pages.components import Page, cached_page
 
 
+@query_budget(0)
 @app.get("/")
 def home(request: Request):
-    return Page(
+    return cached_page(
         request,
-        "Home",
-        A("Play", href=app.url_path_for("play")),
-        Br(),
-        A("Game Wiki", href="https://en.wikipedia.org/wiki/Codenames_(board_game)"),
+        None,
+        lambda: Page(
+            request,
+            "Home",
+            A("Play", href=app.url_path_for("play")),
+            Br(),
+            A("Game Wiki", href="https://en.wikipedia.org/wiki/Codenames_(board_game)"),
+        ),
     )
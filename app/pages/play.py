@@ -3,19 +3,55 @@ import asyncio
 from sqlalchemy import func, desc, exists
 from models.game import *
 from models.errors import *
+from models.config import DbSession, db_session, run_db
+from models.store import (
+    KINDS,
+    LiveGame,
+    live_games,
+    in_use_checks,
+    change_listeners,
+    eviction_hooks,
+    get_live_game,
+    guess_card,
+    toggle_selection,
+    set_next_game,
+)
+from models.events import GameEvent, GameEventKind, guessed_indexes
+from models.codes import allocate_game_code
+from models.upcoming import (
+    claim_game,
+    claimed_next_game,
+    making_next_game,
+    prepare_next_game,
+    upcoming_game_code,
+)
 from sqlalchemy.orm import joinedload
 from starlette.requests import Request
 from make_app import app, PARTIALS_PREFIX, SITE_TOKEN, IS_DARK_MODE_TOKEN
 from multipart.exceptions import MultipartParseError
-from pages.components import MessageKind, MessageStack, Page, Message
+from pages.components import MessageKind, MessageStack, Page, Message, cached_page
+from metrics import Counter, tracked_queries
+from budgets import declare_budget, query_budget
+from live.broadcaster import (
+    Frame,
+    Outbox,
+    broadcast,
+    is_watched,
+    subscribe,
+    unsubscribe,
+    unsubscribe_game,
+)
 from starlette.websockets import WebSocket, WebSocketDisconnect
 from datetime import datetime
-from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from enum import Enum
 from starlette.applications import Starlette
 from typing import Callable
 from dataclasses import dataclass, field
 import uuid
+import time
+import json
+from functools import lru_cache
+from html import escape
 
 
 SELECTION_TEXT = "\u261d"
@@ -54,44 +90,47 @@ board_css = f"""
 
 
 def CardBoard(
-    card: GameCard,
-    game: Game,
+    game: LiveGame,
+    index: int,
     is_update: bool = True,
     is_users_selection: bool = False,
 ):
+    game_card_id = game.game_card_ids[index]
+    is_guessed = game.is_guessed(index)
+    kind = game.kind(index)
     active_attributes = {
         "hx_post": app.url_path_for("select_card", game_code=game.code),
         "hx_swap": "none",
         "hx_trigger": "click",
-        "hx_vals": {"game_card_id": card.rowid},
+        "hx_vals": {"game_card_id": game_card_id},
     }
 
-    row, col = card.to_row_col()
-    card_class = card.kind.to_bs_class() if card.is_guessed else ""
+    row, col = to_row_col(index)
+    card_class = kind.to_bs_class() if is_guessed else ""
     return Div(
         # unselected-card matches the generated css for spy masters to have color
-        id=f"game-card-{card.rowid}",
+        id=f"game-card-{game_card_id}",
         hx_swap_oob="true" if is_update else None,
-        cls=f"rounded-3 position-relative border text-center unselected-card-{card.index} {card_class} p-3 {"text-decoration-underline" if is_users_selection else ""}",
-        style=f"grid-area: {row} / {col} / {row} / {col}; {"" if card.is_guessed else "cursor: pointer"}",
-        **({} if card.is_guessed else active_attributes),
+        cls=f"rounded-3 position-relative border text-center unselected-card-{index} {card_class} p-3 {'text-decoration-underline' if is_users_selection else ''}",
+        style=f"grid-area: {row} / {col} / {row} / {col}; {'' if is_guessed else 'cursor: pointer'}",
+        **({} if is_guessed else active_attributes),
     )(
-        Div(cls=f"{"text-decoration-line-through" if card.is_guessed else ""}")(
-            card.card_phrase.title(),
+        Div(cls=f"{'text-decoration-line-through' if is_guessed else ''}")(
+            game.phrases[index].title(),
             Span(
-                "🙊" if card.kind == GameCardKind.BLACK else "🐵",
+                "🙊" if kind == GameCardKind.BLACK else "🐵",
                 cls=f"text-bg-light position-absolute translate-middle badge rounded-pill",
                 style="top: 10%; left: 90%;",
             )
-            if card.is_guessed
+            if is_guessed
             else None,
         )
     )
 
 
-def GameBoard(game: Game, is_update: bool = True):
+def GameBoard(game: LiveGame, is_update: bool = True):
     return Div(cls="board", id="gameBoard", hx_swap_oob="true" if is_update else None)(
-        *[CardBoard(game_card, game, is_update) for game_card in game.cards],
+        *[CardBoard(game, index, is_update) for index in range(CARDS_PER_GAME)],
         None if is_update else Selections(game, is_update),
     )
 
@@ -110,26 +149,18 @@ def ConfirmButton(game_code: str, game_card_id: int | None = None, is_update: bo
     )
 
 
-def NextGameButton(game: Game, enabled: bool = True, is_update: bool = True):
-    more_recent_game = session.scalar(
-        select(Game)
-        .filter(Game.code != game.code)
-        .filter(Game.session_id == game.session_id)
-        .filter(Game.rowid > game.rowid)
-        .limit(1)
-    )
+def NextGameButton(game: LiveGame, enabled: bool = True, is_update: bool = True):
+    more_recent_game_code = game.next_game_code
     # no need to return anything if there is not a new game
-    if not more_recent_game and is_update:
+    if not more_recent_game_code and is_update:
         return None
-    if more_recent_game:
-        print(more_recent_game.code)
     return Button(
-        "Next Game" if more_recent_game else "Make Game",
+        "Next Game" if more_recent_game_code else "Make Game",
         id="next_game",
         cls="btn btn-success",
-        hx_post=app.url_path_for("continue_game") if not more_recent_game else None,
-        hx_get=app.url_path_for("play_game", game_code=more_recent_game.code)
-        if more_recent_game
+        hx_post=app.url_path_for("continue_game") if not more_recent_game_code else None,
+        hx_get=app.url_path_for("play_game", game_code=more_recent_game_code)
+        if more_recent_game_code
         else None,
         hx_swap="none",
         hx_swap_oob="true" if is_update else None,
@@ -139,26 +170,26 @@ def NextGameButton(game: Game, enabled: bool = True, is_update: bool = True):
     )
 
 
-def UserSelectedStyle(game_card: GameCard | None, is_update: bool = True):
+def UserSelectedStyle(game_card_id: int | None, is_update: bool = True):
     style = Style(id="userSelectedStyle", hx_swap_oob="true" if is_update else None)
-    if game_card is None:
+    if game_card_id is None:
         return style
-    return style(f"#game-card-{game_card.rowid} {{ text-decoration: underline; }}")
+    return style(f"#game-card-{game_card_id} {{ text-decoration: underline; }}")
 
 
-def Selections(game: Game, is_update: bool = True):
+def Selections(game: LiveGame, is_update: bool = True):
     selection_containers = []
-    for card in game.cards:
-        if card.is_guessed:
+    for index in range(CARDS_PER_GAME):
+        if game.is_guessed(index):
             continue
-        selection_count = len(card.selections)
+        selection_count = game.selection_counts[index]
         if selection_count == 0:
             continue
         if selection_count > MAX_SELECTION_COUNT:
             selection_pill_text = f"{SELECTION_TEXT} X {selection_count}"
         else:
             selection_pill_text = SELECTION_TEXT * selection_count
-        row, col = card.to_row_col()
+        row, col = to_row_col(index)
         selection_containers.append(
             Div(
                 cls="position-relative",
@@ -176,9 +207,7 @@ def Selections(game: Game, is_update: bool = True):
     )(*selection_containers)
 
 
-@app.get("/play")
-def play(request: Request):
-    tags = session.scalars(select(Tag)).all()
+def PlayPage(request: Request, tags: list[TagAvailability]):
     return Page(
         request,
         "Play",
@@ -201,12 +230,14 @@ def play(request: Request):
                 *[
                     (
                         Input(
-                            name=f"tag-{tag.rowid}",
-                            value=tag.rowid,
+                            name=f"tag-{tag.id}",
+                            value=tag.id,
                             cls="card-tag form-check-input me-2",
                             type="checkbox",
                         ),
-                        Label(tag.name, cls="me-3"),
+                        Label(cls="me-3")(
+                            tag.name, Span(f"{tag.cards:,}", cls="badge text-bg-secondary ms-1")
+                        ),
                     )
                     for tag in tags
                 ],
@@ -232,169 +263,251 @@ def play(request: Request):
     )
 
 
+# the same for everyone until the tags or their cards change
+@query_budget(3)
+@app.get("/play")
+def play(request: Request):
+    with db_session() as db:
+        tags = tag_availability(db)
+    return cached_page(request, tuple(tags), lambda: PlayPage(request, tags))
+
+
 @dataclass
 class MakeGameData:
     tags: list[str] = field(default_factory=list)
 
 
+# the tags picked for a new session don't have enough cards or a session ran out of them
+not_enough_cards = Counter(
+    "codenames_not_enough_cards_total",
+    "Games that couldn't be made for lack of cards",
+    labels=("scope",),
+)
+
+
+def not_enough_tag_cards(needed_cards: int, cards_left: int):
+    not_enough_cards.inc("tags")
+    return Message(
+        Div(
+            f"You need {needed_cards} cards to play a game but those tags only add up to {cards_left} cards."
+        ),
+        kind=MessageKind.ERROR,
+    )
+
+
+def not_enough_session_cards(needed_cards: int, cards_left: int):
+    not_enough_cards.inc("session")
+    return Message(
+        Div(
+            f"There's only {cards_left} cards left to play within this session and you need {needed_cards} to play a game!"
+        ),
+        kind=MessageKind.ERROR,
+    )
+
+
+# every code of GAME_CODE_SIZE letters was handed out, it has to be made longer
+out_of_codes = Counter(
+    "codenames_out_of_game_codes_total", "Games that couldn't be made for lack of game codes"
+)
+
+
+def out_of_game_codes():
+    out_of_codes.inc()
+    return Message(
+        Div("No more games can be made right now, every game code has been used"),
+        kind=MessageKind.ERROR,
+    )
+
+
+# the new session and its first game, along with a new block of game codes and the card index
+#    when this worker doesn't have them yet
+@query_budget(15)
 @app.post("/play")
 def make_game(game_data: MakeGameData):
     if len(game_data.tags) == 0:
         return Message(Div(f"Please select some categories for the game"), kind=MessageKind.ERROR)
 
-    # case to make a new session
-    game_session = Session()
-    session.add(game_session)
-    # need to generate that id
-    session.flush()
-    groupers = [
-        SessionTagGrouper(session_id=game_session.id, tag_id=tag_id) for tag_id in game_data.tags
-    ]
-    session.add_all(groupers)
-    session.flush()
-
-    try:
-        game = game_session.create_game()
-    except NotEnoughCards as err:
-        session.rollback()
-        # this was the first session that was being made which means
-        #   the tags cards was not enough to fill a single game
-        return Message(
-            Div(
-                f"You need {err.needed_cards} cards to play a game but those tags only add up to {err.cards_left} cards."
-            ),
-            kind=MessageKind.ERROR,
-        )
-    session.commit()
-    return HttpHeader("HX-Redirect", app.url_path_for("play_game", game_code=game.code))
+    with db_session() as db:
+        # the cards the tags have between them are counted in memory so a game that couldn't
+        #    be filled is turned down before anything is made
+        index = current_card_index(db)
+        cards_available = index.tag_set_size(game_data.tags)
+        if cards_available < CARDS_PER_GAME:
+            return not_enough_tag_cards(CARDS_PER_GAME, cards_available)
+        # this has to happen before this thread's session starts writing
+        try:
+            game_code = allocate_game_code()
+        except CodeSpaceExhausted:
+            return out_of_game_codes()
+        # case to make a new session
+        game_session = Session()
+        db.add(game_session)
+        # need to generate that id
+        db.flush()
+        groupers = [
+            SessionTagGrouper(session_id=game_session.id, tag_id=tag_id)
+            for tag_id in game_data.tags
+        ]
+        db.add_all(groupers)
+        db.flush()
+
+        try:
+            game = game_session.create_game(db, game_code, index=index)
+        except NotEnoughCards as err:
+            db.rollback()
+            # this was the first session that was being made which means
+            #   the tags cards was not enough to fill a single game
+            return not_enough_tag_cards(err.needed_cards, err.cards_left)
+        db.commit()
+        return HttpHeader("HX-Redirect", app.url_path_for("play_game", game_code=game.code))
 
 
 # this is the same route for make_game and continue only difference
 #    is the wording of the button for the user
+# making the next game in the request when the one made in the background isn't there, along
+#    with a new block of game codes and the card index when this worker doesn't have them yet
+@query_budget(19)
 @app.post("/continue_game")
 async def continue_game(game_code: str, session_id: int):
-    # Current idea is to require one of the past game codes be sent with
-    #    this request
-    # Since I do not want to make people log in this seems like a relatively
-    #    secure option because as now people may just hit this url with a any session_id
-    # If this is not the most recent game of the session then instead of making it would
-    #    make sense to just redirect to the newest game
-    game = session.scalar(
-        select(Game)
-        .options(joinedload(Game.session))
-        .filter(Game.session_id == session_id)
-        .filter(Game.code == game_code)
-    )
-    if game is None:
-        return Message(Div("The game session no longer exists"), kind=MessageKind.ERROR)
-    most_recent_game_code = session.scalar(
-        select(Game.code).filter(Game.session_id == session_id).order_by(desc(Game.rowid)).limit(1)
-    )
-    assert most_recent_game_code is not None
-
-    if most_recent_game_code != game.code:
-        return HttpHeader(
-            "HX-Redirect", app.url_path_for("play_game", game_code=most_recent_game_code)
+    def next_game(db: DbSession):
+        # Current idea is to require one of the past game codes be sent with
+        #    this request
+        # Since I do not want to make people log in this seems like a relatively
+        #    secure option because as now people may just hit this url with a any session_id
+        # If this is not the most recent game of the session then instead of making it would
+        #    make sense to just redirect to the newest game
+        game = db.scalar(
+            select(Game)
+            .options(joinedload(Game.session))
+            .filter(Game.session_id == session_id)
+            .filter(Game.code == game_code)
+            .filter(Game.is_claimed)
         )
-    # update this to make sure to push the updated new game button
-    game.last_updated = datetime.now()
-    game_session = game.session
-
-    try:
-        game = game_session.create_game()
-    except NotEnoughCards as err:
-        session.rollback()
-        return Message(
-            Div(
-                f"There's only {err.cards_left} cards left to play within this session and you need {err.needed_cards} to play a game!"
-            ),
-            kind=MessageKind.ERROR,
+        if game is None:
+            return None, Message(Div("The game session no longer exists"), kind=MessageKind.ERROR)
+        most_recent_game_code = db.scalar(
+            select(Game.code)
+            .filter(Game.session_id == session_id)
+            .filter(Game.is_claimed)
+            .order_by(desc(Game.rowid))
+            .limit(1)
         )
-    session.commit()
-    await update_game()
-    return HttpHeader("HX-Redirect", app.url_path_for("play_game", game_code=game.code))
+        assert most_recent_game_code is not None
+
+        if most_recent_game_code != game.code:
+            return None, HttpHeader(
+                "HX-Redirect", app.url_path_for("play_game", game_code=most_recent_game_code)
+            )
+        # usually the next game was made in the background while this one was played
+        upcoming_code = upcoming_game_code(db, session_id)
+        if upcoming_code is not None and claim_game(db, upcoming_code):
+            # update this to make sure to push the updated new game button
+            game.last_updated = datetime.now()
+            db.commit()
+            return upcoming_code, None
+        # known without drawing any cards once the session has been counted
+        index = current_card_index(db)
+        cards_left = session_cards_left(db, session_id, index)
+        if cards_left < CARDS_PER_GAME:
+            return None, not_enough_session_cards(CARDS_PER_GAME, cards_left)
+        # this has to happen before the session starts writing
+        try:
+            next_game_code = allocate_game_code()
+        except CodeSpaceExhausted:
+            return None, out_of_game_codes()
+        game.last_updated = datetime.now()
+        game_session = game.session
+
+        try:
+            game = game_session.create_game(db, next_game_code, index=index)
+        except NotEnoughCards as err:
+            db.rollback()
+            return None, not_enough_session_cards(err.needed_cards, err.cards_left)
+        db.commit()
+        return game.code, None
+
+    # two people hitting next game at once should end up in the same next game
+    async with making_next_game(session_id):
+        next_game_code, response = await run_db(next_game)
+    if next_game_code is None:
+        return response
+    claimed_next_game(session_id)
+    # loaded even if no one here is watching it so the other workers hear about the next game
+    game = await get_live_game(game_code)
+    if game is not None:
+        set_next_game(game, next_game_code)
+    # only the game being continued from needs to learn about the next game
+    update_game(game_code)
+    return HttpHeader("HX-Redirect", app.url_path_for("play_game", game_code=next_game_code))
 
 
 # done as a separate route to play_game for error handling and later possible spymaster locking
+@query_budget(1)
 @app.post(f"{PARTIALS_PREFIX}/find_game")
 def find_game(game_code: str):
-    game = session.scalar(select(Game).filter(Game.code == game_code.upper()))
+    with db_session() as db:
+        game = db.scalar(
+            select(Game).filter(Game.code == game_code.upper()).filter(Game.is_claimed)
+        )
     if game is None:
         return Message(Div(f"The game `{game_code}` could not be found"), kind=MessageKind.ERROR)
 
     return HttpHeader("HX-Redirect", app.url_path_for("play_game", game_code=game.code))
 
 
-@app.get("/play/{game_code:str}")
-def play_game(request: Request, role: str | None = None):
-    game_code = request.path_params["game_code"]
-    game = session.scalar(
-        select(Game)
-        .filter(Game.code == game_code)
-        .options(joinedload(Game.cards).joinedload(GameCard.selections))
-    )
-    if game is None:
-        return HttpHeader("HX-Redirect", app.url_path_for("play"))
-    # have them choose a role so they don't accidently hit wrong buttons
-    if role is None:
-        return Page(
-            request,
-            "Play (Picking Role)",
-            Form(
-                cls="container",
-                hx_get=app.url_path_for("play_game", game_code=game_code),
-            )(
-                Select(id="role", name="role", cls="form-select mb-2")(
-                    Option(GameRole.SPYMASTER.value.title(), value=repr(GameRole.SPYMASTER)),
-                    Option(GameRole.OPERATIVE.value.title(), value=repr(GameRole.OPERATIVE)),
-                    Option(GameRole.VIEWER.value.title(), value=repr(GameRole.VIEWER)),
-                ),
-                Button("Select Role", cls="btn btn-primary", type="input"),
+def RolePicker(request: Request, game_code: str):
+    return Page(
+        request,
+        "Play (Picking Role)",
+        Form(
+            cls="container",
+            hx_get=app.url_path_for("play_game", game_code=game_code),
+        )(
+            Select(id="role", name="role", cls="form-select mb-2")(
+                Option(GameRole.SPYMASTER.value.title(), value=repr(GameRole.SPYMASTER)),
+                Option(GameRole.OPERATIVE.value.title(), value=repr(GameRole.OPERATIVE)),
+                Option(GameRole.VIEWER.value.title(), value=repr(GameRole.VIEWER)),
             ),
-        )
-    red_guessed = len([c for c in game.cards if c.kind == GameCardKind.RED and c.is_guessed])
-    red = len([c for c in game.cards if c.kind == GameCardKind.RED])
-    blue_guessed = len([c for c in game.cards if c.kind == GameCardKind.BLUE and c.is_guessed])
-    blue = len([c for c in game.cards if c.kind == GameCardKind.BLUE])
-    black_guessed = len([c for c in game.cards if c.kind == GameCardKind.BLACK and c.is_guessed])
-    black = len([c for c in game.cards if c.kind == GameCardKind.BLACK])
-    tan_guessed = len([c for c in game.cards if c.kind == GameCardKind.TAN and c.is_guessed])
-    tan = len([c for c in game.cards if c.kind == GameCardKind.TAN])
+            Button("Select Role", cls="btn btn-primary", type="input"),
+        ),
+    )
+
+
+def GamePage(request: Request, game: LiveGame, role: str):
     return Page(
         request,
         "Play",
         # there might be a better way to apply these styles for the spymasters
         Style(board_css),
-        Style(
-            "\n".join(
-                [
-                    f".unselected-card-{card.index} {{ {card.kind.to_styles()}; }}"
-                    for card in game.cards
-                ]
-            )
-        )
-        if role == repr(GameRole.SPYMASTER)
-        else None,
+        Style(spymaster_styles(bytes(game.kinds))) if role == repr(GameRole.SPYMASTER) else None,
         UserSelectedStyle(None, is_update=False),
-        Div(hx_ext="ws", ws_connect=app.url_path_for("play_connect", game_code=game_code)),
-        H2(f"Game Code: {game_code}"),
+        Div(hx_ext="ws", ws_connect=app.url_path_for("play_connect", game_code=game.code))(
+            # every time the socket (re)connects tell the server which version this page is at
+            #    so it only sends what was missed
+            Script(
+                "me().on('htmx:wsOpen', (e) => e.detail.socketWrapper.send("
+                "JSON.stringify({version: Number(qs('#gameVersion').dataset.version)})))"
+            )
+        ),
+        GameVersion(game, is_update=False),
+        H2(f"Game Code: {game.code}"),
         GameBoard(game, is_update=False),
         Div(
             Span(cls="pe-3")(
                 "Red:",
-                Span(id=repr(GameCardKind.RED))(f"{red_guessed}/{red}"),
+                KindCount(game, GameCardKind.RED, is_update=False),
             ),
             Span(cls="pe-3")(
                 "Blue:",
-                Span(id=repr(GameCardKind.BLUE))(f"{blue_guessed}/{blue}"),
+                KindCount(game, GameCardKind.BLUE, is_update=False),
             ),
             Span(cls="pe-3")(
                 "Black:",
-                Span(id=repr(GameCardKind.BLACK))(f"{black_guessed}/{black}"),
+                KindCount(game, GameCardKind.BLACK, is_update=False),
             ),
             Span(cls="pe-3")(
                 "Tan:",
-                Span(id=repr(GameCardKind.TAN))(f"{tan_guessed}/{tan}"),
+                KindCount(game, GameCardKind.TAN, is_update=False),
             ),
         ),
         NextGameButton(game, is_update=False)
@@ -407,140 +520,370 @@ def play_game(request: Request, role: str | None = None):
     )
 
 
-# everything is an oob swap to make it easier to maybe do web connections later for
-#   updating the game state
-# could implement caching on each game
-async def updated_game(game_code: str, last_updated: str | None):
-    last_updated_date = datetime.fromisoformat(last_updated) if last_updated else None
-    # could maybe do a smaller query since a lot requests are expected to not change
-    game = session.scalar(
-        select(Game)
-        .filter(Game.code == game_code)
-        .options(joinedload(Game.cards).joinedload(GameCard.selections))
-    )
+# loading the game if it isn't in memory
+@query_budget(3)
+@app.get("/play/{game_code:str}")
+async def play_game(request: Request, role: str | None = None):
+    game_code = request.path_params["game_code"]
+    game = await get_live_game(game_code)
     if game is None:
         return HttpHeader("HX-Redirect", app.url_path_for("play"))
+    if game.next_game_code is None:
+        prepare_next_game(game.session_id)
+    # have them choose a role so they don't accidently hit wrong buttons
+    if role is None:
+        return cached_page(request, None, lambda: RolePicker(request, game_code))
+    # everyone with the same role sees the same page until the game changes
+    return cached_page(request, game.version, lambda: GamePage(request, game, role))
+
+
+# a board's kinds never change so every spymaster of the game gets the same styles
+@lru_cache(maxsize=1024)
+def spymaster_styles(kinds: bytes) -> str:
+    return "\n".join(
+        [
+            f".unselected-card-{index} {{ {KINDS[kind].to_styles()}; }}"
+            for index, kind in enumerate(kinds)
+        ]
+    )
+
+
+def KindCount(game: LiveGame, kind: GameCardKind, is_update: bool = True):
+    guessed, total = game.kind_counts(kind)
+    return Span(id=repr(kind), hx_swap_oob="true" if is_update else None)(f"{guessed}/{total}")
 
-    # only update if out of sync
-    if game.last_updated == last_updated_date:
-        return
 
-    red_guessed = len([c for c in game.cards if c.kind == GameCardKind.RED and c.is_guessed])
-    red = len([c for c in game.cards if c.kind == GameCardKind.RED])
-    blue_guessed = len([c for c in game.cards if c.kind == GameCardKind.BLUE and c.is_guessed])
-    blue = len([c for c in game.cards if c.kind == GameCardKind.BLUE])
-    black_guessed = len([c for c in game.cards if c.kind == GameCardKind.BLACK and c.is_guessed])
-    black = len([c for c in game.cards if c.kind == GameCardKind.BLACK])
-    tan_guessed = len([c for c in game.cards if c.kind == GameCardKind.TAN and c.is_guessed])
-    tan = len([c for c in game.cards if c.kind == GameCardKind.TAN])
+def GameVersion(game: LiveGame, is_update: bool = True):
+    return Div(
+        id="gameVersion",
+        # a string so a new game's 0 is still written out, fasthtml leaves out falsy attributes
+        data_version=str(game.version),
+        hidden=True,
+        hx_swap_oob="true" if is_update else None,
+    )
+
+
+# everything is an oob swap to make it easier to maybe do web connections later for
+#   updating the game state
+def updated_game(game: LiveGame, events: list[GameEvent] | None = None):
+    """What brings a client up to date with the game, only the parts the events touched or
+    everything if there are no events to go off of"""
+    if events is None:
+        return (
+            *[CardBoard(game, index) for index in range(CARDS_PER_GAME) if game.is_guessed(index)],
+            *[KindCount(game, kind) for kind in GameCardKind],
+            NextGameButton(game),
+            Selections(game),
+            GameVersion(game),
+        )
+    guessed = guessed_indexes(events)
+    guessed_kinds = {game.kind(index) for index in guessed}
+    has_new_game = any(event.kind == GameEventKind.NEW_GAME for event in events)
+    # guessed cards don't show their selections anymore
+    selections_changed = any(
+        event.kind in (GameEventKind.SELECT, GameEventKind.UNSELECT) for event in events
+    ) or any(game.selection_counts[index] for index in guessed)
     return (
-        *[CardBoard(c, game) for c in game.cards if c.is_guessed],
-        Span(id=repr(GameCardKind.RED), hx_swap_oob="true")(f"{red_guessed}/{red}"),
-        Span(id=repr(GameCardKind.BLUE), hx_swap_oob="true")(f"{blue_guessed}/{blue}"),
-        Span(id=repr(GameCardKind.BLACK), hx_swap_oob="true")(f"{black_guessed}/{black}"),
-        Span(id=repr(GameCardKind.TAN), hx_swap_oob="true")(f"{tan_guessed}/{tan}"),
-        NextGameButton(game),
-        Selections(game),
+        *[CardBoard(game, index) for index in guessed],
+        *[KindCount(game, kind) for kind in GameCardKind if kind in guessed_kinds],
+        NextGameButton(game) if has_new_game else None,
+        Selections(game) if selections_changed else None,
+        GameVersion(game),
     )
 
 
+# the same markup `to_xml` makes out of the components above when they're updates, filled in
+#    straight from the live game without building any FT trees
+# anything changed in those components has to be changed here too, `bench/render.py` checks the
+#    two still come out exactly the same
+FAST_RENDER = True
+_CARD_BADGE = "text-bg-light position-absolute translate-middle badge rounded-pill"
+_SELECTION_PILL = "text-bg-light border position-absolute translate-middle badge rounded-pill z-3"
+
+
 @dataclass
-class WebSocketPlayerData:
-    websocket: WebSocket
-    game_code: str
-    last_updated: str | None = None  # isoformatted
+class BoardTemplates:
+    """The parts of a game's updates that can't change once the game is made"""
+
+    # index -> the whole card once it's been guessed
+    guessed_cards: list[str | None]
+    # index -> the start of the card's selection pill
+    selection_starts: list[str]
+    next_game_button: str | None = None
+
+
+def board_templates(game: LiveGame) -> BoardTemplates:
+    templates = _board_templates.get(game.code)
+    if templates is None:
+        selection_starts = []
+        for index in range(CARDS_PER_GAME):
+            row, col = to_row_col(index)
+            selection_starts.append(
+                f'  <div class="position-relative" style="grid-area: {row} / {col} / {row} / '
+                f'{col}; pointer-events: none;">\n<span class="{_SELECTION_PILL}" '
+                'style="top: 10%; left: 10%;">'
+            )
+        templates = BoardTemplates([None] * CARDS_PER_GAME, selection_starts)
+        _board_templates[game.code] = templates
+    return templates
+
+
+def fast_card_board(game: LiveGame, templates: BoardTemplates, index: int) -> str:
+    """`CardBoard` for a guessed card"""
+    card = templates.guessed_cards[index]
+    if card is None:
+        row, col = to_row_col(index)
+        kind = game.kind(index)
+        card = (
+            f'<div hx-swap-oob="true" id="game-card-{game.game_card_ids[index]}" '
+            'class="rounded-3 position-relative border text-center '
+            f'unselected-card-{index} {kind.to_bs_class()} p-3 " '
+            f'style="grid-area: {row} / {col} / {row} / {col}; ">\n'
+            '  <div class="text-decoration-line-through">\n'
+            f"{escape(game.phrases[index].title())}"
+            f'<span class="{_CARD_BADGE}" style="top: 10%; left: 90%;">'
+            f"{'🙊' if kind == GameCardKind.BLACK else '🐵'}</span>  </div>\n</div>\n"
+        )
+        templates.guessed_cards[index] = card
+    return card
 
 
-players: dict[str, WebSocketPlayerData] = {}
+def fast_kind_count(game: LiveGame, kind: GameCardKind) -> str:
+    guessed, total = game.kind_counts(kind)
+    return f'<span hx-swap-oob="true" id="{repr(kind)}">{guessed}/{total}</span>'
 
 
-async def update_game():
-    for uuid, player in dict(players).items():
-        try:
-            game = session.scalar(select(Game).where(Game.code == player.game_code))
-            if game is None:
-                del players[uuid]
-                continue
-            fhtml_game = await updated_game(player.game_code, player.last_updated)
-            if fhtml_game is None:
-                # case where game shouldn't be updated
-                print("skipping send")
-                continue
-            await player.websocket.send_text(to_xml(fhtml_game))
-            player.last_updated = str(game.last_updated)
-        except Exception as err:
-            print(err)
-            del players[uuid]
+def fast_next_game_button(game: LiveGame, templates: BoardTemplates) -> str:
+    """`NextGameButton` once there's a next game, which can't change after that"""
+    if game.next_game_code is None:
+        return ""
+    if templates.next_game_button is None:
+        url = app.url_path_for("play_game", game_code=game.next_game_code)
+        vals = json.dumps({"session_id": game.session_id, "game_code": game.code})
+        templates.next_game_button = (
+            f'<button hx-get="{url}" hx-swap="none" hx-swap-oob="true" hx-vals=\'{vals}\' '
+            'id="next_game" class="btn btn-success" name="next_game">Next Game</button>'
+        )
+    return templates.next_game_button
+
+
+def fast_selections(game: LiveGame, templates: BoardTemplates) -> str:
+    pills = []
+    for index in range(CARDS_PER_GAME):
+        selection_count = game.selection_counts[index]
+        if game.guessed[index] or selection_count == 0:
+            continue
+        if selection_count > MAX_SELECTION_COUNT:
+            selection_pill_text = f"{SELECTION_TEXT} X {selection_count}"
+        else:
+            selection_pill_text = SELECTION_TEXT * selection_count
+        pills.append(f"{templates.selection_starts[index]}{selection_pill_text}</span>  </div>\n")
+    start = '<div hx-swap-oob="true" id="selections" style="display: contents">'
+    if not pills:
+        return f"{start}</div>\n"
+    return f"{start}\n{''.join(pills)}</div>\n"
+
+
+def fast_game_version(game: LiveGame) -> str:
+    return f'<div data-version="{game.version}" hidden hx-swap-oob="true" id="gameVersion"></div>\n'
+
+
+def fast_updated_game(game: LiveGame, events: list[GameEvent] | None = None) -> str:
+    """`to_xml(updated_game(game, events))` without the FT trees"""
+    templates = board_templates(game)
+    if events is None:
+        return "".join(
+            [
+                *[
+                    fast_card_board(game, templates, index)
+                    for index in range(CARDS_PER_GAME)
+                    if game.guessed[index]
+                ],
+                *[fast_kind_count(game, kind) for kind in GameCardKind],
+                fast_next_game_button(game, templates),
+                fast_selections(game, templates),
+                fast_game_version(game),
+            ]
+        )
+    guessed = guessed_indexes(events)
+    guessed_kinds = {game.kind(index) for index in guessed}
+    has_new_game = any(event.kind == GameEventKind.NEW_GAME for event in events)
+    selections_changed = any(
+        event.kind in (GameEventKind.SELECT, GameEventKind.UNSELECT) for event in events
+    ) or any(game.selection_counts[index] for index in guessed)
+    return "".join(
+        [
+            *[fast_card_board(game, templates, index) for index in guessed],
+            *[fast_kind_count(game, kind) for kind in GameCardKind if kind in guessed_kinds],
+            fast_next_game_button(game, templates) if has_new_game else "",
+            fast_selections(game, templates) if selections_changed else "",
+            fast_game_version(game),
+        ]
+    )
+
+
+def render_updated_game(game: LiveGame, events: list[GameEvent] | None = None) -> str:
+    if FAST_RENDER:
+        return fast_updated_game(game, events)
+    return to_xml(updated_game(game, events))
+
+
+@dataclass
+class RenderedUpdates:
+    version: int
+    # version the client is at -> what brings it up to `version` (None is the whole game)
+    frames: dict[int | None, Frame] = field(default_factory=dict)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+# everyone watching a game is sent the exact same updates so each only needs to be rendered
+#    (and serialized) once per change of the game no matter how many are watching
+# only the newest version of each game is kept, a change to the game replaces it
+rendered_updates: dict[str, RenderedUpdates] = {}
+# game code -> its templates, dropped along with its rendered updates
+_board_templates: dict[str, BoardTemplates] = {}
+RENDERED_UPDATE_IDLE_SECONDS = 10 * 60
+
+
+async def evict_idle_updates():
+    cutoff = time.monotonic() - RENDERED_UPDATE_IDLE_SECONDS
+    for game_code, updates in list(rendered_updates.items()):
+        if updates.last_used < cutoff or not is_watched(game_code):
+            del rendered_updates[game_code]
+            _board_templates.pop(game_code, None)
+
+
+# swept along with the idle games rather than on every broadcast so a change to one game never
+#    costs anything for the other games on the server
+eviction_hooks.append(evict_idle_updates)
+
+
+def rendered_update(game_code: str, since: int | None) -> Frame | None:
+    """The frame that brings a client at the version `since` up to the newest version"""
+    game = live_games.get(game_code)
+    if game is None:
+        return None
+    updates = rendered_updates.get(game_code)
+    if updates is None or updates.version != game.version:
+        updates = RenderedUpdates(version=game.version)
+        rendered_updates[game_code] = updates
+    updates.last_used = time.monotonic()
+    frame = updates.frames.get(since)
+    if frame is not None:
+        return frame
+    if since == game.version:
+        return Frame(since=since, version=game.version, text="")
+    events = None if since is None else game.events.since(since, game.version)
+    if events is None:
+        # the whole game applies no matter what version the client is at
+        whole_game = updates.frames.get(None)
+        if whole_game is None:
+            whole_game = Frame(since=None, version=game.version, text=render_updated_game(game))
+            updates.frames[None] = whole_game
+        return Frame(since=since, version=game.version, text=whole_game.text)
+    frame = Frame(since=since, version=game.version, text=render_updated_game(game, events))
+    updates.frames[since] = frame
+    return frame
+
+
+# games with a broadcast already scheduled, any more changes before it runs ride along with it
+pending_updates: set[str] = set()
+# the event loop only keeps weak references to tasks
+_update_tasks: set[asyncio.Task] = set()
+# games being watched stay in memory
+in_use_checks.append(is_watched)
+
+
+def update_game(game_code: str):
+    """Schedules sending the newest state of the game to everyone watching it, returns
+    right away so the request that changed the game isn't held up by anyone's connection"""
+    if not is_watched(game_code) or game_code in pending_updates:
+        return
+    pending_updates.add(game_code)
+    task = asyncio.get_running_loop().create_task(_update_game(game_code))
+    _update_tasks.add(task)
+    task.add_done_callback(_update_tasks.discard)
+
+
+# loading the game if it was dropped from memory, rendering never needs the database
+declare_budget("broadcast", 3)
+
+
+async def _update_game(game_code: str):
+    pending_updates.discard(game_code)
+    if not is_watched(game_code):
+        return
+    with tracked_queries("broadcast"):
+        game = await get_live_game(game_code)
+        if game is None:
+            unsubscribe_game(game_code)
+            return
+        broadcast(game_code)
+
+
+# a change made on another worker goes out to the sockets here the same way
+change_listeners.append(update_game)
+
+
+# loading the game if it isn't in memory
+declare_budget("play_connect", 3)
 
 
 class PlayConnect(WebSocketEndpoint):
-    encoding = "http"
+    encoding = "json"
 
     async def on_connect(self, websocket: WebSocket):
         await websocket.accept()
-        game_code = websocket.path_params["game_code"]
+        self.game_code = websocket.path_params["game_code"]
         self.uuid = str(uuid.uuid4())
-        players[self.uuid] = WebSocketPlayerData(websocket=websocket, game_code=game_code)
+        self.outbox = None
+        with tracked_queries("play_connect"):
+            live_game = await get_live_game(self.game_code)
+        if live_game is None:
+            await websocket.close()
+            return
+        game_code = self.game_code
+        self.outbox = Outbox(
+            self.uuid, websocket, game_code, lambda since: rendered_update(game_code, since)
+        )
+        subscribe(self.outbox)
+
+    async def on_receive(self, websocket: WebSocket, data):
+        # the page sends the version it has whenever the socket (re)connects
+        version = data.get("version") if isinstance(data, dict) else None
+        if self.outbox is not None:
+            self.outbox.sync(version if isinstance(version, int) else None)
 
     async def on_disconnect(self, websocket: WebSocket, close_code: int):
-        del players[self.uuid]
+        unsubscribe(self.uuid, self.game_code)
 
 
 app.add_websocket_route("/play-connect/{game_code:str}", PlayConnect, name="play_connect")
 
 
+# the changes are written behind the live game, only loading it touches the database
+@query_budget(3)
 @app.post(f"{PARTIALS_PREFIX}/guess_card/{{game_code:str}}")
 async def guess(request: Request, game_card_id: int):
-    game_card = GameCard.get(game_card_id)
-    game = game_card.game
-    assert not game_card.is_guessed
     game_code = request.path_params["game_code"]
-    assert game.code == game_code
-    game_card.is_guessed = True
-    game.last_updated = datetime.now()
-    session.commit()
-    await update_game()
+    game = await get_live_game(game_code)
+    assert game is not None
+    guess_card(game, game.index_of(game_card_id))
+    update_game(game_code)
     return UserSelectedStyle(None), ConfirmButton(game_code, None)
 
 
+# same as guessing
+@query_budget(3)
 @app.post(f"{PARTIALS_PREFIX}/select_card/{{game_code:str}}")
 async def select_card(request: Request, game_card_id: int):
     game_code = request.path_params["game_code"]
-    # i think there's a better sqlalchemy api for this query
-    game = session.scalar(select(Game).filter(Game.code == game_code))
-    game_exists = game is not None
-    assert game_exists
+    game = await get_live_game(game_code)
+    assert game is not None
     token = request.session.get(SITE_TOKEN)
     assert token is not None
-    card = GameCard.get(game_card_id)
-    assert card is not None
-    game.last_updated = datetime.now()
-    session.commit()
-    current_selection = session.scalar(
-        select(Selection).filter(Selection.token == token).filter(Selection.game_code == game_code)
-    )
-    if current_selection is not None and current_selection.card_phrase == card.card_phrase:
-        # they reselected the same card so unselect it
-        session.delete(current_selection)
-        session.commit()
-        await update_game()
+    is_selected = toggle_selection(game, token, game.index_of(game_card_id))
+    update_game(game_code)
+    if not is_selected:
         return UserSelectedStyle(None), ConfirmButton(game_code, None)
-    new_selection = {
-        "token": token,
-        "game_code": game_code,
-        "card_phrase": card.card_phrase,
-    }
-    update_selection = (
-        sqlite_insert(Selection)
-        .values([new_selection])
-        .on_conflict_do_update(
-            set_={
-                Selection.card_phrase: card.card_phrase,
-                Selection.game_code: game_code,
-            }
-        )
-    )
-    session.execute(update_selection)
-    session.commit()
-    await update_game()
-    return UserSelectedStyle(card), ConfirmButton(game_code, game_card_id)
+    return UserSelectedStyle(game_card_id), ConfirmButton(game_code, game_card_id)
@@ -0,0 +1,15 @@
+from starlette.requests import Request
+from starlette.responses import Response
+from make_app import app
+from budgets import query_budget
+from metrics import CONTENT_TYPE, can_see_metrics, render_metrics
+
+
+@query_budget(0)
+@app.get("/metrics")
+def metrics(request: Request):
+    # nothing but the scraper needs to know this is here
+    host = request.client.host if request.client else None
+    if not can_see_metrics(host, request.headers.get("authorization")):
+        return Response(status_code=404)
+    return Response(render_metrics(), media_type=CONTENT_TYPE)